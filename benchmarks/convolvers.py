@@ -0,0 +1,86 @@
+"""Compare latency and throughput of the convolution engines.
+
+Run with `python benchmarks/convolvers.py`. Filters are random, with lengths
+corresponding to the HRIR and BRIR paths of the default configuration at
+48kHz; the latency of all engines is one block.
+"""
+import argparse
+import time
+import numpy as np
+from nga_binaural.fft import fft_backends, get_fft_backend
+from nga_binaural.matrix_convolver import convolver_types
+
+sample_rate = 48000
+
+# (name, number of virtual loudspeakers, filter length in samples)
+filter_sets = [
+    ("hrir", 47, 256),
+    ("brir", 13, 3000),
+    ("brir_long", 13, 24000),
+]
+
+
+def time_convolver(convolver, block_size, n_in, n_blocks, dtype):
+    """Get the processing time of each of n_blocks calls to filter_block."""
+    input_samples = np.random.RandomState(0).randn(block_size,
+                                                   n_in).astype(dtype)
+    times = np.zeros(n_blocks)
+    for i in range(n_blocks):
+        start = time.perf_counter()
+        convolver.filter_block(input_samples)
+        times[i] = time.perf_counter() - start
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--block-sizes",
+                        type=int,
+                        nargs="+",
+                        default=[64, 128, 256, 512])
+    parser.add_argument("--convolvers",
+                        nargs="+",
+                        default=sorted(convolver_types))
+    parser.add_argument("--fft-backends",
+                        nargs="+",
+                        default=["numpy"],
+                        choices=sorted(fft_backends))
+    parser.add_argument("--fft-threads", type=int, default=1)
+    parser.add_argument("--dtypes",
+                        nargs="+",
+                        default=["float64"],
+                        choices=["float32", "float64"])
+    parser.add_argument("--seconds",
+                        type=float,
+                        default=2.0,
+                        help="length of audio to process per measurement")
+    args = parser.parse_args()
+
+    print("{:10} {:11} {:7} {:7} {:>6} {:>12} {:>12} {:>12} {:>8}".format(
+        "filters", "convolver", "fft", "dtype", "block", "latency/ms",
+        "mean/us", "max/us", "rtf"))
+
+    for name, n_in, length in filter_sets:
+        filters = [(in_ch, out_ch, np.random.randn(length))
+                   for in_ch in range(n_in) for out_ch in range(2)]
+        for block_size in args.block_sizes:
+            n_blocks = int(args.seconds * sample_rate / block_size)
+            for convolver_name in args.convolvers:
+                for fft_name in args.fft_backends:
+                    for dtype in args.dtypes:
+                        fft = get_fft_backend(fft_name, args.fft_threads)
+                        convolver = convolver_types[convolver_name](
+                            block_size, n_in, 2, filters, fft=fft, dtype=dtype)
+                        times = time_convolver(convolver, block_size, n_in,
+                                               n_blocks, dtype)
+
+                        print("{:10} {:11} {:7} {:7} {:6d} {:12.2f} {:12.1f} "
+                              "{:12.1f} {:8.4f}".format(
+                                  name, convolver_name, fft_name, dtype,
+                                  block_size, block_size / sample_rate * 1e3,
+                                  np.mean(times) * 1e6,
+                                  np.max(times) * 1e6,
+                                  np.sum(times) / args.seconds))
+
+if __name__ == "__main__":
+    main()
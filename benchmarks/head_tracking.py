@@ -0,0 +1,111 @@
+"""Measure the cost of head tracking (the `head_tracking` binaural output
+option) compared to rendering a block.
+
+Run with `python benchmarks/head_tracking.py`. A scene with objects, a
+DirectSpeakers bed and an HOA stream is rendered with BinauralStreamRenderer
+without head tracking, with head tracking and a fixed orientation, and with
+the orientation changing every `--update-interval` blocks. The mean time per
+block, and the extra time per orientation set, are reported. Changes are
+much cheaper with `--panning-table-resolution`, and can be limited with
+`--head-tracking-interval` (so that not every orientation set is applied).
+"""
+import argparse
+import time
+import numpy as np
+from nga_binaural.renderer import BinauralStreamRenderer
+from scene import scene_items
+
+
+def time_blocks(renderer, input_block, n_blocks, update_interval):
+    times = np.zeros(n_blocks)
+    n_updates = 0
+    for i in range(n_blocks):
+        start = time.perf_counter()
+        if update_interval and i % update_interval == 0:
+            renderer.set_head_orientation(3.0 * i, 10.0 * np.sin(0.1 * i),
+                                          0.0)
+            n_updates += 1
+        renderer.process(input_block)
+        times[i] = time.perf_counter() - start
+    # ignore the first blocks, which include warming up caches
+    return np.mean(times[10:]), n_updates / float(n_blocks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--block-size", type=int, default=512)
+    parser.add_argument("--sample-rate", type=int, default=48000)
+    parser.add_argument("--objects", type=int, default=4)
+    parser.add_argument("--bed", default="4+5+0")
+    parser.add_argument("--hoa-order", type=int, default=2)
+    parser.add_argument("--update-interval",
+                        type=int,
+                        nargs="+",
+                        default=[8, 1])
+    parser.add_argument("--virtual-layout",
+                        default="4+7+0",
+                        help="BS.2051 layout for the HRIR path")
+    parser.add_argument("--hrir-file")
+    parser.add_argument("--panning-table-resolution",
+                        type=float,
+                        help="resolution of the point source panning tables "
+                        "in degrees; by default they are not used")
+    parser.add_argument("--head-tracking-interval",
+                        type=int,
+                        default=1,
+                        help="minimum number of blocks between orientation "
+                        "changes")
+    parser.add_argument("--seconds", type=float, default=5.0)
+    args = parser.parse_args()
+
+    _, n_tracks = scene_items(args.seconds,
+                              objects=args.objects,
+                              bed=args.bed,
+                              hoa_order=args.hoa_order)
+    n_blocks = max(int(args.seconds * args.sample_rate / args.block_size), 20)
+    input_block = np.random.RandomState(0).randn(args.block_size,
+                                                 n_tracks) * 0.1
+
+    def make_renderer(head_tracking):
+        binaural_output_opts = dict(
+            head_tracking=head_tracking,
+            head_tracking_interval=args.head_tracking_interval)
+        if args.hrir_file is not None:
+            binaural_output_opts["hrir_file"] = args.hrir_file
+        if args.panning_table_resolution is not None:
+            binaural_output_opts["panning_table_resolution"] = (
+                args.panning_table_resolution)
+        renderer = BinauralStreamRenderer(
+            args.virtual_layout,
+            args.sample_rate,
+            block_size=args.block_size,
+            binaural_output_opts=binaural_output_opts)
+        renderer.set_rendering_items(scene_items(args.seconds,
+                                                 objects=args.objects,
+                                                 bed=args.bed,
+                                                 hoa_order=args.hoa_order)[0])
+        return renderer
+
+    print("{:>24} {:>12} {:>16}".format("case", "ms / block",
+                                        "ms / change"))
+    base_time, _ = time_blocks(make_renderer(False), input_block, n_blocks, 0)
+    print("{:>24} {:12.3f} {:>16}".format("no head tracking",
+                                          base_time * 1e3, "-"))
+
+    static_time, _ = time_blocks(make_renderer(True), input_block, n_blocks,
+                                 0)
+    print("{:>24} {:12.3f} {:>16}".format("fixed orientation",
+                                          static_time * 1e3, "-"))
+
+    for update_interval in args.update_interval:
+        block_time, updates_per_block = time_blocks(make_renderer(True),
+                                                    input_block, n_blocks,
+                                                    update_interval)
+        print("{:>24} {:12.3f} {:16.3f}".format(
+            "change every {} blocks".format(update_interval),
+            block_time * 1e3,
+            (block_time - static_time) / updates_per_block * 1e3))
+
+
+if __name__ == "__main__":
+    main()
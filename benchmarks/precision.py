@@ -0,0 +1,84 @@
+"""Report the accuracy of rendering with float32 convolution.
+
+Run with `python benchmarks/precision.py`. The test input file is rendered
+with dtype float64 and float32, and the difference is reported relative to the
+peak level and to the quantisation step of 16 and 24 bit output.
+
+With the default HRIR file, the float32 rendering is also compared with the
+peak-normalized float64 reference file used by the integration test.
+"""
+import argparse
+import os.path
+import numpy as np
+from ear.fileio import openBw64
+from nga_binaural import cmdline
+
+test_data_dir = os.path.join(os.path.dirname(__file__), "..", "nga_binaural",
+                             "test", "data")
+input_file = os.path.join(test_data_dir, "test-input.wav")
+expected_file = os.path.join(test_data_dir, "test-expected-normalized.wav")
+
+
+def render(args, output_file, peak_normalization, **binaural_output_opts):
+    driver = cmdline.make_driver(args)
+    driver.config["binaural_output_opts"].update(binaural_output_opts)
+
+    cmdline._run(driver, input_file, output_file, peak_normalization)
+
+    with openBw64(output_file) as f:
+        return f.read(len(f))
+
+
+def db(x):
+    return 20.0 * np.log10(x) if x > 0 else float("-inf")
+
+
+def report(name, samples, reference):
+    error = np.max(np.abs(samples - reference))
+    peak = np.max(np.abs(reference))
+    print("{:24} max error {:10.3g} ({:7.1f} dB re peak, {:8.3g} LSB at "
+          "16 bit, {:8.3g} LSB at 24 bit)".format(name, error,
+                                                  db(error / peak),
+                                                  error * 2**15,
+                                                  error * 2**23))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--hrir-file")
+    parser.add_argument("--convolver", default="vectorized")
+    parser.add_argument("--fft-backend", default="numpy")
+    parser.add_argument("--tmp-dir", default=".")
+    cmdline.add_commands_for_offline_driver(parser)
+    cmdline.add_filter_cache_commands(parser)
+    args = parser.parse_args()
+
+    opts = dict(convolver=args.convolver, fft_backend=args.fft_backend)
+    if args.hrir_file is not None:
+        opts["hrir_file"] = args.hrir_file
+
+    def tmp_file(name):
+        return os.path.join(args.tmp_dir, name)
+
+    # the input file is 32 bit, so the output is too
+    double = render(args, tmp_file("precision_float64.wav"), False, **opts)
+    single = render(args,
+                    tmp_file("precision_float32.wav"),
+                    False,
+                    dtype="float32",
+                    **opts)
+    report("float32 vs float64", single, double)
+
+    if args.hrir_file is None:
+        with openBw64(expected_file) as f:
+            expected = f.read(len(f))
+        single_normalized = render(args,
+                                   tmp_file("precision_float32_pn.wav"),
+                                   True,
+                                   dtype="float32",
+                                   **opts)
+        report("float32 vs reference", single_normalized, expected)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Synthetic scenes for the benchmarks.
+
+These are rendering items as produced from an ADM file by
+OfflineRenderDriver.get_rendering_items, so that no ADM file needs to be
+written or parsed: a DirectSpeakers bed, moving objects and an HOA stream, on
+consecutive tracks.
+"""
+from fractions import Fraction
+import numpy as np
+from ear.core import bs2051
+from ear.core.metadata_input import (ADMPath, DirectSpeakersRenderingItem,
+                                     DirectSpeakersTypeMetadata,
+                                     DirectTrackSpec, ExtraData,
+                                     HOARenderingItem, HOATypeMetadata,
+                                     MetadataSourceIter, ObjectRenderingItem,
+                                     ObjectTypeMetadata)
+from ear.fileio.adm.elements import (
+    AudioBlockFormatDirectSpeakers, AudioBlockFormatObjects,
+    AudioChannelFormat, BoundCoordinate, DirectSpeakerPolarPosition,
+    Frequency, ObjectPolarPosition, TypeDefinition)
+
+
+def bed_items(layout_name):
+    """DirectSpeakers rendering items for the channels of a BS.2051 layout,
+    on the first tracks."""
+    items = []
+    for track, channel in enumerate(bs2051.get_layout(layout_name).channels):
+        position = DirectSpeakerPolarPosition(
+            bounded_azimuth=BoundCoordinate(channel.polar_position.azimuth),
+            bounded_elevation=BoundCoordinate(
+                channel.polar_position.elevation),
+        )
+        block_format = AudioBlockFormatDirectSpeakers(
+            position=position, speakerLabel=[channel.name])
+        frequency = Frequency(lowPass=120.0) if channel.is_lfe else Frequency()
+        metadata = DirectSpeakersTypeMetadata(
+            block_format=block_format,
+            extra_data=ExtraData(channel_frequency=frequency))
+        items.append(
+            DirectSpeakersRenderingItem(
+                track_spec=DirectTrackSpec(track),
+                metadata_source=MetadataSourceIter([metadata])))
+    return items
+
+
+def object_items(n_objects, first_track, duration, block_duration=0.1):
+    """Object rendering items moving around the listener, with a block every
+    block_duration seconds."""
+    items = []
+    n_blocks = int(np.ceil(duration / block_duration))
+    rtimes = [Fraction(i * block_duration).limit_denominator(1000)
+              for i in range(n_blocks + 1)]
+    for i in range(n_objects):
+        block_formats = [
+            AudioBlockFormatObjects(
+                rtime=start,
+                duration=end - start,
+                position=ObjectPolarPosition(
+                    azimuth=(360.0 * i / n_objects + 30.0 * float(start)) %
+                    360.0 - 180.0,
+                    elevation=15.0 * (i % 3),
+                    distance=1.0)) for start, end in zip(rtimes, rtimes[1:])
+        ]
+        channel_format = AudioChannelFormat(
+            audioChannelFormatName="object {}".format(i),
+            type=TypeDefinition.Objects,
+            audioBlockFormats=block_formats)
+        items.append(
+            ObjectRenderingItem(
+                track_spec=DirectTrackSpec(first_track + i),
+                metadata_source=MetadataSourceIter([
+                    ObjectTypeMetadata(block_format=block_format)
+                    for block_format in block_formats
+                ]),
+                adm_path=ADMPath(audioChannelFormat=channel_format)))
+    return items
+
+
+def hoa_items(order, first_track):
+    """An HOA rendering item of the given order (N3D, ACN channel order), on
+    (order + 1) ** 2 tracks starting at first_track."""
+    orders, degrees = zip(*[(n, m) for n in range(order + 1)
+                            for m in range(-n, n + 1)])
+    metadata = HOATypeMetadata(orders=list(orders),
+                               degrees=list(degrees),
+                               normalization="N3D")
+    return [
+        HOARenderingItem(
+            track_specs=[
+                DirectTrackSpec(first_track + i) for i in range(len(orders))
+            ],
+            metadata_source=MetadataSourceIter([metadata]))
+    ]
+
+
+def scene_items(duration, objects=0, bed=None, hoa_order=0):
+    """Rendering items for a scene.
+
+    Parameters:
+        duration (float): length of the scene in seconds
+        objects (int): number of moving objects
+        bed (str or None): BS.2051 layout of a DirectSpeakers bed
+        hoa_order (int): order of an HOA stream, or 0 for none
+
+    Returns:
+        list of RenderingItem: items for the bed, then the objects, then the
+            HOA stream, on consecutive tracks from 0
+        int: number of tracks
+    """
+    items = bed_items(bed) if bed is not None else []
+    n_tracks = len(items)
+
+    items += object_items(objects, n_tracks, duration)
+    n_tracks += objects
+
+    if hoa_order:
+        items += hoa_items(hoa_order, n_tracks)
+        n_tracks += (hoa_order + 1)**2
+
+    return items, n_tracks
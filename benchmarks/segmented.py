@@ -0,0 +1,77 @@
+"""Compare rendering one file in segments on several processes with rendering
+it sequentially.
+
+Run with `python benchmarks/segmented.py input.wav`. The file is rendered
+sequentially, then in segments with each number of jobs; the time taken and
+the largest difference to the sequential output are reported. The time for
+segmented rendering includes creating a renderer in each worker, so a long
+input is needed to see the benefit.
+"""
+import argparse
+import os.path
+import time
+from functools import partial
+import numpy as np
+from ear.fileio import openBw64
+from nga_binaural import cmdline, segmented
+
+test_data_dir = os.path.join(os.path.dirname(__file__), "..", "nga_binaural",
+                             "test", "data")
+
+
+def render(driver, input_file, output_file):
+    start = time.perf_counter()
+    cmdline._run(driver, input_file, output_file, False)
+    duration = time.perf_counter() - start
+
+    with openBw64(output_file) as f:
+        return f.read(len(f)), duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("input_file",
+                        nargs="?",
+                        default=os.path.join(test_data_dir, "test-input.wav"))
+    parser.add_argument("--jobs", type=int, nargs="+", default=[2, 4])
+    parser.add_argument("--segment-duration", type=float)
+    parser.add_argument("--hrir-file")
+    parser.add_argument("--tmp-dir", default=".")
+    cmdline.add_commands_for_offline_driver(parser)
+    cmdline.add_filter_cache_commands(parser)
+    args = parser.parse_args()
+
+    driver = cmdline.make_driver(args)
+    if args.hrir_file is not None:
+        driver.config["binaural_output_opts"]["hrir_file"] = args.hrir_file
+
+    with openBw64(args.input_file) as f:
+        input_duration = len(f) / f.sampleRate
+
+    reference, duration = render(
+        driver, args.input_file,
+        os.path.join(args.tmp_dir, "segmented_reference.wav"))
+    print("{:>12} {:>10} {:>8} {:>12}".format("jobs", "time / s", "rtf",
+                                              "max error"))
+    print("{:>12} {:10.2f} {:8.3f} {:>12}".format("sequential", duration,
+                                                  duration / input_duration,
+                                                  "-"))
+
+    for jobs in args.jobs:
+        driver.render_input_file = partial(
+            segmented.render_input_file_segmented,
+            input_file=args.input_file,
+            jobs=jobs,
+            segment_duration=args.segment_duration,
+            tmp_dir=args.tmp_dir)
+        output, duration = render(
+            driver, args.input_file,
+            os.path.join(args.tmp_dir, "segmented_{}.wav".format(jobs)))
+        assert output.shape == reference.shape
+        print("{:12} {:10.2f} {:8.3f} {:12.3g}".format(
+            jobs, duration, duration / input_duration,
+            np.max(np.abs(output - reference))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Measure the time taken to set up a renderer.
+
+Run with `python benchmarks/startup.py`. Each step is timed in a new process,
+so that the layout registry, filter banks and FFT plans are not shared with
+previous steps; the times include importing nga_binaural.
+"""
+import argparse
+import subprocess
+import sys
+
+steps = {
+    "import":
+    "import nga_binaural.renderer",
+    "layout":
+    "from nga_binaural import sofa\n"
+    "sofa.get_binaural_layout(('binaural', 'BRIR'))",
+    "layouts x10":
+    "from nga_binaural import sofa\n"
+    "for i in range(10):\n"
+    "    sofa.get_binaural_layout(('binaural', 'BRIR'))",
+    "virtual layouts":
+    "from nga_binaural.binaural_wrapper import get_virtual_layouts\n"
+    "get_virtual_layouts(None, ('binaural', 'all_defined'), "
+    "('binaural', 'BRIR'))",
+    "renderer":
+    "from nga_binaural.binaural_layout import BinauralOutput\n"
+    "from nga_binaural.renderer import BinauralRenderer\n"
+    "BinauralRenderer(BinauralOutput(), None, sr=48000, "
+    "binaural_output_opts=dict(hrir_file={hrir_file!r}))",
+    "renderer (panning tables)":
+    "from nga_binaural.binaural_layout import BinauralOutput\n"
+    "from nga_binaural.renderer import BinauralRenderer\n"
+    "BinauralRenderer(BinauralOutput(), None, sr=48000, "
+    "binaural_output_opts=dict(hrir_file={hrir_file!r}, "
+    "panning_table_resolution=2, filter_cache_dir={cache_dir!r}))",
+}
+
+timed_step = """\
+import time
+start = time.perf_counter()
+{code}
+print(time.perf_counter() - start)
+"""
+
+
+def time_step(code, repeats):
+    times = []
+    for i in range(repeats):
+        output = subprocess.check_output(
+            [sys.executable, "-c",
+             timed_step.format(code=code)],
+            stderr=subprocess.DEVNULL)
+        times.append(float(output.decode().split()[-1]))
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--hrir-file",
+                        default="resource:data/HRIR_FULL2DEG.sofa")
+    parser.add_argument("--filter-cache-dir",
+                        default="filter_cache",
+                        help="cache directory for steps which use one; the "
+                        "first run fills it")
+    parser.add_argument("--repeats",
+                        type=int,
+                        default=3,
+                        help="number of runs of each step; the fastest is "
+                        "reported")
+    parser.add_argument("--steps",
+                        nargs="+",
+                        default=list(steps),
+                        choices=list(steps))
+    args = parser.parse_args()
+
+    for name in args.steps:
+        code = steps[name].format(hrir_file=args.hrir_file,
+                                  cache_dir=args.filter_cache_dir)
+        print("{:26} {:8.3f} s".format(name, time_step(code, args.repeats)))
+
+
+if __name__ == "__main__":
+    main()
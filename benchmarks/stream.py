@@ -0,0 +1,83 @@
+"""Check that BinauralStreamRenderer meets the real-time deadline.
+
+Run with `python benchmarks/stream.py`. The scene is a 7.1.4 (BS.2051 4+7+0)
+DirectSpeakers bed plus a number of moving objects, rendered in blocks of
+--block-size samples; each block must be processed in less than its duration.
+The default HRIR set is large, so --hrir-file can be used to select another
+SOFA file.
+"""
+import argparse
+import time
+import numpy as np
+from nga_binaural.renderer import BinauralStreamRenderer
+from scene import bed_items, object_items
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--block-size", type=int, default=128)
+    parser.add_argument("--sample-rate", type=int, default=48000)
+    parser.add_argument("--objects", type=int, default=4)
+    parser.add_argument("--virtual-layout",
+                        default="4+7+0",
+                        help="BS.2051 layout for the HRIR path")
+    parser.add_argument("--convolver", default="vectorized")
+    parser.add_argument("--hrir-file")
+    parser.add_argument("--panning-table-resolution",
+                        type=float,
+                        help="use panning tables with this grid spacing in "
+                        "degrees")
+    parser.add_argument("--filter-cache-dir")
+    parser.add_argument("--threads",
+                        type=int,
+                        default=1,
+                        help="number of threads to process the paths with")
+    parser.add_argument("--seconds", type=float, default=10.0)
+    args = parser.parse_args()
+
+    binaural_output_opts = dict(
+        convolver=args.convolver,
+        panning_table_resolution=args.panning_table_resolution,
+        filter_cache_dir=args.filter_cache_dir,
+        threads=args.threads)
+    if args.hrir_file is not None:
+        binaural_output_opts["hrir_file"] = args.hrir_file
+
+    renderer = BinauralStreamRenderer(
+        args.virtual_layout,
+        args.sample_rate,
+        block_size=args.block_size,
+        binaural_output_opts=binaural_output_opts)
+
+    items = bed_items("4+7+0")
+    items += object_items(args.objects, len(items), args.seconds)
+    renderer.set_rendering_items(items)
+
+    n_channels = len(items)
+    n_blocks = int(args.seconds * args.sample_rate / args.block_size)
+    input_block = np.random.RandomState(0).randn(args.block_size,
+                                                  n_channels) * 0.1
+
+    times = np.zeros(n_blocks)
+    for i in range(n_blocks):
+        start = time.perf_counter()
+        renderer.process(input_block)
+        times[i] = time.perf_counter() - start
+
+    deadline = args.block_size / args.sample_rate
+    # ignore the first blocks, which include warming up caches
+    steady = times[10:]
+    print("block size:  {} samples ({:.2f} ms)".format(args.block_size,
+                                                       deadline * 1e3))
+    print("latency:     {} samples ({:.2f} ms)".format(
+        renderer.latency, renderer.latency / args.sample_rate * 1e3))
+    print("mean:        {:.3f} ms".format(np.mean(steady) * 1e3))
+    print("99th pct:    {:.3f} ms".format(np.percentile(steady, 99) * 1e3))
+    print("max:         {:.3f} ms".format(np.max(steady) * 1e3))
+    print("rtf:         {:.3f}".format(np.mean(steady) / deadline))
+    print("missed:      {} of {} blocks".format(np.sum(steady > deadline),
+                                               len(steady)))
+
+
+if __name__ == "__main__":
+    main()
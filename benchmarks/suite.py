@@ -0,0 +1,504 @@
+"""Benchmark suite for the convolvers, the renderers and end-to-end rendering.
+
+Run all benchmarks and store the results with `python benchmarks/suite.py run`;
+compare two stored results (e.g. from before and after a change) with
+`python benchmarks/suite.py compare old.json new.json`.
+
+Each case is run in a new process, so that the peak RSS and startup time are
+those of the case alone. For each case the following are reported:
+
+- startup: time to construct the convolver or renderer and set the rendering
+  items, in seconds
+- rtf: processing time divided by the duration of the audio processed
+- p50, p99, max: per-block processing time in ms; the first blocks, which
+  include warming up caches, are not included
+- rss: peak resident set size of the process in MiB
+
+Scenes are generated by benchmarks/scene.py. The default HRIR set is large, so
+--hrir-file can be used to select another SOFA file; the results record the
+options used.
+"""
+import argparse
+import datetime
+import fnmatch
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import numpy as np
+
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+
+# number of blocks at the start of each measurement which are not included in
+# the per-block statistics
+warmup_blocks = 5
+
+
+def cases():
+    """Get all benchmark cases.
+
+    Returns:
+        list of dict: parameters of each case; "name" identifies the case
+            between runs, and "kind" selects the run_* function
+    """
+    cases = []
+    for filters in ["hrir", "brir"]:
+        for convolver in ["matrix", "vectorized", "nonuniform"]:
+            for block_size in [128, 512]:
+                cases.append(
+                    dict(kind="convolver",
+                         convolver=convolver,
+                         filters=filters,
+                         block_size=block_size))
+    for call_size in [100, 1000, 8192]:
+        cases.append(
+            dict(kind="vbs",
+                 convolver="vectorized",
+                 filters="brir",
+                 block_size=512,
+                 call_size=call_size))
+
+    cases.append(
+        dict(kind="wrapper",
+             virtual_layout="4+7+0",
+             block_size=512,
+             scene=dict(objects=8)))
+
+    mixed = dict(objects=8, bed="4+7+0", hoa_order=3)
+    for virtual_layout in ["0+5+0", "4+7+0", None]:
+        for block_size in [512, 2048]:
+            cases.append(
+                dict(kind="offline",
+                     virtual_layout=virtual_layout,
+                     block_size=block_size,
+                     scene=mixed))
+    for hoa_order in [1, 2, 3, 4]:
+        cases.append(
+            dict(kind="offline",
+                 virtual_layout="4+7+0",
+                 block_size=512,
+                 scene=dict(hoa_order=hoa_order)))
+    for n_objects in [1, 16]:
+        cases.append(
+            dict(kind="offline",
+                 virtual_layout="4+7+0",
+                 block_size=512,
+                 scene=dict(objects=n_objects)))
+
+    for block_size in [128, 512]:
+        cases.append(
+            dict(kind="stream",
+                 virtual_layout="4+7+0",
+                 block_size=block_size,
+                 scene=mixed))
+    # objects panned to the HRIR virtual loudspeakers, or rendered directly
+    for n_objects in [1, 4, 16]:
+        for hrir_objects in ["panned", "direct"]:
+            cases.append(
+                dict(kind="stream",
+                     virtual_layout=None,
+                     block_size=512,
+                     hrir_objects=hrir_objects,
+                     scene=dict(objects=n_objects)))
+
+    for case in cases:
+        case["name"] = case_name(case)
+    return cases
+
+
+def case_name(case):
+    parts = [case["kind"]]
+    for key in [
+            "convolver", "filters", "virtual_layout", "block_size",
+            "call_size", "hrir_objects"
+    ]:
+        if key in case:
+            value = case[key]
+            parts.append("all_defined" if value is None else str(value))
+    if "scene" in case:
+        scene = case["scene"]
+        parts.append("+".join("{}={}".format(key, scene[key])
+                              for key in sorted(scene)))
+    return "/".join(parts)
+
+
+def block_stats(times, block_duration):
+    """Statistics of per-block processing times in seconds."""
+    steady = times[min(warmup_blocks, len(times) // 2):]
+    return dict(rtf=float(np.sum(steady) / (len(steady) * block_duration)),
+                p50=float(np.percentile(steady, 50) * 1e3),
+                p99=float(np.percentile(steady, 99) * 1e3),
+                max=float(np.max(steady) * 1e3))
+
+
+def time_blocks(process, blocks):
+    times = np.zeros(len(blocks))
+    for i, block in enumerate(blocks):
+        start = time.perf_counter()
+        process(block)
+        times[i] = time.perf_counter() - start
+    return times
+
+
+def input_blocks(n_samples, n_channels, block_sizes, seed=0):
+    """Blocks of noise with the given sizes (repeated) covering n_samples."""
+    noise = np.random.RandomState(seed).randn(max(block_sizes),
+                                              n_channels) * 0.1
+    blocks = []
+    total = 0
+    while total < n_samples:
+        size = block_sizes[len(blocks) % len(block_sizes)]
+        blocks.append(noise[:size])
+        total += size
+    return blocks
+
+
+# (number of virtual loudspeakers, filter length in samples) of the filter
+# sets used for the convolver benchmarks; see benchmarks/convolvers.py
+filter_sets = dict(hrir=(47, 256), brir=(13, 3000))
+
+
+def make_convolver(case):
+    from nga_binaural.matrix_convolver import convolver_types
+    n_in, length = filter_sets[case["filters"]]
+    rng = np.random.RandomState(0)
+    filters = [(in_ch, out_ch, rng.randn(length) * 0.01)
+               for in_ch in range(n_in) for out_ch in range(2)]
+    return convolver_types[case["convolver"]](case["block_size"], n_in, 2,
+                                              filters)
+
+
+def run_convolver(case, options):
+    start = time.perf_counter()
+    convolver = make_convolver(case)
+    startup = time.perf_counter() - start
+
+    block_size = case["block_size"]
+    blocks = input_blocks(options["seconds"] * options["sample_rate"],
+                          convolver.n_in, [block_size])
+    times = time_blocks(convolver.filter_block, blocks)
+    return dict(startup=startup,
+                **block_stats(times, block_size / options["sample_rate"]))
+
+
+def run_vbs(case, options):
+    from nga_binaural.convolver import VariableBlockSizeAdapter
+    start = time.perf_counter()
+    convolver = make_convolver(case)
+    adapter = VariableBlockSizeAdapter(case["block_size"],
+                                       (convolver.n_in, convolver.n_out),
+                                       convolver.filter_block,
+                                       in_place=True)
+    startup = time.perf_counter() - start
+
+    call_size = case["call_size"]
+    blocks = input_blocks(options["seconds"] * options["sample_rate"],
+                          convolver.n_in, [call_size])
+    times = time_blocks(adapter.process, blocks)
+    return dict(startup=startup,
+                **block_stats(times, call_size / options["sample_rate"]))
+
+
+def binaural_output_opts(case, options):
+    opts = dict(block_size=case["block_size"])
+    if "hrir_objects" in case:
+        opts["hrir_objects"] = case["hrir_objects"]
+    if options["hrir_file"] is not None:
+        opts["hrir_file"] = options["hrir_file"]
+    return opts
+
+
+def run_wrapper(case, options):
+    from ear.core.objectbased.renderer import ObjectRenderer
+    from nga_binaural.binaural_layout import BinauralOutput
+    from nga_binaural.binaural_wrapper import BinauralWrapper
+    from scene import scene_items
+
+    sr = options["sample_rate"]
+    items, n_tracks = scene_items(options["seconds"], **case["scene"])
+
+    start = time.perf_counter()
+    wrapper = BinauralWrapper(ObjectRenderer, BinauralOutput(),
+                              case["virtual_layout"], sr,
+                              **binaural_output_opts(case, options))
+    wrapper.set_rendering_items(items)
+    startup = time.perf_counter() - start
+
+    blocks = input_blocks(options["seconds"] * sr, n_tracks,
+                          [options["chunk_size"]])
+    position = [0]
+
+    def render(block):
+        wrapper.render(sr, position[0], block)
+        position[0] += len(block)
+
+    times = time_blocks(render, blocks)
+    return dict(startup=startup,
+                **block_stats(times, options["chunk_size"] / sr))
+
+
+def run_offline(case, options):
+    from nga_binaural.binaural_layout import BinauralOutput
+    from nga_binaural.renderer import BinauralRenderer
+    from scene import scene_items
+
+    sr = options["sample_rate"]
+    items, n_tracks = scene_items(options["seconds"], **case["scene"])
+
+    start = time.perf_counter()
+    renderer = BinauralRenderer(
+        BinauralOutput(),
+        case["virtual_layout"],
+        sr=sr,
+        binaural_output_opts=binaural_output_opts(case, options))
+    renderer.set_rendering_items(items)
+    startup = time.perf_counter() - start
+
+    blocks = input_blocks(options["seconds"] * sr, n_tracks,
+                          [options["chunk_size"]])
+    times = time_blocks(lambda block: renderer.render(sr, block), blocks)
+    return dict(startup=startup,
+                **block_stats(times, options["chunk_size"] / sr))
+
+
+def run_stream(case, options):
+    from nga_binaural.renderer import BinauralStreamRenderer
+    from scene import scene_items
+
+    sr = options["sample_rate"]
+    items, n_tracks = scene_items(options["seconds"], **case["scene"])
+
+    start = time.perf_counter()
+    renderer = BinauralStreamRenderer(
+        case["virtual_layout"],
+        sr,
+        block_size=case["block_size"],
+        binaural_output_opts=binaural_output_opts(case, options))
+    renderer.set_rendering_items(items)
+    startup = time.perf_counter() - start
+
+    blocks = input_blocks(options["seconds"] * sr, n_tracks,
+                          [case["block_size"]])
+    times = time_blocks(renderer.process, blocks)
+    return dict(startup=startup,
+                **block_stats(times, case["block_size"] / sr))
+
+
+def run_case(case, options):
+    """Run one case in this process."""
+    from nga_binaural.profiling import peak_rss_mib
+    run = globals()["run_" + case["kind"]]
+    result = run(case, options)
+    result["rss"] = peak_rss_mib()
+    return result
+
+
+def run_case_subprocess(case, options):
+    """Run one case in a new process.
+
+    Returns:
+        dict: metrics, or {"error": message} if the case failed
+    """
+    process = subprocess.run(
+        [sys.executable,
+         os.path.abspath(__file__), "case",
+         json.dumps(dict(case=case, options=options))],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True)
+    if process.returncode != 0:
+        lines = process.stderr.strip().splitlines()
+        return dict(error=lines[-1] if lines else "failed")
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def git_revision():
+    """Get the current commit and whether the tree has uncommitted changes,
+    or (None, None) if this is not a git checkout."""
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"],
+                                         cwd=benchmarks_dir,
+                                         stderr=subprocess.DEVNULL)
+        status = subprocess.check_output(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            cwd=benchmarks_dir,
+            stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit.decode().strip(), bool(status.strip())
+
+
+metrics = [("startup", "{:9.3f}"), ("rtf", "{:8.4f}"), ("p50", "{:8.3f}"),
+           ("p99", "{:8.3f}"), ("max", "{:8.3f}"), ("rss", "{:7.0f}")]
+
+
+def format_result(name, result):
+    if "error" in result:
+        return "{:60} error: {}".format(name, result["error"])
+    return "{:60} ".format(name) + " ".join(
+        fmt.format(result[metric]) for metric, fmt in metrics)
+
+
+def header():
+    return "{:60} {:>9} {:>8} {:>8} {:>8} {:>8} {:>7}".format(
+        "case", "startup/s", "rtf", "p50/ms", "p99/ms", "max/ms", "rss/MiB")
+
+
+def cmd_run(args):
+    options = dict(seconds=args.seconds,
+                   sample_rate=args.sample_rate,
+                   chunk_size=args.chunk_size,
+                   hrir_file=args.hrir_file)
+    selected = [
+        case for case in cases()
+        if any(fnmatch.fnmatch(case["name"], pattern)
+               for pattern in args.cases)
+    ]
+
+    commit, dirty = git_revision()
+    import numpy
+    import scipy
+    results = dict(
+        commit=commit,
+        dirty=dirty,
+        date=datetime.datetime.now().isoformat(),
+        machine=dict(platform=platform.platform(),
+                     processor=platform.processor(),
+                     cpu_count=os.cpu_count(),
+                     python=platform.python_version(),
+                     numpy=numpy.__version__,
+                     scipy=scipy.__version__),
+        options=options,
+        results={},
+    )
+
+    print(header())
+    for case in selected:
+        result = run_case_subprocess(case, options)
+        results["results"][case["name"]] = dict(case=case, **result)
+        print(format_result(case["name"], result))
+        sys.stdout.flush()
+
+    output = args.output
+    if output is None:
+        output = os.path.join(
+            benchmarks_dir, "results", "{}{}.json".format(
+                commit[:10] if commit else "results",
+                "-dirty" if dirty else ""))
+    output_dir = os.path.dirname(os.path.abspath(output))
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print("results written to {}".format(output))
+
+
+def cmd_compare(args):
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    for label, results in [("old", old), ("new", new)]:
+        print("{}: {} {}".format(label, results["commit"],
+                                 "(dirty)" if results["dirty"] else ""))
+    if old["options"] != new["options"]:
+        print("warning: the results were measured with different options")
+
+    print("{:60} {:>8} {:>10} {:>10} {:>7}".format("case", "metric", "old",
+                                                   "new", "change"))
+    n_regressions = 0
+    for name, new_result in new["results"].items():
+        old_result = old["results"].get(name)
+        if old_result is None or "error" in old_result or "error" in new_result:
+            continue
+        for metric, _ in metrics:
+            change = new_result[metric] / old_result[metric] - 1.0 if \
+                old_result[metric] else 0.0
+            flag = ""
+            if change > args.threshold:
+                flag = " regression"
+                n_regressions += 1
+            elif change < -args.threshold:
+                flag = " improvement"
+            if flag or args.all:
+                print("{:60} {:>8} {:10.4g} {:10.4g} {:+6.1f}%{}".format(
+                    name, metric, old_result[metric], new_result[metric],
+                    change * 100.0, flag))
+    print("{} regressions above {:.0f}%".format(n_regressions,
+                                                args.threshold * 100.0))
+
+
+def cmd_case(args):
+    spec = json.loads(args.spec)
+    print(json.dumps(run_case(spec["case"], spec["options"])))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    run_parser = subparsers.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument("cases",
+                            nargs="*",
+                            default=["*"],
+                            help="glob patterns of case names to run, e.g. "
+                            "'offline/*' (default: all)")
+    run_parser.add_argument("--list",
+                            action="store_true",
+                            help="list the cases and exit")
+    run_parser.add_argument("--seconds",
+                            type=float,
+                            default=10.0,
+                            help="duration of audio to process in each case")
+    run_parser.add_argument("--sample-rate", type=int, default=48000)
+    run_parser.add_argument("--chunk-size",
+                            type=int,
+                            default=8192,
+                            help="samples per call to the offline renderers, "
+                            "as used by nga-binaural")
+    run_parser.add_argument("--hrir-file")
+    run_parser.add_argument("-o",
+                            "--output",
+                            help="file to store the results in (default: "
+                            "benchmarks/results/<commit>.json)")
+
+    compare_parser = subparsers.add_parser(
+        "compare", help="compare two sets of stored results")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold",
+                                type=float,
+                                default=0.1,
+                                help="relative change reported as a "
+                                "regression or improvement (default: "
+                                "%(default)s)")
+    compare_parser.add_argument("--all",
+                                action="store_true",
+                                help="show all metrics, not only changes "
+                                "above the threshold")
+
+    case_parser = subparsers.add_parser("case",
+                                        help="run one case given as JSON; "
+                                        "used internally")
+    case_parser.add_argument("spec")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        if args.list:
+            for case in cases():
+                print(case["name"])
+            return
+        cmd_run(args)
+    elif args.command == "compare":
+        cmd_compare(args)
+    else:
+        cmd_case(args)
+
+
+if __name__ == "__main__":
+    main()
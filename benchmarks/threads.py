@@ -0,0 +1,83 @@
+"""Measure how rendering scales with the number of threads used to process
+the BRIR, HRIR and direct paths (the `threads` binaural output option).
+
+Run with `python benchmarks/threads.py`. The scene from benchmarks/stream.py
+is rendered with BinauralStreamRenderer at each block size and thread count,
+and the mean time per block and the speedup relative to one thread are
+reported. There are only three paths, so more than three threads do not help.
+"""
+import argparse
+import os
+import time
+import numpy as np
+from nga_binaural.renderer import BinauralStreamRenderer
+from scene import bed_items, object_items
+
+
+def time_blocks(renderer, input_block, n_blocks):
+    times = np.zeros(n_blocks)
+    for i in range(n_blocks):
+        start = time.perf_counter()
+        renderer.process(input_block)
+        times[i] = time.perf_counter() - start
+    # ignore the first blocks, which include warming up caches
+    return np.mean(times[10:])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--block-sizes",
+                        type=int,
+                        nargs="+",
+                        default=[128, 1024, 4096])
+    parser.add_argument("--max-threads",
+                        type=int,
+                        default=min(os.cpu_count() or 1, 3))
+    parser.add_argument("--sample-rate", type=int, default=48000)
+    parser.add_argument("--objects", type=int, default=4)
+    parser.add_argument("--virtual-layout",
+                        default="4+7+0",
+                        help="BS.2051 layout for the HRIR path")
+    parser.add_argument("--convolver", default="vectorized")
+    parser.add_argument("--fft-backend", default="numpy")
+    parser.add_argument("--hrir-file")
+    parser.add_argument("--seconds", type=float, default=5.0)
+    args = parser.parse_args()
+
+    print("{} CPUs".format(os.cpu_count()))
+    print("{:>10} {:>8} {:>12} {:>8}".format("block size", "threads",
+                                              "ms / block", "speedup"))
+    for block_size in args.block_sizes:
+        base_time = None
+        for threads in range(1, args.max_threads + 1):
+            binaural_output_opts = dict(convolver=args.convolver,
+                                        fft_backend=args.fft_backend,
+                                        threads=threads)
+            if args.hrir_file is not None:
+                binaural_output_opts["hrir_file"] = args.hrir_file
+
+            renderer = BinauralStreamRenderer(
+                args.virtual_layout,
+                args.sample_rate,
+                block_size=block_size,
+                binaural_output_opts=binaural_output_opts)
+            items = bed_items("4+7+0")
+            items += object_items(args.objects, len(items), args.seconds)
+            renderer.set_rendering_items(items)
+
+            n_blocks = max(int(args.seconds * args.sample_rate / block_size),
+                           20)
+            input_block = np.random.RandomState(0).randn(
+                block_size, len(items)) * 0.1
+
+            with renderer:
+                block_time = time_blocks(renderer, input_block, n_blocks)
+            if base_time is None:
+                base_time = block_time
+            print("{:10} {:8} {:12.3f} {:8.2f}".format(
+                block_size, threads, block_time * 1e3,
+                base_time / block_time))
+
+
+if __name__ == "__main__":
+    main()
@@ -3,75 +3,147 @@ from scipy import signal
 
 """a function to align IRs of different emitter-positions"""
 
-def align_irs(irs):
-
-    oversample_fact = 2
-    irs_os = []
-    for ir in irs:
-        irs_os.append(signal.resample(ir, len(ir[0]) * oversample_fact, axis=1))
-
-    irs = np.array(irs_os)
-    listofdelays = []
-    listLmax = []
-    listRmax = []
-    list_min_delay = []
-    list_of_peaks = []
-
-    posorneg = np.max(irs)
-    for ir in irs:
-        if posorneg < 0:
-            max_amp_l = np.argmax(-ir[0, :])
-            max_amp_r = np.argmax(-ir[1, :])
-        elif posorneg > 0:
-            max_amp_l = np.argmax(ir[0, :])
-            max_amp_r = np.argmax(ir[1, :])
-
-
-        if max_amp_l <= max_amp_r:
-            if posorneg < 0:
-                peak = signal.find_peaks(-ir[0, :], height=0.2)
-            else:
-                peak = signal.find_peaks(ir[0, :], height=0.2)
-
-            if len(peak[0]) >= 2 and peak[0][0] <= peak[0][1] and max_amp_r - max_amp_l <= oversample_fact * 20:
-                max_amp_l = peak[0][0]
-            list_of_peaks.append(peak[0])
-            list_min_delay.append(max_amp_l)
-
-        else:
-            if posorneg < 0:
-                peak = signal.find_peaks(-ir[1, :], height=0.2)
-            else:
-                peak = signal.find_peaks(ir[1, :], height=0.2)
-
-            if len(peak[0]) >= 2 and peak[0][0] <= peak[0][1] and max_amp_l-max_amp_r <= oversample_fact * 20:
-                max_amp_r = peak[0][0]
-            list_of_peaks.append(peak[0])
-            list_min_delay.append(max_amp_r)
-    
-        maxamp_avg = np.average([max_amp_l, max_amp_r])
-        listofdelays.append(maxamp_avg)
-        listLmax.append(max_amp_l)
-        listRmax.append(max_amp_r)
-
-    maxdelay = int(np.amax(list_min_delay))
-
-
-    irs_aligned = []
-    list_of_lengths = []
-    for i_idx, ir in enumerate(irs):
-        if listLmax[i_idx] <= listRmax[i_idx]:
-            irs_aligned.append(np.concatenate(((np.zeros((2, maxdelay-listLmax[i_idx]))), ir[:, :]), axis=1))
-        else:
-            irs_aligned.append(np.concatenate(((np.zeros((2, maxdelay-listRmax[i_idx]))), ir[:, :]), axis=1))
-        list_of_lengths.append(np.shape(irs_aligned[i_idx])[1])
-
-    max_length = np.amax(list_of_lengths)
-
-    irs_final = []
-    for ir_aligned in irs_aligned:
-        irs_final.append(np.concatenate(((ir_aligned[:], np.zeros((2, max_length - np.shape(ir_aligned[0])[0])))), axis=1))
-
-    irs_final = signal.resample(irs_final, int(len(irs_final[0][0]) / oversample_fact), axis=2)           
-
-    return irs_final
\ No newline at end of file
+# the onsets are found with this resolution, in samples per input sample
+oversample_fact = 2
+
+
+def find_onsets(irs_os, height=0.2):
+    """Find the onset of each IR in the ear which it reaches first.
+
+    This is the position of the maximum of that ear (or the minimum, if all
+    samples are negative), or the position of its first peak above height if
+    it has more than one and the maxima of the two ears are less than 20
+    input samples apart.
+
+    Parameters:
+        irs_os (array of (n_irs, 2, n) floats): oversampled IRs
+        height (float): minimum height of a peak
+
+    Returns:
+        array of n_irs ints: onset positions in samples of irs_os
+    """
+    irs_os = -irs_os if np.max(irs_os) < 0 else irs_os
+    ir_idx = np.arange(len(irs_os))
+
+    max_amps = np.argmax(irs_os, axis=2)
+    first_ear = np.where(max_amps[:, 0] <= max_amps[:, 1], 0, 1)
+    onsets = max_amps[ir_idx, first_ear]
+
+    # local maxima of the first ear which are at least height; plateaus are
+    # not detected, unlike with scipy.signal.find_peaks
+    ir = irs_os[ir_idx, first_ear]
+    is_peak = ((ir[:, 1:-1] > ir[:, :-2]) & (ir[:, 1:-1] > ir[:, 2:]) &
+               (ir[:, 1:-1] >= height))
+    first_peaks = np.argmax(is_peak, axis=1) + 1
+
+    use_first_peak = ((np.count_nonzero(is_peak, axis=1) >= 2) &
+                      (np.abs(max_amps[:, 0] - max_amps[:, 1]) <=
+                       oversample_fact * 20))
+    return np.where(use_first_peak, first_peaks, onsets)
+
+
+def delay_and_resample(irs, delays, padded_length, num):
+    """Delay each IR by a number of samples, zero-pad them to padded_length
+    samples, then resample them to num samples as scipy.signal.resample
+    does.
+
+    The delays are applied as phase shifts to the spectra used for
+    resampling, so all IRs are processed with one FFT and one inverse FFT.
+
+    Parameters:
+        irs (array of (n_irs, 2, n) floats): IRs to delay
+        delays (array of n_irs ints): delay of each IR in samples; these must
+            be between 0 and padded_length - n, so that the IRs are not
+            shifted circularly
+        padded_length (int): length of the delayed IRs
+        num (int): number of samples to resample the delayed IRs to; at most
+            padded_length
+
+    Returns:
+        array of (n_irs, 2, num) floats
+    """
+    assert np.all(delays >= 0) and np.all(
+        delays + irs.shape[2] <= padded_length), "IRs would wrap around"
+
+    n_bins = num // 2 + 1
+    spectra = np.fft.rfft(irs, padded_length, axis=2)[:, :, :n_bins]
+    spectra *= np.exp(-2j * np.pi * np.outer(delays, np.arange(n_bins)) /
+                      padded_length)[:, np.newaxis]
+
+    # see scipy.signal.resample: the Nyquist bin of the output is the sum of
+    # the positive and negative frequency components
+    if num % 2 == 0 and num < padded_length:
+        spectra[:, :, num // 2] *= 2.0
+
+    return np.fft.irfft(spectra, num, axis=2) * (float(num) / padded_length)
+
+
+def ir_onsets(irs):
+    """Find the onsets of IRs as align_irs does.
+
+    Parameters:
+        irs (array of (n_irs, 2, n) floats): IRs
+
+    Returns:
+        array of n_irs ints: onset positions in samples of the IRs
+        oversampled by oversample_fact; see find_onsets
+    """
+    irs = np.asarray(irs)
+    return find_onsets(
+        signal.resample(irs, irs.shape[2] * oversample_fact, axis=2))
+
+
+def align_irs(irs, reference_onsets=None):
+    """Align IRs of different emitter positions, such that their onsets (see
+    find_onsets) are at the same time.
+
+    The onsets are found on IRs oversampled by oversample_fact, and the IRs
+    are delayed by up to the largest onset to match, so the alignment has a
+    resolution of 1/oversample_fact samples.
+
+    Parameters:
+        irs (array of (n_irs, 2, n) floats): IRs to align
+        reference_onsets (array of ints or None): onsets of the IRs which
+            determine the alignment (see ir_onsets), or None to use the IRs
+            being aligned. The onsets are aligned with the latest of these,
+            and the result is only extended to include their largest delay,
+            so IRs with these onsets are aligned exactly as they would be on
+            their own. Other IRs may be advanced or delayed further, in which
+            case the samples before the start or after the end of the result
+            are removed.
+
+    Returns:
+        array of (n_irs, 2, m) floats: aligned IRs, extended to include the
+        largest delay
+    """
+    irs = np.asarray(irs)
+    n_os = irs.shape[2] * oversample_fact
+    irs_os = signal.resample(irs, n_os, axis=2)
+
+    onsets = find_onsets(irs_os)
+    if reference_onsets is None:
+        reference_onsets = onsets
+    delays = np.max(reference_onsets) - onsets
+
+    padded_length = np.max(reference_onsets) - np.min(reference_onsets) + n_os
+    num = padded_length // oversample_fact
+    aligned = np.empty((len(irs), 2, num))
+
+    fits = (delays >= 0) & (delays + n_os <= padded_length)
+    if np.any(fits):
+        aligned[fits] = delay_and_resample(irs_os[fits], delays[fits],
+                                           padded_length, num)
+
+    if not np.all(fits):
+        # shift the others in the time domain, removing the samples outside
+        # of padded_length rather than wrapping them around
+        positions = np.arange(padded_length) - delays[~fits, np.newaxis]
+        in_range = (positions >= 0) & (positions < n_os)
+        shifted = irs_os[~fits][np.arange(len(positions))[:, np.newaxis],
+                                :,
+                                np.clip(positions, 0, n_os - 1)]
+        shifted = shifted.transpose(0, 2, 1) * in_range[:, np.newaxis]
+        aligned[~fits] = delay_and_resample(
+            shifted, np.zeros(len(shifted), dtype=int), padded_length, num)
+
+    return aligned
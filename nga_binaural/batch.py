@@ -0,0 +1,234 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+import numpy as np
+from ear.fileio import openBw64
+from .cmdline import (add_commands_for_offline_driver,
+                      add_filter_cache_commands, make_driver,
+                      _warm_filter_cache)
+from .ear_cmdline_render_file import handle_strict
+from .segmented import _get_mp_context
+
+"""render many files in a pool of worker processes
+
+The filters for each sample rate are prepared in the parent process before the
+workers are started. Where processes are forked, the workers share these
+copy-on-write; otherwise they are prepared again in each worker, which is
+cheap if a filter cache is used, as the cached filters are memory-mapped.
+"""
+
+# driver for the current worker process, set by _init_worker
+_driver = None
+
+
+def _init_worker(args):
+    global _driver
+    handle_strict(args)
+    _driver = make_driver(args)
+
+
+def _render_one(job):
+    """Render one file using the driver of this worker.
+
+    Parameters:
+        job (tuple): (input file, output file, peak_normalization, debug)
+
+    Returns:
+        dict: summary of the rendering of this file
+    """
+    input_file, output_file, peak_normalization, debug = job
+    result = dict(input_file=input_file, output_file=output_file)
+
+    start = time.time()
+    try:
+        output_monitor = _driver.run(_driver, input_file, output_file,
+                                     peak_normalization)
+    except (Exception, SystemExit) as error:
+        if debug:
+            raise
+        result.update(status="error", error=str(error))
+        return result
+    result["render_time"] = time.time() - start
+
+    with np.errstate(divide="ignore"):
+        peak_db = 20.0 * np.log10(output_monitor.peak_abs_linear)
+    result.update(
+        status="ok",
+        peak_db=[None if np.isinf(p) else float(p) for p in peak_db],
+        overloaded=bool(output_monitor.has_overloaded()),
+    )
+    return result
+
+
+def _expand_input_files(patterns):
+    """Expand glob patterns, keeping names which do not match anything so that
+    they are reported as errors."""
+    input_files = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern))
+        input_files.extend(matches if matches else [pattern])
+    return input_files
+
+
+def _output_file(output_dir, input_file, suffix):
+    name, ext = os.path.splitext(os.path.basename(input_file))
+    return os.path.join(output_dir, name + suffix + ext)
+
+
+def _get_duration(input_file):
+    """Get the sample rate and duration in seconds of a file, or (None, None)
+    if it can not be read."""
+    try:
+        with openBw64(input_file) as infile:
+            return infile.sampleRate, len(infile) / infile.sampleRate
+    except Exception:
+        return None, None
+
+
+def render_files_batch(args):
+    """Render all input files given in args.
+
+    Returns:
+        list of dict: summary of the rendering of each file, in the order of
+            the input files
+    """
+    input_files = _expand_input_files(args.input_files)
+    output_files = [
+        _output_file(args.output_dir, input_file, args.suffix)
+        for input_file in input_files
+    ]
+    assert len(set(output_files)) == len(output_files), \
+        "input files with the same name would be rendered to the same file"
+    if not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+
+    durations = [_get_duration(input_file) for input_file in input_files]
+
+    # prepare the filters once for each sample rate; these are re-used by
+    # renderers created later in this process, and inherited by forked workers
+    _init_worker(args)
+    for sr in sorted(set(sr for sr, _ in durations if sr is not None)):
+        _warm_filter_cache(_driver, sr)
+
+    jobs = [(input_file, output_file, args.peak_normalization, args.debug)
+            for input_file, output_file in zip(input_files, output_files)]
+
+    n_jobs = min(args.jobs, len(jobs))
+    if n_jobs <= 1:
+        results = [_render_one(job) for job in jobs]
+    else:
+        with _get_mp_context().Pool(n_jobs,
+                                    initializer=_init_worker,
+                                    initargs=(args, )) as pool:
+            results = pool.map(_render_one, jobs, chunksize=1)
+
+    for result, (sr, duration) in zip(results, durations):
+        result["duration"] = duration
+        if result["status"] == "ok" and duration:
+            result["realtime_factor"] = result["render_time"] / duration
+
+    return results
+
+
+def _format_result(result):
+    name = os.path.basename(result["input_file"])
+    if result["status"] != "ok":
+        return "{:<40} error: {}".format(name, result["error"])
+
+    peak = max((p for p in result["peak_db"] if p is not None),
+               default=float("-inf"))
+    return "{:<40} {:>8.2f} {:>8.2f} {:>8.3f} {:>8.1f} {}".format(
+        name, result["duration"], result["render_time"],
+        result["realtime_factor"], peak,
+        "overload" if result["overloaded"] else "")
+
+
+def print_summary(results, f=None):
+    """Print a table of the results from render_files_batch to f (default:
+    stdout)."""
+    if f is None:
+        f = sys.stdout
+    f.write("{:<40} {:>8} {:>8} {:>8} {:>8}\n".format("file", "dur/s",
+                                                      "time/s", "rtf",
+                                                      "peak/dB"))
+    for result in results:
+        f.write(_format_result(result) + "\n")
+
+
+def parse_command_line(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Binaural NGA Renderer; render several files in parallel")
+
+    parser.add_argument("-d",
+                        "--debug",
+                        help="print debug information when an error occurs",
+                        action="store_true")
+
+    add_commands_for_offline_driver(parser)
+
+    parser.add_argument("input_files",
+                        nargs="+",
+                        metavar="input_file",
+                        help="input files or glob patterns")
+    parser.add_argument("-o",
+                        "--output-dir",
+                        required=True,
+                        metavar="dir",
+                        help="directory to write the rendered files to")
+    parser.add_argument("--suffix",
+                        default="",
+                        help="added to the name of each input file to make "
+                        "the output file name")
+    parser.add_argument("-j",
+                        "--jobs",
+                        type=int,
+                        default=os.cpu_count(),
+                        help="number of files to render in parallel "
+                        "(default: %(default)s)")
+    parser.add_argument("--summary",
+                        metavar="file",
+                        help="write a JSON summary of the timings and levels "
+                        "of each file")
+
+    parser.add_argument("--peak_normalization",
+                        "-pn",
+                        help="perform a peak normalization of the output",
+                        action="store_true")
+
+    parser.add_argument("--strict",
+                        help="treat unknown ADM attributes as errors",
+                        action="store_true")
+
+    add_filter_cache_commands(parser)
+
+    args = parser.parse_args(argv)
+
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+
+    return args
+
+
+def render_batch():
+    args = parse_command_line()
+
+    try:
+        results = render_files_batch(args)
+    except Exception as error:
+        if args.debug:
+            raise
+        else:
+            sys.exit(str(error))
+
+    print_summary(results)
+    if args.summary is not None:
+        with open(args.summary, "w") as f:
+            json.dump(results, f, indent=2)
+
+    n_failed = sum(result["status"] != "ok" for result in results)
+    if n_failed:
+        sys.exit("error: {} of {} files failed".format(n_failed,
+                                                       len(results)))
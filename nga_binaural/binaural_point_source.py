@@ -2,36 +2,57 @@ import numpy as np
 from attr import attrs, attrib
 from ear.options import OptionsHandler
 from ear.core import bs2051, point_source
+from ear.fileio.adm.elements import ObjectPolarPosition
 import pkg_resources
 from ruamel import yaml
 from . import sofa
+from .panning_table import get_panning_table
 
 """this is a modified version of point_source.py from the EAR. It was modified to adapt to the binaural rendering structure."""
 
+def _load_yaml(fname):
+    """Load a YAML resource, using the C implementation of the safe loader if
+    it is available."""
+    with pkg_resources.resource_stream(__name__, fname) as f:
+        return yaml.YAML(typ="safe").load(f)
+
 def _load_binaural_layouts():
-    fname = "data/binaural_layouts.yaml"
-    with pkg_resources.resource_stream(__name__, fname) as layouts_file:
-        layouts_data = yaml.safe_load(layouts_file)
+    layouts_data = _load_yaml("data/binaural_layouts.yaml")
 
-        layouts = list(map(bs2051._dict_to_layout, layouts_data))
+    layouts = list(map(bs2051._dict_to_layout, layouts_data))
 
-        for layout in layouts:
-            errors = []
-            layout.check_positions(callback=errors.append)
-            assert errors == []
+    for layout in layouts:
+        errors = []
+        layout.check_positions(callback=errors.append)
+        assert errors == []
 
-        layout_names = [layout.name for layout in layouts]
-        layouts_dict = {layout.name: layout for layout in layouts}
+    layout_names = [layout.name for layout in layouts]
+    layouts_dict = {layout.name: layout for layout in layouts}
 
-        return layout_names, layouts_dict
+    return layout_names, layouts_dict
 
 def _load_allo_positions_binaural():
-    import pkg_resources
-    from ruamel import yaml
+    return _load_yaml("data/binaural_layouts_allo.yaml")
+
+_layout_registry = {}
+
+def get_layout_registry():
+    """Get the binaural layouts and their allocentric positions, which are
+    loaded on the first call in each process.
+
+    Returns:
+        tuple: layout names (list of str), layouts (dict from name to Layout)
+        and allocentric positions (dict from name to position data); these are
+        shared, so must not be modified
+    """
+    if not _layout_registry:
+        layout_names, layouts = _load_binaural_layouts()
+        _layout_registry.update(layout_names=layout_names,
+                                layouts=layouts,
+                                allo_positions=_load_allo_positions_binaural())
 
-    fname = "data/binaural_layouts_allo.yaml"
-    with pkg_resources.resource_stream(__name__, fname) as layouts_file:
-        return yaml.safe_load(layouts_file)
+    return (_layout_registry["layout_names"], _layout_registry["layouts"],
+            _layout_registry["allo_positions"])
 
 @attrs(slots=True)
 class StereoPanDownmix_Binaural(point_source.RegionHandler): 
@@ -59,17 +80,17 @@ class StereoPanDownmix_Binaural(point_source.RegionHandler):
 
         self.psp = configure(layout)
 
-    def handle(self, position):
-        # downmix as in ITU-R BS.775, but with the centre downmix adjusted to
-        # preserve the velocity vector rather than the output power
-        downmix = [
-            [1.0000, 0.0000, np.sqrt(3) / 3, np.sqrt(3) / 3],
-            [0.0000, 1.0000, np.sqrt(3) / 3, np.sqrt(3) / 3],
-        ]
+    # downmix as in ITU-R BS.775, but with the centre downmix adjusted to
+    # preserve the velocity vector rather than the output power
+    downmix = np.array([
+        [1.0000, 0.0000, np.sqrt(3) / 3, np.sqrt(3) / 3],
+        [0.0000, 1.0000, np.sqrt(3) / 3, np.sqrt(3) / 3],
+    ])
 
+    def handle(self, position):
         # pan with 0+4+0, downmix and power normalise
         pv = self.psp.handle(position)
-        pv_dmix = np.dot(downmix, pv)
+        pv_dmix = np.dot(self.downmix, pv)
         pv_dmix /= np.linalg.norm(pv_dmix)
 
         return pv_dmix
@@ -87,19 +108,56 @@ def _configure_stereo_binaural(layout):
 configure_options = OptionsHandler()
 
 
-def configure(layout):
+def configure(layout,
+              panning_table_resolution=None,
+              panning_table_max_error=0.05,
+              cache_dir=None,
+              cache_max_size=0):
     """Configure a point source panner given a loudspeaker layout.
 
     Args:
         layout (.layout.Layout): Loudspeaker layout.
+        panning_table_resolution (float or None): if not None, use a
+            panning_table.PanningTable with this grid spacing in degrees
+        panning_table_max_error, cache_dir, cache_max_size: see
+            panning_table.get_panning_table
 
     Returns:
         PointSourcePanner: point source panner configured to output channels in
             the same order as layout.channels.
     """
     if layout.name == "0+2+0":
-        return point_source._configure_stereo(layout)
+        panner = point_source._configure_stereo(layout)
     elif layout.name == "binaural_direct":
-        return _configure_stereo_binaural(layout)
+        panner = _configure_stereo_binaural(layout)
     else:
-        return point_source._configure_full(layout)
+        panner = point_source._configure_full(layout)
+
+    if panning_table_resolution is not None:
+        table = get_panning_table(layout,
+                                  panner,
+                                  panning_table_resolution,
+                                  panning_table_max_error,
+                                  cache_dir=cache_dir,
+                                  cache_max_size=cache_max_size)
+        if table is not None:
+            return table
+
+    return panner
+
+
+def is_point_source(block_format):
+    """Would ObjectRenderer only pan an object block to its direction with
+    the point source panner (with the block gain)? These blocks can be
+    rendered by ObjectHRIRRenderer, and their gains calculated directly."""
+    position = block_format.position
+    return (not block_format.cartesian
+            and isinstance(position, ObjectPolarPosition)
+            and position.screenEdgeLock.horizontal is None
+            and position.screenEdgeLock.vertical is None
+            and block_format.width == 0 and block_format.height == 0
+            and block_format.depth == 0 and block_format.diffuse == 0
+            and block_format.channelLock is None
+            and (block_format.objectDivergence is None
+                 or block_format.objectDivergence.value == 0)
+            and not block_format.screenRef and not block_format.zoneExclusion)
@@ -1,21 +1,47 @@
 import copy
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import numpy as np
 from ear.options import Option, OptionsHandler
-from ear.core.metadata_input import ObjectRenderingItem
+from attr import evolve
+from ear.core.metadata_input import (MetadataSource, MetadataSourceIter,
+                                     ObjectRenderingItem)
+from ear.core.metadata_processing import MetadataSourceModifyBlockFormat
 from ear.core import point_source
+from ear.core.delay import Delay
+from ear.core.geom import cart
+from ear.core.direct_speakers.renderer import DirectSpeakersRenderer
+from ear.core.objectbased.renderer import (InterpretObjectMetadata,
+                                           ObjectRenderer)
+from ear.core.scenebased.renderer import HOARenderer
+from ear.core.renderer_common import BlockProcessingChannel
+from ear.core.track_processor import TrackProcessor
 from ear.fileio.adm.elements import ObjectPolarPosition
-import numpy as np
-from scipy import signal
-from . import sofa, binaural_point_source
-from .matrix_convolver import MatrixBlockConvolver
+from . import sofa, binaural_point_source, profiling
+from .binaural_point_source import is_point_source
+from .matrix_convolver import SilenceBypass, convolver_types
 from .convolver import VariableBlockSizeAdapter
-from .align_irs import align_irs
+from .filter_bank import get_filter_bank
+from .fft import fft_backends, get_fft_backend
 from .binaural_layout import BinauralOutput
+from .head_tracking import HeadTracker, track_renderer
+from .object_hrir import CrossfadingConvolver, get_hrir_set
 
 binaural_output_options = OptionsHandler(
     block_size=Option(
         default=512,
         description="block size for convolution",
     ),
+    convolver=Option(
+        default="vectorized",
+        description="convolution engine to use; one of {}".format(
+            ", ".join(sorted(convolver_types))),
+    ),
+    max_partition_size=Option(
+        default=8192,
+        description="largest partition size used by the nonuniform convolver",
+    ),
     virtual_layout_hrir=Option(
         default=("binaural", "all_defined"),
         description="loudspeaker layout to render to before applying HRIRs",
@@ -33,189 +59,962 @@ binaural_output_options = OptionsHandler(
         "resource:data/BRIR_KU100_60ms.sofa",
         description="SOFA file to get BRIRs from",
     ),
+    filter_cache_dir=Option(
+        default=None,
+        description="directory to cache preprocessed filters in, or None",
+    ),
+    filter_cache_max_size=Option(
+        default=2**30,
+        description="maximum size of the filter cache in bytes",
+    ),
+    fft_backend=Option(
+        default="numpy",
+        description="FFT library to use in the convolvers; one of {}".format(
+            ", ".join(sorted(fft_backends))),
+    ),
+    fft_threads=Option(
+        default=1,
+        description="number of threads to use for FFTs, if supported by "
+        "fft_backend",
+    ),
+    dtype=Option(
+        default="float64",
+        description="precision of the convolution; float32 or float64",
+    ),
+    threads=Option(
+        default=1,
+        description="number of threads used to render and convolve the "
+        "BRIR, HRIR and direct paths concurrently; with 1 they are processed "
+        "in turn",
+    ),
+    panning_table_resolution=Option(
+        default=None,
+        description="if not None, interpolate point source panning gains "
+        "precomputed on a grid with this spacing in degrees, rather than "
+        "running the panner for each block; the tables are stored in "
+        "filter_cache_dir",
+    ),
+    panning_table_max_error=Option(
+        default=0.05,
+        description="largest estimated gain error of a panning table "
+        "compared to the panner; tables with larger errors are not used",
+    ),
+    head_tracking=Option(
+        default=False,
+        description="rotate the scene to follow the orientation of the "
+        "listener's head, set with set_head_orientation of the renderer",
+    ),
+    head_tracking_interval=Option(
+        default=1,
+        description="minimum number of blocks between head orientation "
+        "changes; each change costs roughly one block of processing with "
+        "panning tables (see panning_table_resolution) and several without, "
+        "so this can be increased to bound the average cost",
+    ),
+    hrir_objects=Option(
+        default="panned",
+        description="how objects are rendered on the HRIR path: 'panned' to "
+        "the virtual loudspeakers (the default), 'direct' by convolving each object with "
+        "HRIRs interpolated at its position, or 'auto' to use 'direct' when "
+        "there are fewer objects than virtual loudspeakers; objects which "
+        "are not point sources (e.g. with extent, diffuseness or divergence) "
+        "are always panned",
+    ),
 )
 
-class BinauralWrapper(object):
-    """Wrapper around multiple loudspeaker renderers which returns the binaural rendering."""
+def get_virtual_layouts(virtual_layout, virtual_layout_hrir,
+                        virtual_layout_brir):
+    """Get the virtual loudspeaker layouts for the HRIR, BRIR and direct paths.
+
+    Parameters:
+        virtual_layout (str or None): BS.2051 layout name to use for the HRIR
+            path instead of virtual_layout_hrir
+        virtual_layout_hrir, virtual_layout_brir: see binaural_output_options
+
+    Returns:
+        tuple of 3 Layout: layouts for the HRIR, BRIR and direct paths
+    """
+    if virtual_layout is None:
+        hrir_layout = sofa.get_binaural_layout(virtual_layout_hrir)
+    else:
+        hrir_layout = sofa.get_binaural_layout(('bs2051', virtual_layout))
+    if len(hrir_layout.channels) < 22:
+        brir_layout = hrir_layout
+    else:
+        brir_layout = sofa.get_binaural_layout(virtual_layout_brir)
+    dirir_layout = sofa.get_binaural_layout(("binaural", "binaural_direct"))
+
+    return hrir_layout, brir_layout, dirir_layout
+
+
+# the paths of the binaural rendering, in the order used for arguments
+paths = ("brir", "hrir", "dirir")
+
+# profiling stage for the convolution of each path
+_convolve_stages = dict((path, "render/convolve/" + path) for path in paths)
+
+
+class PathExecutor(object):
+    """Runs a function for each path of the binaural rendering, either in
+    turn in the calling thread, or concurrently on a fixed pool of threads.
+
+    The paths use separate renderers and convolvers, and most of the time is
+    spent in numpy operations which release the GIL, so they can be
+    processed in parallel.
+
+    The threads are stopped by close(), or when the executor is garbage
+    collected.
+
+    Parameters:
+        threads (int): number of threads to use; with 1, no threads are
+            started
+    """
+    def __init__(self, threads):
+        assert threads >= 1, "threads must be at least 1"
+        self.threads = threads
+        self._pool = ThreadPoolExecutor(threads) if threads > 1 else None
+        if self._pool is not None:
+            self._finalizer = weakref.finalize(self, self._pool.shutdown,
+                                               False)
+        else:
+            self._finalizer = None
+
+    def close(self):
+        """Stop the threads; map must not be called afterwards."""
+        if self._finalizer is not None:
+            self._finalizer()
+
+    def map(self, f, *iterables):
+        """Call f with one item from each of iterables at a time, and wait
+        for all calls to finish.
+
+        Returns:
+            list: the results of f, in order
+        """
+        if self._pool is None:
+            return list(map(f, *iterables))
+        return list(self._pool.map(f, *iterables))
+
+
+class BinauralConvolver(object):
+    """Convolution of virtual loudspeaker signals for the BRIR, HRIR and
+    direct paths with their filters, producing the binaural rendering.
+
+    Attributes:
+        hrir_layout, brir_layout, dirir_layout (Layout): virtual loudspeaker
+            layouts that the input signals to process must be rendered to
+        block_size (int): block size for convolution
+        executor (PathExecutor): used to process the paths; this can also be
+            used to render the input signals of each path concurrently
+        head_tracker (HeadTracker or None): head orientation applied by the
+            loudspeaker renderers if head_tracking is enabled
+    """
     @binaural_output_options.with_defaults
-    def __init__(self,
-                 renderer_cls,
-                 layout,
-                 virtual_layout,
-                 sr,
-                 block_size,
-                 virtual_layout_hrir,
-                 virtual_layout_brir,
-                 hrir_file,
-                 brir_file,
-                 renderer_opts={}):
-
-        point_source.configure = binaural_point_source.configure
-
+    def __init__(self, virtual_layout, sr, block_size, convolver,
+                 max_partition_size, virtual_layout_hrir, virtual_layout_brir,
+                 hrir_file, brir_file, filter_cache_dir,
+                 filter_cache_max_size, fft_backend, fft_threads, dtype,
+                 panning_table_resolution, panning_table_max_error, threads,
+                 head_tracking, head_tracking_interval, hrir_objects):
+        assert hrir_objects in ("auto", "direct", "panned"), \
+            "unknown hrir_objects {}".format(hrir_objects)
         """load layouts for all three renderings"""
-        
-        if virtual_layout is None:
-            hrir_layout = sofa.get_binaural_layout(virtual_layout_hrir)
-        else:
-            hrir_layout = sofa.get_binaural_layout(('bs2051', virtual_layout))
-        if len(hrir_layout.channels) < 22:
-            brir_layout = hrir_layout
-        else:
-            brir_layout = sofa.get_binaural_layout(virtual_layout_brir)
-        dirir_layout = sofa.get_binaural_layout(("binaural", "binaural_direct"))
-
-        """define three renderers"""
-        self.renderer_hrir = renderer_cls(hrir_layout, **renderer_opts)
-        self.renderer_brir = renderer_cls(brir_layout, **renderer_opts)
-        self.renderer_direct = renderer_cls(dirir_layout, **renderer_opts)
-
-        """load impulse responses according to the prior defined layouts and apply gain and delay for correct summation"""
-        hrir_sofa_file = sofa.SOFAFileHRIR(sofa.load_hdf5(hrir_file))
-        hrirs = hrir_sofa_file.irs_for_positions(hrir_layout.positions)
-        hrirs = align_irs(hrirs)
-        if hrir_sofa_file.check_fs() != sr:
-            hrirs = signal.resample(
-                hrirs, int(len(hrirs) / hrir_sofa_file.check_fs() * sr))
-        hrirs = hrirs / sofa.calc_gain_of_irs(hrirs) * 0.20885643426029013 / 2
-
-        brir_sofa_file = sofa.SOFAFileHRIR(sofa.load_hdf5(brir_file))
-        brirs = brir_sofa_file.irs_for_positions(brir_layout.positions)
-        if brir_sofa_file.check_fs() != sr:
-            brirs = signal.resample(
-                brirs, int(len(brirs) / brir_sofa_file.check_fs() * sr))
-        brirs = brirs / sofa.calc_gain_of_irs(
-            brirs) * 0.05542830927315457 / 2 
-        brirs = np.concatenate(
-            (np.zeros([len(brirs), 2,
-                       int(sofa.calc_delay_of_irs(hrirs)) - 1]), brirs), axis=2)
-
-        dirirs = np.concatenate((np.zeros(
-            [2, 2, int(sofa.calc_delay_of_irs(hrirs)) - 1]), np.ones([2, 2, 1])), axis=2)
-        dirirs = dirirs * 0.37
-
-        """prepare filter matrix for MatrixBlockConvolver"""
-        filter_matrix_hrir = [(in_ch, out_ch, ir)
-                              for in_ch, ir_pair in enumerate(hrirs)
-                              for out_ch, ir in enumerate(ir_pair)]
-
-        filter_matrix_brir = [(in_ch, out_ch, ir)
-                              for in_ch, ir_pair in enumerate(brirs)
-                              for out_ch, ir in enumerate(ir_pair)]
-
-        filter_matrix_dirir = [(in_ch, out_ch, ir)
-                               for in_ch, ir_pair in enumerate(dirirs)
-                               for out_ch, ir in enumerate(ir_pair)]
-
-        """define convolver for all three parts"""
-        convolver_hrir = MatrixBlockConvolver(block_size,
-                                              len(hrir_layout.channels), 2,
-                                              filter_matrix_hrir)
-
-        convolver_brir = MatrixBlockConvolver(block_size,
-                                              len(brir_layout.channels), 2,
-                                              filter_matrix_brir)
-
-        convolver_dirir = MatrixBlockConvolver(block_size,
-                                               len(dirir_layout.channels), 2,
-                                               filter_matrix_dirir)
+        self.hrir_layout, self.brir_layout, self.dirir_layout = get_virtual_layouts(
+            virtual_layout, virtual_layout_hrir, virtual_layout_brir)
+
+        """get convolvers for the prior defined layouts; the filters are shared between instances with the same parameters"""
+        fft = get_fft_backend(fft_backend,
+                              fft_threads,
+                              wisdom_dir=filter_cache_dir)
+        filter_bank = get_filter_bank(
+            self.hrir_layout,
+            self.brir_layout,
+            self.dirir_layout,
+            sr,
+            block_size,
+            convolver,
+            max_partition_size,
+            hrir_file,
+            brir_file,
+            filter_cache_dir=filter_cache_dir,
+            filter_cache_max_size=filter_cache_max_size,
+            fft=fft,
+            dtype=dtype)
+        self.block_size = block_size
+        self._configure_panner = partial(
+            binaural_point_source.configure,
+            panning_table_resolution=panning_table_resolution,
+            panning_table_max_error=panning_table_max_error,
+            cache_dir=filter_cache_dir,
+            cache_max_size=filter_cache_max_size)
+        # paths with silent input are skipped once their tail has decayed
+        self.convolver_hrir, self.convolver_brir, self.convolver_dirir = [
+            SilenceBypass(convolver) for convolver in filter_bank.convolvers()
+        ]
+
+        self.executor = PathExecutor(threads)
+        self.head_tracker = (HeadTracker(head_tracking_interval)
+                             if head_tracking else None)
+
+        self.hrir_objects = hrir_objects
+        self._get_hrir_set = partial(get_hrir_set,
+                                     hrir_file,
+                                     self.hrir_layout,
+                                     sr,
+                                     cache_dir=filter_cache_dir,
+                                     cache_max_size=filter_cache_max_size,
+                                     dtype=dtype)
+        self._fft = fft
+        self._dtype = dtype
+
+        # output of each path in process_block
+        self._block_outputs = dict(
+            (path, np.zeros((block_size, 2), dtype=dtype)) for path in paths)
 
         """convolution with variable block size"""
         self.convolver_vbs_hrir = VariableBlockSizeAdapter(
-            block_size, (len(hrir_layout.channels), 2),
-            convolver_hrir.filter_block)
+            block_size, (len(self.hrir_layout.channels), 2),
+            self.convolver_hrir.filter_block,
+            in_place=True,
+            dtype=dtype)
 
         self.convolver_vbs_brir = VariableBlockSizeAdapter(
-            block_size, (len(brir_layout.channels), 2),
-            convolver_brir.filter_block)
+            block_size, (len(self.brir_layout.channels), 2),
+            self.convolver_brir.filter_block,
+            in_place=True,
+            dtype=dtype)
 
         self.convolver_vbs_dirir = VariableBlockSizeAdapter(
-            block_size, (len(dirir_layout.channels), 2),
-            convolver_dirir.filter_block)
+            block_size, (len(self.dirir_layout.channels), 2),
+            self.convolver_dirir.filter_block,
+            in_place=True,
+            dtype=dtype)
+
+        self._convolvers = dict(hrir=self.convolver_hrir,
+                                brir=self.convolver_brir,
+                                dirir=self.convolver_dirir)
+        self._convolvers_vbs = dict(hrir=self.convolver_vbs_hrir,
+                                    brir=self.convolver_vbs_brir,
+                                    dirir=self.convolver_vbs_dirir)
+
+    def close(self):
+        """Stop the threads used to process the paths."""
+        self.executor.close()
+
+    def loudspeaker_renderer(self, renderer_cls, renderer_opts={}, name=None):
+        """Get a VirtualLoudspeakerRenderer producing the input signals for
+        this convolver, using the panning options given here.
+
+        Parameters:
+            renderer_cls: EAR renderer class
+            renderer_opts (dict): options for renderer_cls
+            name (str or None): see VirtualLoudspeakerRenderer
+        """
+        return VirtualLoudspeakerRenderer(renderer_cls,
+                                          self.hrir_layout,
+                                          self.brir_layout,
+                                          self.dirir_layout,
+                                          renderer_opts=renderer_opts,
+                                          configure=self._configure_panner,
+                                          name=name,
+                                          head_tracker=self.head_tracker)
+
+    def object_hrir_renderer(self, delay):
+        """Get an ObjectHRIRRenderer whose output can be added to the HRIR
+        path of this convolver.
+
+        Parameters:
+            delay (int): delay of the ObjectRenderer rendering the objects on
+                the other paths (its overall_delay)
+        """
+        return ObjectHRIRRenderer(self._get_hrir_set,
+                                  self.block_size,
+                                  delay,
+                                  fft=self._fft,
+                                  dtype=self._dtype,
+                                  head_tracker=self.head_tracker)
+
+    def direct_hrir_objects(self, rendering_items):
+        """Select the objects to render on the HRIR path with an
+        ObjectHRIRRenderer rather than by panning them to the virtual
+        loudspeakers; see the hrir_objects option.
+
+        Parameters:
+            rendering_items (list of ObjectRenderingItem): objects to render
+
+        Returns:
+            list of ObjectRenderingItem: the items of rendering_items to
+            render directly
+        """
+        if self.hrir_objects == "panned":
+            return []
+
+        items = [item for item in rendering_items if _is_point_source(item)]
+        if (self.hrir_objects == "auto"
+                and len(items) >= len(self.hrir_layout.channels)):
+            return []
+        return items
 
+    @property
+    def tail_length(self):
+        """int: number of samples for which a block of input affects the
+        output of process_block, i.e. the length of the state of the
+        convolvers"""
+        return max(convolver.tail_blocks
+                   for convolver in self._convolvers.values()) * self.block_size
 
-    """filter items to be rendered for different renderers (binaural, non-binaural)"""
-    def filter_rendering_items_hrir(self, rendering_items):
-        rendering_items_hrir = copy.deepcopy(rendering_items)
-
-        for objects in enumerate(rendering_items_hrir):
-            if isinstance(objects[1], ObjectRenderingItem):
+    @property
+    def skipped_blocks(self):
+        """dict: number of convolution blocks skipped because of silence on
+        each path (hrir, brir and dirir)"""
+        return dict(hrir=self.convolver_hrir.skipped_blocks,
+                    brir=self.convolver_brir.skipped_blocks,
+                    dirir=self.convolver_dirir.skipped_blocks)
+
+    def delay(self, process_delay):
+        """Get the delay of the binaural rendering given the delay of the
+        virtual loudspeaker signals."""
+        return self.convolver_vbs_hrir.delay(process_delay)
+
+    def process_block_path(self, path, loudspeaker_signals):
+        """Convolve exactly block_size samples of the virtual loudspeaker
+        signals of one path; see process_block.
+
+        Returns:
+            array of (block_size, 2) floats: rendering of the path, which is
+            overwritten by the next call for the same path
+        """
+        out = self._block_outputs[path]
+        with profiling.stage(_convolve_stages[path]):
+            self._convolvers[path].filter_block(loudspeaker_signals, out=out)
+        return out
+
+    def process_block(self, loudspeaker_signals_brir, loudspeaker_signals_hrir,
+                      loudspeaker_signals_direct, out):
+        """Convolve exactly block_size samples of the virtual loudspeaker
+        signals of all three paths, without the delay added by process.
+
+        This uses the same convolver state as process, so only one of them
+        should be used for a given instance.
+
+        Parameters:
+            loudspeaker_signals_brir, loudspeaker_signals_hrir,
+                loudspeaker_signals_direct (array of (block_size, n) floats):
+                virtual loudspeaker signals for each path
+            out (array of (block_size, 2) floats): output for the summed
+                rendering
+        """
+        renderings = self.executor.map(
+            self.process_block_path, paths,
+            (loudspeaker_signals_brir, loudspeaker_signals_hrir,
+             loudspeaker_signals_direct))
+        self.mix(*renderings, out=out)
+
+    def process_path(self, path, loudspeaker_signals):
+        """Convolve the virtual loudspeaker signals of one path, with any
+        number of samples; see process.
+
+        Returns:
+            array of (n, 2) floats: rendering of the path
+        """
+        with profiling.stage(_convolve_stages[path]):
+            return self._convolvers_vbs[path].process(loudspeaker_signals)
+
+    """convolve the virtual loudspeaker signals of all three paths, return complete summed rendering"""
+    def process(self, loudspeaker_signals_brir, loudspeaker_signals_hrir,
+                loudspeaker_signals_direct):
+        renderings = self.executor.map(
+            self.process_path, paths,
+            (loudspeaker_signals_brir, loudspeaker_signals_hrir,
+             loudspeaker_signals_direct))
+        return self.mix(*renderings)
+
+    @staticmethod
+    def mix(brir_rendering, hrir_rendering, direct_rendering, out=None):
+        """Sum the renderings of the three paths.
+
+        Parameters:
+            brir_rendering, hrir_rendering, direct_rendering (array of (n, 2)
+                floats): output of process_path or process_block_path
+            out (array of (n, 2) floats or None): array to write to
+
+        Returns:
+            array of (n, 2) floats: out, or a new array if out is None
+        """
+        if out is None:
+            return (hrir_rendering + brir_rendering + direct_rendering) / 2
+
+        np.add(hrir_rendering, brir_rendering, out=out)
+        out += direct_rendering
+        out *= 0.5
+        return out
+
+
+def path_gain(block_format, path):
+    """Get the gain applied to an object block on one path, which depends on
+    the distance of the object: objects within 1m are faded from the BRIR path
+    to the HRIR path, and objects within 0.3m to the direct path.
+
+    Parameters:
+        block_format (AudioBlockFormatObjects): object block
+        path (str): hrir, brir or dirir
+
+    Returns:
+        float: gain to multiply the block gain by
+    """
+    position = block_format.position
+    if not isinstance(position, ObjectPolarPosition):
+        return 0.0 if path == "dirir" else 1.0
+
+    distance = position.distance
+    if path == "hrir":
+        return distance / 0.3 if distance <= 0.3 else 1.0
+    elif path == "brir":
+        if distance <= 0.2:
+            return 0.0
+        return (distance - 0.2) / 0.8 if distance <= 1 else 1.0
+    else:
+        return 1 - distance / 0.3 if distance <= 0.3 else 0.0
+
+
+def copy_metadata_source(metadata_source):
+    """Get a copy of metadata_source which can be read independently of it.
+    For MetadataSourceIter only the iterator is copied, not the metadata,
+    and this also applies to the sources wrapped by
+    MetadataSourceModifyBlockFormat and PathMetadataSource."""
+    if isinstance(metadata_source, MetadataSourceModifyBlockFormat):
+        return evolve(metadata_source,
+                      inner=copy_metadata_source(metadata_source.inner))
+    if isinstance(metadata_source, PathMetadataSource):
+        return PathMetadataSource(
+            copy_metadata_source(metadata_source.metadata_source),
+            metadata_source.path)
+    if isinstance(metadata_source, MetadataSourceIter):
+        other = copy.copy(metadata_source)
+        other.type_metadatas_iter = copy.copy(
+            metadata_source.type_metadatas_iter)
+        return other
+    return copy.deepcopy(metadata_source)
+
+
+class PathMetadataSource(MetadataSource):
+    """Object metadata for one path of the binaural rendering.
+
+    Blocks from the wrapped source are copied as they are read, with the gain
+    multiplied by path_gain and the distance set to 1; the metadata is not
+    modified.
+
+    Parameters:
+        metadata_source (MetadataSource): source of ObjectTypeMetadata; this
+            is read from, so should not be shared
+        path (str): hrir, brir or dirir
+    """
+    def __init__(self, metadata_source, path):
+        self.metadata_source = metadata_source
+        self.path = path
+
+    def get_next_block(self):
+        metadata = self.metadata_source.get_next_block()
+        if metadata is None:
+            return None
+
+        block_format = copy.copy(metadata.block_format)
+        block_format.gain = block_format.gain * path_gain(
+            block_format, self.path)
+        if isinstance(block_format.position, ObjectPolarPosition):
+            block_format.position = copy.copy(block_format.position)
+            block_format.position.distance = 1
+
+        return evolve(metadata, block_format=block_format)
+
+
+def rendering_items_for_path(rendering_items, path):
+    """Get the rendering items to render on one path.
+
+    These have their own metadata sources, so the items can be used for
+    several paths; objects have the distance-dependent gains for the path
+    applied (see PathMetadataSource). Only objects are rendered on the direct
+    path, even if other items are present, and objects whose gain on the path
+    is always zero are removed.
+
+    Parameters:
+        rendering_items (list of RenderingItem): items to render
+        path (str): hrir, brir or dirir
+
+    Returns:
+        list of RenderingItem
+    """
+    path_items = []
+    for item in rendering_items:
+        if isinstance(item, ObjectRenderingItem):
+            if _is_silent(item, path):
+                continue
+            metadata_source = PathMetadataSource(
+                copy_metadata_source(item.metadata_source), path)
+        elif path == "dirir":
+            continue
+        else:
+            metadata_source = copy_metadata_source(item.metadata_source)
+
+        path_items.append(evolve(item, metadata_source=metadata_source))
+
+    return path_items
+
+
+def _read_block_formats(metadata_source):
+    """Read the block formats of a copy of metadata_source, if they can be
+    read in advance, i.e. it is a MetadataSourceIter, possibly wrapped by
+    PathMetadataSource or the block format conversions applied by EAR
+    (MetadataSourceModifyBlockFormat).
+
+    Returns:
+        list of AudioBlockFormat, or None if the blocks can not be read in
+        advance
+    """
+    inner = metadata_source
+    while True:
+        if isinstance(inner, MetadataSourceModifyBlockFormat):
+            inner = inner.inner
+        elif isinstance(inner, PathMetadataSource):
+            inner = inner.metadata_source
+        elif isinstance(inner, MetadataSourceIter):
+            break
+        else:
+            return None
+
+    metadata_source = copy_metadata_source(metadata_source)
+    block_formats = []
+    while True:
+        metadata = metadata_source.get_next_block()
+        if metadata is None:
+            return block_formats
+        block_formats.append(metadata.block_format)
+
+
+def _is_point_source(rendering_item):
+    """Are all blocks of an object point sources (see is_point_source)?
+
+    This reads a copy of the metadata source rather than the blocks in the
+    adm_path, because the rendered blocks may differ from these, e.g. after
+    conversion to Cartesian. Objects whose blocks can not be read in advance
+    are not treated as point sources."""
+    block_formats = _read_block_formats(rendering_item.metadata_source)
+    return block_formats is not None and all(
+        is_point_source(block_format) for block_format in block_formats)
+
+
+def _is_silent(rendering_item, path):
+    """Is the gain of an object always zero on path?"""
+    if rendering_item.adm_path is None:
+        return False
+    return all(
+        block_format.gain * path_gain(block_format, path) == 0
+        for block_format in
+        rendering_item.adm_path.audioChannelFormat.audioBlockFormats)
+
+
+class VirtualLoudspeakerRenderer(object):
+    """Loudspeaker renderers of one type (e.g. ObjectRenderer) for the BRIR,
+    HRIR and direct virtual layouts, producing the input signals for
+    BinauralConvolver.
+
+    Parameters:
+        renderer_cls: EAR renderer class
+        hrir_layout, brir_layout, dirir_layout (Layout): virtual loudspeaker
+            layouts; see BinauralConvolver
+        renderer_opts (dict): options for renderer_cls
+        configure (callable): function to configure point source panners; see
+            binaural_point_source.configure
+        name (str or None): name of the type rendered, used in the profiling
+            stages of each path (render/<name>/<path>); the name of
+            renderer_cls by default
+        head_tracker (HeadTracker or None): if not None, the renderers apply
+            the head orientation from this; see head_tracking.track_renderer
+
+    Attributes:
+        active (dict): for each path (hrir, brir and dirir), whether the
+            renderer has any rendering items which are not always silent;
+            inactive renderers are not run
+        skipped_blocks (dict): number of calls to render in which each path was
+            not run
+    """
+    def __init__(self,
+                 renderer_cls,
+                 hrir_layout,
+                 brir_layout,
+                 dirir_layout,
+                 renderer_opts={},
+                 configure=binaural_point_source.configure,
+                 name=None,
+                 head_tracker=None):
 
-                for audioBlock in objects[1].adm_path.audioChannelFormat.audioBlockFormats[:]:
-                    if isinstance(audioBlock.position, ObjectPolarPosition):
-                        if audioBlock.position.distance <= 0.3:
-                            audioBlock.gain *= (audioBlock.position.distance / 0.3)
-                        audioBlock.position.distance = 1
+        point_source.configure = configure
 
-        return rendering_items_hrir
+        if name is None:
+            name = renderer_cls.__name__
+        self._stages = dict(
+            (path, "render/{}/{}".format(name, path)) for path in paths)
 
-    def filter_rendering_items_brir(self, rendering_items):
-        rendering_items_brir = copy.deepcopy(rendering_items)
+        """define three renderers"""
+        self.renderer_hrir = renderer_cls(hrir_layout, **renderer_opts)
+        self.renderer_brir = renderer_cls(brir_layout, **renderer_opts)
+        self.renderer_direct = renderer_cls(dirir_layout, **renderer_opts)
+        self._renderers = dict(hrir=self.renderer_hrir,
+                               brir=self.renderer_brir,
+                               dirir=self.renderer_direct)
+
+        self._nchannels = dict(hrir=len(hrir_layout.channels),
+                               brir=len(brir_layout.channels),
+                               dirir=len(dirir_layout.channels))
+        self.active = dict(hrir=False, brir=False, dirir=False)
+        self.skipped_blocks = dict(hrir=0, brir=0, dirir=0)
+        # read-only zeros, returned for inactive paths
+        self._silence = dict(hrir=None, brir=None, dirir=None)
+        self._head_tracker = head_tracker
+        if head_tracker is not None:
+            # point source panners for the rotated items on each path
+            self._layouts = dict(hrir=hrir_layout,
+                                 brir=brir_layout,
+                                 dirir=dirir_layout)
+            self._point_source_panners = dict(
+                (path, configure(layout.without_lfe))
+                for path, layout in self._layouts.items())
+
+    """sets rendering items for the three renderers; see rendering_items_for_path.
+    excluded_items maps paths to items of rendering_items which are not rendered on that path"""
+    def set_rendering_items(self, rendering_items, excluded_items={}):
+
+        for path, renderer in [("brir", self.renderer_brir),
+                               ("hrir", self.renderer_hrir),
+                               ("dirir", self.renderer_direct)]:
+            excluded = excluded_items.get(path, [])
+            items = rendering_items_for_path([
+                item for item in rendering_items
+                if not any(item is other for other in excluded)
+            ], path)
+            renderer.set_rendering_items(items)
+            if self._head_tracker is not None:
+                track_renderer(renderer, self._head_tracker,
+                               self._layouts[path],
+                               self._point_source_panners[path])
+            self.active[path] = len(items) > 0
 
-        for objects in enumerate(rendering_items_brir):
-            if isinstance(objects[1], ObjectRenderingItem):
+    @property
+    def overall_delay(self):
+        """delay of the loudspeaker signals; only the ObjectRenderer has one"""
+        return getattr(self.renderer_hrir, "overall_delay", 0)
+
+    def skip_metadata(self, sample_rate, start_sample):
+        """Read and interpret the metadata of all rendering items up to
+        start_sample without rendering any audio, so that render can be
+        called with start_sample next.
+
+        Parameters:
+            sample_rate (int): sample rate
+            start_sample (int): index of the next sample to render
+        """
+        for renderer in self._renderers.values():
+            for _, channel in renderer.block_processing_channels:
+                _skip_processing_blocks(channel, sample_rate, start_sample)
+
+    def render_path(self, path, sample_rate, start_sample, samples):
+        """Get the loudspeaker signals for one path (hrir, brir or dirir).
+
+        The renderers for different paths are independent, so this may be
+        called for several paths at once from different threads.
+        """
+        if self.active[path]:
+            with profiling.stage(self._stages[path]):
+                return self._renderers[path].render(sample_rate, start_sample,
+                                                    samples)
+
+        self.skipped_blocks[path] += 1
+        silence = self._silence[path]
+        if silence is None or len(silence) < len(samples):
+            silence = np.zeros((len(samples), self._nchannels[path]))
+            silence.flags.writeable = False
+            self._silence[path] = silence
+        return silence[:len(samples)]
+
+    """take output of all renderers, return the BRIR, HRIR and direct loudspeaker signals"""
+    def render(self, sample_rate, start_sample, samples):
+        return tuple(
+            self.render_path(path, sample_rate, start_sample, samples)
+            for path in paths)
+
+
+def _skip_processing_blocks(channel, sample_rate, start_sample):
+    """Remove the processing blocks of an EAR BlockProcessingChannel which end
+    before start_sample, interpreting metadata blocks as necessary."""
+    while True:
+        channel._refil_processing_queue(sample_rate)
+        if (not channel.processing_queue
+                or channel.processing_queue[0].last_sample > start_sample):
+            return
+        channel.processing_queue.popleft()
+
+
+def _object_parameters(type_metadata):
+    """Parameters of an object block used by ObjectHRIRRenderer, which are
+    interpolated between blocks in the same way as the gains of
+    ObjectRenderer: the gain, followed by the Cartesian direction."""
+    block_format = type_metadata.block_format
+    assert is_point_source(block_format), \
+        "ObjectHRIRRenderer can only render point sources"
+    position = block_format.position
+    return np.concatenate(([block_format.gain],
+                           cart(position.azimuth, position.elevation, 1.0)))
+
+
+class ObjectHRIRRenderer(object):
+    """Renders objects on the HRIR path by convolving each one with HRIRs
+    interpolated at its direction (see object_hrir.HRIRSet), rather than
+    panning them to the virtual loudspeakers. With fewer objects than virtual
+    loudspeakers this needs fewer convolutions, and objects between the
+    loudspeakers are not spread over several of them.
+
+    Only point sources can be rendered; see is_point_source. The gain and
+    direction of each object are interpolated between metadata blocks as
+    ObjectRenderer interpolates its gains, then the direction is averaged
+    over each convolution block to choose the HRIRs, which are crossfaded
+    when they change (see object_hrir.CrossfadingConvolver).
+
+    The objects are delayed by delay samples to match the ObjectRenderer, so
+    the output can be added to the output of the HRIR convolver of
+    BinauralConvolver: from render, which (like process_path) adds a delay of
+    block_size samples, or from process_block, which (like
+    process_block_path) does not.
+
+    Parameters:
+        get_hrir_set (callable): returns the HRIRSet to use; this is only
+            called when there are objects to render
+        block_size (int): block size for convolution
+        delay (int): delay of the ObjectRenderer (its overall_delay)
+        fft (FFT backend or None): see fft.get_fft_backend
+        dtype (str): real dtype for processing
+        head_tracker (HeadTracker or None): if not None, the directions are
+            rotated to follow the current head orientation
+
+    Attributes:
+        active (bool): whether there are any objects to render; render and
+            process_block must not be called if not
+    """
+    def __init__(self,
+                 get_hrir_set,
+                 block_size,
+                 delay,
+                 fft=None,
+                 dtype="float64",
+                 head_tracker=None):
+        self._get_hrir_set = get_hrir_set
+        self.block_size = block_size
+        self._delay_samples = delay
+        self._fft = fft
+        self._dtype = dtype
+        self._head_tracker = head_tracker
+
+        self.block_processing_channels = []
+        self.active = False
+        self._convolver = None
+        self._ones = np.ones(0)
+        # buffers for _object_signals, grown as needed
+        self._signals = np.zeros((0, 0))
+        self._parameters = np.zeros((0, 4))
 
-                for audioBlock in objects[1].adm_path.audioChannelFormat.audioBlockFormats[:]:
-                    if isinstance(audioBlock.position, ObjectPolarPosition):
-                        if audioBlock.position.distance <= 1 and audioBlock.position.distance > 0.2:
-                            audioBlock.gain *= (audioBlock.position.distance - 0.2) / 0.8
-                        if audioBlock.position.distance <= 0.2:
-                            audioBlock.gain = 0
-                        audioBlock.position.distance = 1
+    def set_rendering_items(self, rendering_items):
+        """Set the objects to render, which must be point sources on the
+        HRIR path; see rendering_items_for_path."""
+        self.block_processing_channels = [
+            (TrackProcessor(item.track_spec),
+             BlockProcessingChannel(item.metadata_source,
+                                    InterpretObjectMetadata(_object_parameters)))
+            for item in rendering_items
+        ]
+        n = len(rendering_items)
+        self.active = n > 0
+        if not self.active:
+            return
+
+        self._hrir_set = self._get_hrir_set()
+        # prepare the HRIRs needed at the positions of the blocks in advance;
+        # any others needed between them are prepared when first used
+        directions = []
+        for item in rendering_items:
+            block_formats = _read_block_formats(item.metadata_source)
+            for block_format in block_formats or []:
+                position = block_format.position
+                directions.append(
+                    cart(position.azimuth, position.elevation, 1.0))
+        if directions:
+            self._hrir_set.prepare(np.array(directions))
+        self._convolver = CrossfadingConvolver(self.block_size,
+                                               n,
+                                               self._hrir_set.hrirs.shape[2],
+                                               fft=self._fft,
+                                               dtype=self._dtype)
+        # HRIRSet.weights of the filters of each object, or -1 if not set
+        self._idxes = np.full((n, 3), -1)
+        self._weights = np.zeros((n, 3))
+
+        # the signal of each object, followed by the x, y and z components of
+        # their directions
+        self._delay = Delay(4 * n, self._delay_samples)
+        self._convolver_vbs = VariableBlockSizeAdapter(self.block_size,
+                                                       (4 * n, 2),
+                                                       self._process_block,
+                                                       in_place=True,
+                                                       dtype=self._dtype)
+        self._block_output = np.zeros((self.block_size, 2), dtype=self._dtype)
 
-        return rendering_items_brir
+    @property
+    def tail_length(self):
+        """int: number of samples for which a block of input affects the
+        output of process_block"""
+        if not self.active:
+            return 0
+        return self._convolver.tail_blocks * self.block_size
+
+    def skip_metadata(self, sample_rate, start_sample):
+        """Read and interpret the metadata up to start_sample without
+        rendering any audio; see VirtualLoudspeakerRenderer.skip_metadata."""
+        for _, channel in self.block_processing_channels:
+            _skip_processing_blocks(channel, sample_rate, start_sample)
+
+    def _object_signals(self, sample_rate, start_sample, samples):
+        """Get the delayed signals and directions of the objects; see
+        _delay."""
+        n_samples = len(samples)
+        n = len(self.block_processing_channels)
+        if len(self._ones) < n_samples:
+            self._ones = np.ones(n_samples)
+            self._parameters = np.zeros((n_samples, 4))
+        if self._signals.shape != (len(self._ones), 4 * n):
+            self._signals = np.zeros((len(self._ones), 4 * n))
+
+        # every column of signals is overwritten
+        signals = self._signals[:n_samples]
+        parameters = self._parameters[:n_samples]
+        for i, (track_processor,
+                channel) in enumerate(self.block_processing_channels):
+            parameters[:] = 0.0
+            channel.process(sample_rate, start_sample,
+                            self._ones[:n_samples], parameters)
+            parameters[:, 0] *= track_processor.process(sample_rate, samples)
+            signals[:, i::n] = parameters
+
+        return self._delay.process(signals)
+
+    def _process_block(self, signals, out=None):
+        """Convolve one block of the output of _object_signals."""
+        n = len(self.block_processing_channels)
+        directions = np.sum(signals[:, n:].reshape(len(signals), 3, n),
+                            axis=0).T
+        if self._head_tracker is not None:
+            directions = self._head_tracker.orientation.rotate(directions)
+
+        # objects which are not active in this block keep their filters
+        active = np.flatnonzero(np.linalg.norm(directions, axis=1) > 1e-9)
+        if len(active):
+            idxes, weights = self._hrir_set.weights(directions[active])
+            changed = (np.any(idxes != self._idxes[active], axis=1)
+                       | np.any(weights != self._weights[active], axis=1))
+            if np.any(changed):
+                changed_objects = active[changed]
+                self._idxes[changed_objects] = idxes[changed]
+                self._weights[changed_objects] = weights[changed]
+                self._convolver.set_filters(
+                    changed_objects,
+                    self._hrir_set.interpolate(idxes[changed],
+                                               weights[changed]))
+
+        return self._convolver.filter_block(signals[:, :n], out=out)
 
-    def filter_rendering_items_direct(self, rendering_items):
-        rendering_items_direct = copy.deepcopy(rendering_items)
+    def render(self, sample_rate, start_sample, samples):
+        """Render any number of samples; see VirtualLoudspeakerRenderer.render
+        and BinauralConvolver.process_path.
+
+        Returns:
+            array of (n, 2) floats: binaural rendering of the objects
+        """
+        with profiling.stage("render/objects/hrir_direct"):
+            return self._convolver_vbs.process(
+                self._object_signals(sample_rate, start_sample, samples))
+
+    def process_block(self, sample_rate, start_sample, samples):
+        """Render exactly block_size samples; see
+        BinauralConvolver.process_block_path.
+
+        Returns:
+            array of (block_size, 2) floats: binaural rendering of the
+            objects, which is overwritten by the next call
+        """
+        with profiling.stage("render/objects/hrir_direct"):
+            self._process_block(
+                self._object_signals(sample_rate, start_sample, samples),
+                self._block_output)
+        return self._block_output
+
+
+# names of the types rendered by the EAR renderers, used in profiling stages
+renderer_type_names = {
+    ObjectRenderer: "objects",
+    DirectSpeakersRenderer: "direct_speakers",
+    HOARenderer: "hoa",
+}
 
-        for objects in enumerate(rendering_items_direct):
-            if isinstance(objects[1], ObjectRenderingItem):
 
-                for audioBlock in objects[1].adm_path.audioChannelFormat.audioBlockFormats[:]:
-                    if isinstance(audioBlock.position, ObjectPolarPosition):
-                        if audioBlock.position.distance > 0.3:
-                            audioBlock.gain = 0
-                        if audioBlock.position.distance <= 0.3:
-                            audioBlock.gain *= 1 - (audioBlock.position.distance / 0.3)
-                        audioBlock.position.distance = 1
-                    else:
-                        audioBlock.gain = 0
+class BinauralWrapper(object):
+    """Wrapper around multiple loudspeaker renderers which returns the binaural rendering."""
+    @binaural_output_options.with_defaults
+    def __init__(self,
+                 renderer_cls,
+                 layout,
+                 virtual_layout,
+                 sr,
+                 renderer_opts={},
+                 **binaural_output_opts):
 
-            else:
-                rendering_items_direct = []
+        self.binaural_convolver = BinauralConvolver(virtual_layout, sr,
+                                                    **binaural_output_opts)
 
-        return rendering_items_direct
+        self.loudspeaker_renderer = \
+            self.binaural_convolver.loudspeaker_renderer(
+                renderer_cls,
+                renderer_opts=renderer_opts,
+                name=renderer_type_names.get(renderer_cls))
 
-    """sets rendering items and applies filtering"""
     def set_rendering_items(self, rendering_items):
+        self.loudspeaker_renderer.set_rendering_items(rendering_items)
+
+    def close(self):
+        """Stop any threads used by this renderer."""
+        self.binaural_convolver.close()
 
-        self.renderer_brir.set_rendering_items(self.filter_rendering_items_brir(rendering_items))
-        self.renderer_hrir.set_rendering_items(self.filter_rendering_items_hrir(rendering_items))
-        self.renderer_direct.set_rendering_items(self.filter_rendering_items_direct(rendering_items))
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
     @property
     def overall_delay(self):
         """check delays for all renderers"""
 
-        return self.convolver_vbs_hrir.delay(self.renderer_hrir.overall_delay)
-
-    """take output of all rednerers and convolve accordingly, return complete summed rendering"""
-    def render(self, sample_rate, start_sample, samples):
-
-        loudspeaker_signals_brir = self.renderer_brir.render(
-            sample_rate, start_sample, samples)
-        brir_rendering = self.convolver_vbs_brir.process(
-            loudspeaker_signals_brir)
+        return self.binaural_convolver.delay(
+            self.loudspeaker_renderer.overall_delay)
 
-        loudspeaker_signals_hrir = self.renderer_hrir.render(
-            sample_rate, start_sample, samples)
-        hrir_rendering = self.convolver_vbs_hrir.process(
-            loudspeaker_signals_hrir)
+    def _render_path(self, path, sample_rate, start_sample, samples):
+        return self.binaural_convolver.process_path(
+            path,
+            self.loudspeaker_renderer.render_path(path, sample_rate,
+                                                  start_sample, samples))
 
-        loudspeaker_signals_direct = self.renderer_direct.render(
-            sample_rate, start_sample, samples)
-        direct_rendering = self.convolver_vbs_dirir.process(
-            loudspeaker_signals_direct)
-
-        rendering = (hrir_rendering + brir_rendering + direct_rendering) / 2
+    """take output of all renderers and convolve accordingly, return complete summed rendering"""
+    def render(self, sample_rate, start_sample, samples):
 
-        return rendering
+        renderings = self.binaural_convolver.executor.map(
+            partial(self._render_path,
+                    sample_rate=sample_rate,
+                    start_sample=start_sample,
+                    samples=samples), paths)
+        return self.binaural_convolver.mix(*renderings)
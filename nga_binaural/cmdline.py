@@ -1,45 +1,104 @@
 import argparse
+import os
+import tempfile
+import numpy as np
 from .ear_cmdline_render_file import OfflineRenderDriver, handle_strict
-from pydub import AudioSegment
-from pydub.effects import normalize
 from ear.core import bs2051, layout
 from ear.fileio import openBw64, openBw64Adm
 from ear.fileio.bw64.chunks import FormatInfoChunk
 from ear.core.monitor import PeakMonitor
 from .binaural_layout import BinauralOutput
 from .renderer import BinauralRenderer
+from .binaural_wrapper import BinauralConvolver, binaural_output_options
+from .filter_cache import FilterCache
+from .segmented import _n_samples, render_input_file_segmented
+from .head_tracking import HeadOrientationFile
+from . import profiling
+from functools import partial
 from itertools import chain
 import sys
 
 """this is a modified version of render_file.py from the EAR. It was modified to adapt to the binaural rendering structure."""
 
+# level of the output peak after peak normalization, in dBFS
+peak_normalization_level_db = -0.3
+
+
+def _write_peak_normalized(outfile, output_blocks, output_monitor,
+                           block_size, tmp_dir):
+    """Write output_blocks to outfile, scaled such that the peak level is
+    peak_normalization_level_db.
+
+    The blocks are stored in a temporary file in tmp_dir while the peak level
+    is measured by output_monitor, then scaled while being copied to outfile,
+    so that memory use does not depend on the length of the output.
+    """
+    # float32 is exact enough for up to 24 bit output
+    dtype = np.float32 if outfile.bitdepth <= 24 else np.float64
+    frame_bytes = np.dtype(dtype).itemsize * outfile.channels
+
+    with tempfile.TemporaryFile(dir=tmp_dir) as tmp:
+        for output_block in output_blocks:
+            output_monitor.process(output_block)
+            with profiling.stage("write"):
+                tmp.write(output_block.astype(dtype).tobytes())
+
+        peak = np.max(output_monitor.peak_abs_linear)
+        gain = 10.0**(peak_normalization_level_db / 20.0) / peak if peak else 1.0
+
+        tmp.seek(0)
+        while True:
+            data = tmp.read(block_size * frame_bytes)
+            if not data:
+                break
+            samples = np.frombuffer(data, dtype=dtype)
+            with profiling.stage("write"):
+                outfile.write(samples.reshape(-1, outfile.channels) * gain)
+
+
 def _run(driver, input_file, output_file, peak_normalization):
-    """Render input_file to output_file."""
+    """Render input_file to output_file.
+
+    Returns:
+        PeakMonitor: peak levels of the output before normalization
+    """
     spkr_layout, upmix, n_channels = driver.load_output_layout(driver)
     virtual_layout = driver.target_layout
 
     output_monitor = PeakMonitor(n_channels)
 
-    with openBw64Adm(input_file, driver.enable_block_duration_fix) as infile:
+    with profiling.stage("adm"):
+        infile = openBw64Adm(input_file, driver.enable_block_duration_fix)
+    with infile:
+        profiling.add_audio(_n_samples(input_file), infile.sampleRate)
         formatInfo = FormatInfoChunk(formatTag=1,
                                      channelCount=n_channels,
                                      sampleRate=infile.sampleRate,
                                      bitsPerSample=infile.bitdepth)
         with openBw64(output_file, "w", formatInfo=formatInfo) as outfile:
-            for output_block in driver.render_input_file(driver, infile, spkr_layout, virtual_layout, upmix):
-                output_monitor.process(output_block)
-                outfile.write(output_block)
+            output_blocks = driver.render_input_file(driver, infile, spkr_layout, virtual_layout, upmix)
+            if peak_normalization:
+                _write_peak_normalized(
+                    outfile, output_blocks, output_monitor, driver.blocksize,
+                    os.path.dirname(os.path.abspath(output_file)))
+            else:
+                for output_block in output_blocks:
+                    output_monitor.process(output_block)
+                    with profiling.stage("write"):
+                        outfile.write(output_block)
 
     output_monitor.warn_overloaded()
     if driver.fail_on_overload and output_monitor.has_overloaded():
         sys.exit("error: output overloaded")
 
-    output = AudioSegment.from_file(output_file)
+    return output_monitor
+
+def _warm_filter_cache(driver, sample_rate):
+    """Prepare the filters for the target layout and sample rate, storing them
+    in the filter cache."""
+    BinauralConvolver(driver.target_layout, sample_rate,
+                      **driver.config["binaural_output_opts"])
 
-    if peak_normalization:
-        output = normalize(output, headroom=0.3)
-    
-    output.export(output_file, format="wav")
 
 def _load_binaural_output_layout(driver):
     spkr_layout = BinauralOutput()
@@ -60,26 +119,38 @@ def _render_input_file_binaural(driver, infile, spkr_layout, virtual_layout, upm
         Yields:
             2D sample blocks
         """
-    renderer = BinauralRenderer(spkr_layout,
-                                virtual_layout,
-                                sr=infile.sampleRate,
-                                **driver.config)
-    renderer.set_rendering_items(driver.get_rendering_items(infile.adm))
-
-    for input_samples in chain(infile.iter_sample_blocks(driver.blocksize),
-                               [None]):
-        if input_samples is None:
-            output_samples = renderer.get_tail(infile.sampleRate,
-                                               infile.channels)
-        else:
-            output_samples = renderer.render(infile.sampleRate, input_samples)
-
-        output_samples *= driver.output_gain_linear
-
-        if upmix is not None:
-            output_samples *= upmix
-
-        yield output_samples
+    with profiling.stage("setup"):
+        renderer = BinauralRenderer(spkr_layout,
+                                    virtual_layout,
+                                    sr=infile.sampleRate,
+                                    **driver.config)
+    with profiling.stage("adm"):
+        rendering_items = driver.get_rendering_items(infile.adm)
+    renderer.set_rendering_items(rendering_items)
+
+    head_orientations = getattr(driver, "head_orientations", None)
+
+    input_blocks = profiling.timed_iter(
+        "read", infile.iter_sample_blocks(driver.blocksize))
+    with renderer:
+        for input_samples in chain(input_blocks, [None]):
+            with profiling.stage("render"):
+                if input_samples is None:
+                    output_samples = renderer.get_tail(infile.sampleRate,
+                                                       infile.channels)
+                elif head_orientations is not None:
+                    output_samples = head_orientations.render(
+                        renderer, infile.sampleRate, input_samples)
+                else:
+                    output_samples = renderer.render(infile.sampleRate,
+                                                     input_samples)
+
+            output_samples *= driver.output_gain_linear
+
+            if upmix is not None:
+                output_samples *= upmix
+
+            yield output_samples
 
 
 def add_commands_for_offline_driver(parser):
@@ -122,6 +193,46 @@ def add_commands_for_offline_driver(parser):
         help='Apply conversion to Objects audioBlockFormats before rendering')
 
 
+def add_filter_cache_commands(parser):
+    parser.add_argument("--filter-cache",
+                        metavar="dir",
+                        help="directory to cache preprocessed filters in")
+    parser.add_argument("--filter-cache-size",
+                        metavar="size_mb",
+                        type=float,
+                        default=binaural_output_options.options[
+                            "filter_cache_max_size"].default / 2**20,
+                        help="maximum size of the filter cache in MiB "
+                        "(default: %(default)s)")
+
+
+def make_driver(args):
+    """Make an OfflineRenderDriver for binaural rendering from the arguments
+    added by add_commands_for_offline_driver and add_filter_cache_commands."""
+    driver = OfflineRenderDriver(
+        target_layout=args.system,
+        speakers_file=None,
+        output_gain_db=args.output_gain_db,
+        fail_on_overload=args.fail_on_overload,
+        enable_block_duration_fix=args.enable_block_duration_fix,
+        programme_id=args.programme,
+        complementary_object_ids=args.comp_object,
+        conversion_mode=args.apply_conversion,
+        config=dict(binaural_output_opts=dict(
+            filter_cache_dir=args.filter_cache,
+            filter_cache_max_size=int(args.filter_cache_size * 2**20),
+        )),
+    )
+
+    driver.load_output_layout = _load_binaural_output_layout
+    driver.render_input_file = _render_input_file_binaural
+    driver.run = _run
+    # HeadOrientationFile to follow, or None
+    driver.head_orientations = None
+
+    return driver
+
+
 def parse_command_line():
     parser = argparse.ArgumentParser(description="Binaural ADM renderer")
 
@@ -132,8 +243,8 @@ def parse_command_line():
 
     add_commands_for_offline_driver(parser)
 
-    parser.add_argument("input_file")
-    parser.add_argument("output_file")
+    parser.add_argument("input_file", nargs="?")
+    parser.add_argument("output_file", nargs="?")
 
     parser.add_argument("--peak_normalization",
                         "-pn",
@@ -144,7 +255,52 @@ def parse_command_line():
                         help="treat unknown ADM attributes as errors",
                         action="store_true")
 
+    parser.add_argument("-j",
+                        "--jobs",
+                        type=int,
+                        default=1,
+                        help="number of processes to render segments of the "
+                        "input file with in parallel (default: %(default)s)")
+    parser.add_argument("--segment-duration",
+                        metavar="seconds",
+                        type=float,
+                        help="maximum duration of the segments rendered with "
+                        "--jobs (default: the input duration divided by the "
+                        "number of jobs)")
+    parser.add_argument("--head-orientation",
+                        metavar="file",
+                        help="rotate the scene to follow the listener's head "
+                        "orientation over time, read from file; each line "
+                        "has a time in seconds followed by the yaw, pitch "
+                        "and roll in degrees")
+    parser.add_argument("--profile",
+                        metavar="report_file",
+                        help="measure the time spent in each stage of the "
+                        "rendering, and write a JSON report to report_file")
+
+    add_filter_cache_commands(parser)
+    parser.add_argument("--warm-filter-cache",
+                        metavar="sample_rate",
+                        type=int,
+                        nargs="?",
+                        const=48000,
+                        help="prepare the filters for the target system at "
+                        "sample_rate (default: %(const)s) and exit")
+    parser.add_argument("--clear-filter-cache",
+                        action="store_true",
+                        help="remove all filters from the filter cache and exit")
+
     args = parser.parse_args()
+
+    if (args.warm_filter_cache is not None
+            or args.clear_filter_cache) and args.filter_cache is None:
+        parser.error("--filter-cache is required to warm or clear the cache")
+    if (args.warm_filter_cache is None and not args.clear_filter_cache
+            and (args.input_file is None or args.output_file is None)):
+        parser.error("input_file and output_file are required")
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+
     return args
 
 
@@ -154,22 +310,32 @@ def render_file():
     handle_strict(args)
 
     try:
-        driver = OfflineRenderDriver(
-            target_layout=args.system,
-            speakers_file=None,
-            output_gain_db=args.output_gain_db,
-            fail_on_overload=args.fail_on_overload,
-            enable_block_duration_fix=args.enable_block_duration_fix,
-            programme_id=args.programme,
-            complementary_object_ids=args.comp_object,
-            conversion_mode=args.apply_conversion,
-        )
-
-        driver.load_output_layout = _load_binaural_output_layout
-        driver.render_input_file = _render_input_file_binaural
-        driver.run = _run
-
-        driver.run(driver, args.input_file, args.output_file, args.peak_normalization)
+        driver = make_driver(args)
+
+        if args.clear_filter_cache:
+            FilterCache(args.filter_cache, 0).clear()
+            return
+        if args.warm_filter_cache is not None:
+            _warm_filter_cache(driver, args.warm_filter_cache)
+            return
+        if args.head_orientation is not None:
+            driver.head_orientations = HeadOrientationFile(
+                args.head_orientation)
+            driver.config["binaural_output_opts"]["head_tracking"] = True
+        if args.jobs > 1:
+            driver.render_input_file = partial(
+                render_input_file_segmented,
+                input_file=args.input_file,
+                jobs=args.jobs,
+                segment_duration=args.segment_duration)
+
+        if args.profile is not None:
+            with profiling.profile() as profiler:
+                driver.run(driver, args.input_file, args.output_file,
+                           args.peak_normalization)
+            profiler.write(args.profile)
+        else:
+            driver.run(driver, args.input_file, args.output_file, args.peak_normalization)
     except Exception as error:
         if args.debug:
             raise
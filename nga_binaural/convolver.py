@@ -1,4 +1,5 @@
 import numpy as np
+from .fft import complex_dtype, numpy_fft
 
 class OverlapSaveConvolver(object):
     """Objects that convolve a signal with a filter in fixed-size blocks.
@@ -7,6 +8,8 @@ class OverlapSaveConvolver(object):
         nchannels (int): number of channels to process
         f (array of (n, nchannels) floats): specification of nchannels length n
             FIR filters to convolve the input channels with.
+        fft (FFT backend or None): see fft.get_fft_backend; numpy if None
+        dtype: real dtype for processing; float32 or float64
     Attributes:
         block_size (int): time domain block size for input and output blocks
         filter_blocks_fd (list of complex arrays): blocks of block_size samples
@@ -22,15 +25,17 @@ class OverlapSaveConvolver(object):
             previous block.
     """
 
-    def __init__(self, block_size, nchannels, f):
+    def __init__(self, block_size, nchannels, f, fft=None, dtype=np.float64):
         self.block_size = block_size
-        self.input_block = np.zeros((block_size * 2, nchannels))
+        self.fft = fft if fft is not None else numpy_fft
+        self.input_block = np.zeros((block_size * 2, nchannels), dtype=dtype)
 
         self.filter_blocks_fd = []
         self.blocks_fd = []
         for start in range(0, len(f), self.block_size):
             end = min(len(f), start + self.block_size)
-            block_fd = np.fft.rfft(f[start:end], self.block_size * 2, axis=0)
+            block_fd = self.fft.rfft(f[start:end], self.block_size * 2,
+                                     axis=0).astype(complex_dtype(dtype))
 
             self.filter_blocks_fd.append(block_fd)
             self.blocks_fd.append(np.zeros_like(block_fd))
@@ -47,12 +52,12 @@ class OverlapSaveConvolver(object):
         self.input_block[self.block_size:] = self.input_block[:self.block_size]
         self.input_block[:self.block_size] = in_block_td
 
-        in_block_fd = np.fft.rfft(self.input_block, axis=0)
+        in_block_fd = self.fft.rfft(self.input_block, axis=0)
 
         for filter_block, block in zip(self.filter_blocks_fd, self.blocks_fd):
             block += filter_block * in_block_fd
 
-        first_block_td = np.fft.irfft(self.blocks_fd[0], axis=0)
+        first_block_td = self.fft.irfft(self.blocks_fd[0], axis=0)
 
         self.blocks_fd[0][:] = 0.0
         self.blocks_fd.append(self.blocks_fd.pop(0))
@@ -70,11 +75,22 @@ class VariableBlockSizeAdapter(object):
         nchannels (tuple or int): Number of input and output channels for process_func.
         process_func (callable): Callback such that Y=process_func(X) processes
             an (block_size, n_in) array X, to produce an (block_size, n_out) array Y.
+        in_place (bool): if True, process_func is called as
+            process_func(X, out=Y) and must write its output to Y, so that no
+            arrays are allocated to hold it.
+        dtype: dtype of the buffers and of the output samples
     """
 
-    def __init__(self, block_size, nchannels, process_func):
+    def __init__(self,
+                 block_size,
+                 nchannels,
+                 process_func,
+                 in_place=False,
+                 dtype=np.float64):
         self.process_func = process_func
         self.block_size = block_size
+        self.in_place = in_place
+        self.dtype = dtype
 
         self.n_in, self.n_out = (nchannels if isinstance(nchannels, tuple)
                                  else (nchannels, nchannels))
@@ -82,23 +98,28 @@ class VariableBlockSizeAdapter(object):
         # store block_size samples, input samples followed by output samples:
         # - self.input_buffer[:self.buffer_input] stores unprocessed input samples
         # - self.output_buffer[self.buffer_input:] stores processed output samples
-        self.output_buffer = process_func(np.zeros((block_size, self.n_in)))
-        self.input_buffer = np.zeros((block_size, self.n_in))
+        self.output_buffer = np.zeros((block_size, self.n_out), dtype=dtype)
+        self.output_buffer[:] = process_func(
+            np.zeros((block_size, self.n_in), dtype=dtype))
+        self.input_buffer = np.zeros((block_size, self.n_in), dtype=dtype)
         self.buffer_input = 0
 
     def delay(self, process_delay):
         return self.block_size + process_delay
 
-    def process(self, input_samples):
+    def process(self, input_samples, out=None):
         """Process n samples.
 
         Parameters:
             input_samples (array of (n, n_in) floats): input samples
+            out (array of (n, n_out) floats or None): array to write the output
+                samples to; if None, a new array is allocated
 
         Returns:
             array of (n, n_out) floats: output samples
         """
-        output_samples = np.zeros((len(input_samples), self.n_out))
+        if out is None:
+            out = np.zeros((len(input_samples), self.n_out), dtype=self.dtype)
 
         # range of input and output samples that are yet to be processed
         n_done, n_input = 0, len(input_samples)
@@ -110,7 +131,7 @@ class VariableBlockSizeAdapter(object):
             buffer_slice = slice(self.buffer_input, self.buffer_input+to_xfer)
             samples_slice = slice(n_done, n_done + to_xfer)
 
-            output_samples[samples_slice] = self.output_buffer[buffer_slice]
+            out[samples_slice] = self.output_buffer[buffer_slice]
             self.input_buffer[buffer_slice] = input_samples[samples_slice]
 
             self.buffer_input += to_xfer
@@ -119,9 +140,14 @@ class VariableBlockSizeAdapter(object):
             # at this point the buffer is a full as it can be of input samples;
             # process these to turn them into output samples if we have enough
             if self.buffer_input == self.block_size:
-                self.output_buffer[:] = self.process_func(self.input_buffer)
+                if self.in_place:
+                    self.process_func(self.input_buffer,
+                                      out=self.output_buffer)
+                else:
+                    self.output_buffer[:] = self.process_func(
+                        self.input_buffer)
                 self.buffer_input = 0
 
         assert n_done == n_input
 
-        return output_samples
+        return out
@@ -0,0 +1,267 @@
+import os
+import tempfile
+import warnings
+import zipfile
+import numpy as np
+
+"""FFT backends used by the convolvers
+
+Each backend provides one-off transforms (rfft and irfft, as in numpy.fft),
+and planned transforms between fixed arrays: plan_rfft(input_array,
+output_array, axis) returns a function which writes the transform of the
+current contents of input_array to output_array. The convolvers plan their
+transforms once when they are created, so that backends which support it
+(pyFFTW) do not allocate while processing.
+"""
+
+
+class NumpyFFT(object):
+    """FFTs using numpy.fft; planned transforms compute a temporary result
+    which is copied to the output array."""
+    name = "numpy"
+
+    def rfft(self, x, n=None, axis=-1):
+        return np.fft.rfft(x, n, axis=axis)
+
+    def irfft(self, x, n=None, axis=-1):
+        return np.fft.irfft(x, n, axis=axis)
+
+    def plan_rfft(self, input_array, output_array, axis=-1):
+        """Plan a real-to-complex FFT along axis.
+
+        Parameters:
+            input_array (array of floats): input, with n samples along axis
+            output_array (array of complex): output, with n // 2 + 1 bins
+                along axis
+
+        Returns:
+            callable: function of no arguments performing the transform
+        """
+        def execute():
+            output_array[...] = self.rfft(input_array, axis=axis)
+
+        return execute
+
+    def plan_irfft(self, input_array, output_array, axis=-1):
+        """Plan a complex-to-real inverse FFT along axis. The contents of
+        input_array may be overwritten when the transform is performed.
+
+        Parameters:
+            input_array (array of complex): input, with n // 2 + 1 bins along
+                axis
+            output_array (array of floats): output, with n samples along axis
+
+        Returns:
+            callable: function of no arguments performing the transform
+        """
+        n = output_array.shape[axis]
+
+        def execute():
+            output_array[...] = self.irfft(input_array, n, axis=axis)
+
+        return execute
+
+
+class ScipyFFT(NumpyFFT):
+    """FFTs using scipy.fft, which can use several threads for transforms of
+    multiple channels.
+
+    Parameters:
+        threads (int): number of threads to use
+    """
+    name = "scipy"
+
+    def __init__(self, threads=1):
+        import scipy.fft
+        self._fft = scipy.fft
+        self.threads = threads
+
+    def rfft(self, x, n=None, axis=-1):
+        return self._fft.rfft(x, n, axis=axis, workers=self.threads)
+
+    def irfft(self, x, n=None, axis=-1):
+        return self._fft.irfft(x, n, axis=axis, workers=self.threads)
+
+
+class FFTWFFT(NumpyFFT):
+    """FFTs using pyFFTW. Planned transforms are computed directly into the
+    output arrays.
+
+    Planning with FFTW_MEASURE takes some time, so the accumulated FFTW wisdom
+    is saved to wisdom_file (if not None) after each new plan, and loaded from
+    it when this backend is created. The file is a .npz file with the wisdom
+    for each precision as an array of bytes (see save_wisdom); invalid files
+    are ignored with a warning.
+
+    Parameters:
+        threads (int): number of threads to use
+        wisdom_file (str or None): file to store FFTW wisdom in
+        planner_effort (str): FFTW planner flag
+    """
+    name = "pyfftw"
+
+    def __init__(self,
+                 threads=1,
+                 wisdom_file=None,
+                 planner_effort="FFTW_MEASURE"):
+        import pyfftw
+        import pyfftw.interfaces.numpy_fft
+        self._pyfftw = pyfftw
+        self._numpy_fft = pyfftw.interfaces.numpy_fft
+        self.threads = threads
+        self.wisdom_file = wisdom_file
+        self.planner_effort = planner_effort
+
+        if wisdom_file is not None and os.path.exists(wisdom_file):
+            wisdom = load_wisdom(wisdom_file)
+            if wisdom is not None:
+                pyfftw.import_wisdom(wisdom)
+        self._saved_wisdom = pyfftw.export_wisdom()
+
+    def rfft(self, x, n=None, axis=-1):
+        return self._numpy_fft.rfft(x, n, axis=axis, threads=self.threads)
+
+    def irfft(self, x, n=None, axis=-1):
+        return self._numpy_fft.irfft(x, n, axis=axis, threads=self.threads)
+
+    def _plan(self, input_array, output_array, axis, direction):
+        # planning may overwrite the arrays
+        saved_input, saved_output = input_array.copy(), output_array.copy()
+        plan = self._pyfftw.FFTW(input_array,
+                                 output_array,
+                                 axes=(axis, ),
+                                 direction=direction,
+                                 flags=(self.planner_effort, ),
+                                 threads=self.threads)
+        input_array[...] = saved_input
+        output_array[...] = saved_output
+
+        self._save_wisdom()
+
+        return plan
+
+    def _save_wisdom(self):
+        wisdom = self._pyfftw.export_wisdom()
+        if self.wisdom_file is None or wisdom == self._saved_wisdom:
+            return
+        self._saved_wisdom = wisdom
+
+        wisdom_dir = os.path.dirname(os.path.abspath(self.wisdom_file))
+        if not os.path.isdir(wisdom_dir):
+            os.makedirs(wisdom_dir)
+        fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", dir=wisdom_dir)
+        with os.fdopen(fd, "wb") as f:
+            save_wisdom(f, wisdom)
+        os.replace(tmp_path, self.wisdom_file)
+
+    def plan_rfft(self, input_array, output_array, axis=-1):
+        plan = self._plan(input_array, output_array, axis, "FFTW_FORWARD")
+        return plan.execute
+
+    def plan_irfft(self, input_array, output_array, axis=-1):
+        plan = self._plan(input_array, output_array, axis, "FFTW_BACKWARD")
+        scale = 1.0 / output_array.shape[axis]
+
+        def execute():
+            plan.execute()
+            np.multiply(output_array, scale, out=output_array)
+
+        return execute
+
+
+# names of the wisdom for each precision, in the order used by
+# pyfftw.export_wisdom
+_wisdom_names = ("double", "single", "long_double")
+
+
+def save_wisdom(f, wisdom):
+    """Save FFTW wisdom (from pyfftw.export_wisdom) to a .npz file, with the
+    wisdom for each precision as an array of bytes.
+
+    Parameters:
+        f (str or file): file to write to
+        wisdom (tuple of bytes): wisdom for each precision
+    """
+    np.savez(
+        f, **{
+            name: np.frombuffer(precision_wisdom, dtype=np.uint8)
+            for name, precision_wisdom in zip(_wisdom_names, wisdom)
+        })
+
+
+def load_wisdom(path):
+    """Load FFTW wisdom saved with save_wisdom.
+
+    Parameters:
+        path (str): file to read
+
+    Returns:
+        tuple of bytes: wisdom for each precision, for pyfftw.import_wisdom,
+        or None if the file is not valid, in which case a warning is issued
+    """
+    try:
+        with np.load(path, allow_pickle=False) as arrays:
+            wisdom = []
+            for name in _wisdom_names:
+                array = arrays[name]
+                if array.dtype != np.uint8 or array.ndim != 1:
+                    raise ValueError("bad wisdom array {}".format(name))
+                wisdom.append(array.tobytes())
+            return tuple(wisdom)
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile) as e:
+        warnings.warn("ignoring invalid FFTW wisdom file {}: {}".format(
+            path, e))
+        return None
+
+
+def complex_dtype(dtype):
+    """Get the complex dtype for spectra of real signals of dtype, i.e.
+    complex64 for float32 and complex128 for float64."""
+    return np.result_type(dtype, np.complex64)
+
+
+fft_backends = {
+    "numpy": NumpyFFT,
+    "scipy": ScipyFFT,
+    "pyfftw": FFTWFFT,
+}
+
+numpy_fft = NumpyFFT()
+
+_backends = {}
+
+
+def get_fft_backend(name, threads=1, wisdom_dir=None):
+    """Get an FFT backend, re-using one created previously in this process if
+    possible. If the backend can not be imported, a warning is issued and the
+    numpy backend is used instead.
+
+    Parameters:
+        name (str): key of fft_backends
+        threads (int): number of threads to use, if supported
+        wisdom_dir (str or None): directory to store FFTW wisdom in, if
+            supported
+
+    Returns:
+        backend object; see NumpyFFT
+    """
+    assert name in fft_backends, "unknown FFT backend {}".format(name)
+
+    key = (name, threads, wisdom_dir)
+    if key not in _backends:
+        if name == "numpy":
+            backend = numpy_fft
+        else:
+            kwargs = dict(threads=threads)
+            if name == "pyfftw" and wisdom_dir is not None:
+                kwargs["wisdom_file"] = os.path.join(wisdom_dir,
+                                                     "fftw_wisdom.npz")
+            try:
+                backend = fft_backends[name](**kwargs)
+            except ImportError:
+                warnings.warn(
+                    "FFT backend {} is not available; using numpy".format(name))
+                backend = numpy_fft
+        _backends[key] = backend
+
+    return _backends[key]
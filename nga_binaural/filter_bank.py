@@ -0,0 +1,397 @@
+import numpy as np
+from scipy import signal
+from . import sofa, profiling
+from .align_irs import align_irs, ir_onsets
+from .filter_cache import FilterCache, hash_file, layout_description
+from .matrix_convolver import (DelayGainConvolver, convolver_types,
+                               partition_filters, sparse_taps)
+
+"""loading of the impulse responses used by BinauralWrapper, and a cache of
+the resulting convolvers so that they can be shared between wrappers"""
+
+
+def _resample_irs(irs, fs, sr):
+    """Resample (n_irs, 2, n) IRs from fs to sr."""
+    if fs == sr:
+        return irs
+    return signal.resample(irs, int(irs.shape[2] / fs * sr), axis=2)
+
+
+def load_hrirs(hrir_file, layout, sr):
+    """Load HRIRs for the loudspeakers in layout; these are aligned, resampled
+    to sr and normalised.
+
+    Returns:
+        array of (n_channels, 2, n) floats
+    """
+    with profiling.stage("setup/load_sofa"):
+        hrir_sofa_file = sofa.SOFAFileHRIR(sofa.load_hdf5(hrir_file))
+        hrirs = hrir_sofa_file.irs_for_positions(layout.positions)
+    with profiling.stage("setup/align_irs"):
+        hrirs = align_irs(hrirs)
+    hrirs = _resample_irs(hrirs, hrir_sofa_file.check_fs(), sr)
+    hrirs = hrirs / sofa.calc_gain_of_irs(hrirs) * 0.20885643426029013 / 2
+
+    return hrirs
+
+
+class HRIRGrid(object):
+    """The HRIRs of all measurements in a SOFA file, prepared as
+    load_hrirs(hrir_file, layout, sr) prepares those for the loudspeakers in
+    layout: they are aligned and normalised such that the HRIRs of the
+    measurements used for the loudspeakers are the same as those returned by
+    load_hrirs, so that they can be used together.
+
+    The HRIRs are indexed like an array of (n_measurements, 2, n) floats, but
+    are only read from the file and prepared when they are first indexed, in
+    chunks of chunk_size consecutive measurements, so that the parts of the
+    file which are not used are not read. If cache is not None, the prepared
+    chunks are stored in it, and loaded from it if they were stored
+    previously.
+
+    Parameters:
+        hrir_file (str): SOFA file URL, see sofa.load_hdf5
+        layout (Layout): virtual loudspeaker layout
+        sr (int): sample rate
+        cache (FilterCache or None): cache for the prepared chunks
+        dtype (str): precision of the prepared HRIRs
+        chunk_size (int): number of measurements prepared at once
+
+    Attributes:
+        positions (array of (n_measurements, 3) floats): Cartesian
+            measurement positions
+        shape (tuple): shape of the HRIRs, (n_measurements, 2, n)
+        sofa_file (sofa.SOFAFileHRIR): the file the HRIRs are read from
+    """
+    def __init__(self,
+                 hrir_file,
+                 layout,
+                 sr,
+                 cache=None,
+                 dtype="float64",
+                 chunk_size=64):
+        self.sr = sr
+        self.dtype = dtype
+        self.chunk_size = chunk_size
+        self._chunks = {}
+
+        with profiling.stage("setup/load_sofa"):
+            self.sofa_file = sofa.SOFAFileHRIR(sofa.load_hdf5(hrir_file))
+            self.positions = self.sofa_file.source_positions()
+            layout_hrirs = self.sofa_file.irs_for_positions(layout.positions)
+
+        # the alignment and gain are determined by the measurements used for
+        # the loudspeakers, as in load_hrirs
+        with profiling.stage("setup/align_irs"):
+            self._reference_onsets = ir_onsets(layout_hrirs)
+            layout_hrirs = align_irs(layout_hrirs)
+        layout_hrirs = _resample_irs(layout_hrirs, self.sofa_file.check_fs(),
+                                     sr)
+        self._gain = 0.20885643426029013 / 2 / sofa.calc_gain_of_irs(
+            layout_hrirs)
+        self.shape = (len(self.positions), 2, layout_hrirs.shape[2])
+
+        self._cache = cache
+        if cache is not None:
+            self._cache_params = dict(
+                type="hrir_grid_chunk",
+                hrir_file=hash_file(sofa.resolve_file_url(hrir_file)),
+                layout=layout_description(layout),
+                sr=sr,
+                dtype=dtype,
+                chunk_size=chunk_size)
+
+    def _prepare_chunk(self, chunk):
+        """Read and prepare the HRIRs of one chunk of measurements.
+
+        Returns:
+            array of (k, 2, n) floats
+        """
+        start = chunk * self.chunk_size
+        stop = min(start + self.chunk_size, self.shape[0])
+        hrirs = self.sofa_file.irs_for_sources(np.arange(start, stop))
+        hrirs = align_irs(hrirs, reference_onsets=self._reference_onsets)
+        hrirs = _resample_irs(hrirs, self.sofa_file.check_fs(), self.sr)
+        return (hrirs * self._gain).astype(self.dtype)
+
+    def _get_chunk(self, chunk):
+        if chunk not in self._chunks:
+            with profiling.stage("hrir_grid"):
+                hrirs = None
+                if self._cache is not None:
+                    key = self._cache.key(chunk=int(chunk),
+                                          **self._cache_params)
+                    arrays = self._cache.load(key)
+                    if arrays is not None:
+                        hrirs = arrays["hrirs"]
+
+                if hrirs is None:
+                    hrirs = self._prepare_chunk(chunk)
+                    if self._cache is not None:
+                        self._cache.store(key, dict(hrirs=hrirs))
+
+                self._chunks[chunk] = hrirs
+
+        return self._chunks[chunk]
+
+    def __getitem__(self, idxes):
+        """Get the HRIRs of some measurements.
+
+        Parameters:
+            idxes (array of ints): measurement indices, of any shape
+
+        Returns:
+            array of idxes.shape + (2, n) floats
+        """
+        idxes = np.asarray(idxes)
+        flat_idxes = idxes.ravel()
+        chunks = flat_idxes // self.chunk_size
+
+        hrirs = np.empty((len(flat_idxes), ) + self.shape[1:],
+                         dtype=self.dtype)
+        for chunk in np.unique(chunks):
+            in_chunk = chunks == chunk
+            hrirs[in_chunk] = self._get_chunk(chunk)[flat_idxes[in_chunk] -
+                                                     chunk * self.chunk_size]
+
+        return hrirs.reshape(idxes.shape + self.shape[1:])
+
+
+def load_brirs(brir_file, layout, sr, delay):
+    """Load BRIRs for the loudspeakers in layout; these are resampled to sr,
+    normalised and delayed by delay samples to match the HRIRs.
+
+    Returns:
+        array of (n_channels, 2, n) floats
+    """
+    with profiling.stage("setup/load_sofa"):
+        brir_sofa_file = sofa.SOFAFileHRIR(sofa.load_hdf5(brir_file))
+        brirs = brir_sofa_file.irs_for_positions(layout.positions)
+    brirs = _resample_irs(brirs, brir_sofa_file.check_fs(), sr)
+    brirs = brirs / sofa.calc_gain_of_irs(brirs) * 0.05542830927315457 / 2
+    brirs = np.concatenate((np.zeros([len(brirs), 2, delay - 1]), brirs),
+                           axis=2)
+
+    return brirs
+
+
+def direct_irs(delay):
+    """Get the filters for the direct (near-field) path, which are a delay
+    matching the HRIRs and a fixed gain.
+
+    Returns:
+        array of (2, 2, delay) floats
+    """
+    dirirs = np.concatenate((np.zeros([2, 2, delay - 1]), np.ones([2, 2, 1])),
+                            axis=2)
+    return dirirs * 0.37
+
+
+def filter_matrix(irs):
+    """Turn an array of (n_in, n_out, n) impulse responses into a filter list
+    for the convolvers in matrix_convolver."""
+    return [(in_ch, out_ch, ir) for in_ch, ir_pair in enumerate(irs)
+            for out_ch, ir in enumerate(ir_pair)]
+
+
+class FilterBank(object):
+    """The convolvers used by BinauralWrapper for one set of virtual layouts.
+
+    Use `convolvers` to get convolvers for processing; these share the
+    frequency-domain filters held here, and only allocate their own state.
+
+    Paths whose filters are only a few impulses (normally the direct path) use
+    a DelayGainConvolver rather than the selected convolution engine.
+
+    If filter_cache_dir is not None, the preprocessed impulse responses (and
+    the partitioned filters for the vectorized convolver) are stored in a
+    FilterCache there, and loaded from it instead of being recomputed if they
+    were stored previously.
+
+    Parameters:
+        hrir_layout, brir_layout, dirir_layout (Layout): virtual loudspeaker
+            layouts for the HRIR, BRIR and direct paths
+        sr (int): sample rate
+        block_size (int): block size for convolution
+        convolver (str): convolution engine; key of convolver_types
+        max_partition_size (int): largest partition size for the nonuniform
+            convolver
+        hrir_file, brir_file (str): SOFA file URLs, see sofa.load_hdf5
+        filter_cache_dir (str or None): directory for a FilterCache
+        filter_cache_max_size (int): maximum size of the FilterCache in bytes
+        fft (FFT backend or None): FFT backend for the convolvers; see
+            fft.get_fft_backend
+        dtype (str): real dtype for processing; "float32" or "float64". The
+            filters are prepared at double precision, then stored (and cached)
+            at this precision.
+    """
+    paths = ("hrir", "brir", "dirir")
+
+    def __init__(self,
+                 hrir_layout,
+                 brir_layout,
+                 dirir_layout,
+                 sr,
+                 block_size,
+                 convolver,
+                 max_partition_size,
+                 hrir_file,
+                 brir_file,
+                 filter_cache_dir=None,
+                 filter_cache_max_size=0,
+                 fft=None,
+                 dtype="float64"):
+        assert convolver in convolver_types, "unknown convolver {}".format(
+            convolver)
+        assert dtype in ("float32", "float64"), "unknown dtype {}".format(
+            dtype)
+        self.layouts = dict(hrir=hrir_layout,
+                            brir=brir_layout,
+                            dirir=dirir_layout)
+
+        if filter_cache_dir is not None:
+            cache = FilterCache(filter_cache_dir, filter_cache_max_size)
+            key = cache.key(
+                hrir_file=hash_file(sofa.resolve_file_url(hrir_file)),
+                brir_file=hash_file(sofa.resolve_file_url(brir_file)),
+                layouts={
+                    path: layout_description(layout)
+                    for path, layout in self.layouts.items()
+                },
+                sr=sr,
+                block_size=block_size,
+                convolver=convolver,
+                dtype=dtype,
+            )
+            filters = cache.load(key)
+        else:
+            filters = None
+
+        if filters is None:
+            filters = self._prepare_filters(sr, block_size, convolver,
+                                            hrir_file, brir_file, dtype)
+            if filter_cache_dir is not None:
+                cache.store(key, filters)
+
+        for path in self.paths:
+            n_in = len(self.layouts[path].channels)
+            taps = sparse_taps(filter_matrix(filters[path]))
+            if taps is not None:
+                conv = DelayGainConvolver(block_size,
+                                          n_in,
+                                          2,
+                                          taps,
+                                          dtype=dtype)
+            elif convolver == "vectorized":
+                conv = convolver_types[convolver](
+                    block_size,
+                    n_in,
+                    2,
+                    None,
+                    filters_fd=filters[path + "_fd"],
+                    fft=fft,
+                    dtype=dtype)
+            elif convolver == "nonuniform":
+                conv = convolver_types[convolver](
+                    block_size,
+                    n_in,
+                    2,
+                    filter_matrix(filters[path]),
+                    max_block_size=max_partition_size,
+                    fft=fft,
+                    dtype=dtype)
+            else:
+                conv = convolver_types[convolver](block_size,
+                                                  n_in,
+                                                  2,
+                                                  filter_matrix(filters[path]),
+                                                  fft=fft,
+                                                  dtype=dtype)
+            setattr(self, "convolver_" + path, conv)
+
+    def _prepare_filters(self, sr, block_size, convolver, hrir_file,
+                         brir_file, dtype):
+        """Load the impulse responses for all paths.
+
+        Returns:
+            dict: impulse responses for each path (see paths), and their
+                partitions for the vectorized convolver (with "_fd" appended
+                to the path) unless they are sparse, with precision dtype
+        """
+        hrirs = load_hrirs(hrir_file, self.layouts["hrir"], sr)
+        delay = int(sofa.calc_delay_of_irs(hrirs))
+        brirs = load_brirs(brir_file, self.layouts["brir"], sr, delay)
+        dirirs = direct_irs(delay)
+
+        filters = dict(hrir=hrirs, brir=brirs, dirir=dirirs)
+
+        if convolver == "vectorized":
+            for path in self.paths:
+                if sparse_taps(filter_matrix(filters[path])) is not None:
+                    continue
+                filters[path + "_fd"] = partition_filters(
+                    block_size, len(self.layouts[path].channels), 2,
+                    filter_matrix(filters[path]), dtype)
+
+        for path in self.paths:
+            filters[path] = filters[path].astype(dtype)
+
+        return filters
+
+    def convolvers(self):
+        """Get new convolvers for the HRIR, BRIR and direct paths.
+
+        Returns:
+            tuple of 3 convolvers
+        """
+        return (self.convolver_hrir.clone(), self.convolver_brir.clone(),
+                self.convolver_dirir.clone())
+
+
+_filter_banks = {}
+
+
+def _layout_key(layout):
+    return layout.name, tuple(layout.channel_names)
+
+
+def get_filter_bank(hrir_layout,
+                    brir_layout,
+                    dirir_layout,
+                    sr,
+                    block_size,
+                    convolver,
+                    max_partition_size,
+                    hrir_file,
+                    brir_file,
+                    filter_cache_dir=None,
+                    filter_cache_max_size=0,
+                    fft=None,
+                    dtype="float64"):
+    """Get a FilterBank for the given parameters, re-using one created
+    previously in this process if possible.
+
+    Parameters are as for FilterBank.
+    """
+    key = (_layout_key(hrir_layout), _layout_key(brir_layout),
+           _layout_key(dirir_layout), sr, block_size, convolver,
+           max_partition_size, hrir_file, brir_file, fft, dtype)
+
+    if key not in _filter_banks:
+        with profiling.stage("setup/filters"):
+            _filter_banks[key] = FilterBank(
+                hrir_layout,
+                brir_layout,
+                dirir_layout,
+                sr,
+                block_size,
+                convolver,
+                max_partition_size,
+                hrir_file,
+                brir_file,
+                filter_cache_dir=filter_cache_dir,
+                filter_cache_max_size=filter_cache_max_size,
+                fft=fft,
+                dtype=dtype)
+
+    return _filter_banks[key]
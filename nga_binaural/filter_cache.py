@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+
+"""an on-disk cache of preprocessed filters, so that loading, aligning and
+partitioning the SOFA files can be skipped when the same filters have been
+used before"""
+
+# increment this when the preprocessing of the filters changes, so that old
+# cache entries are no longer used
+CACHE_VERSION = 2
+
+
+def hash_file(path, chunk_size=1 << 20):
+    """Get the SHA-256 hex digest of the contents of a file."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def layout_description(layout):
+    """Get a JSON-serialisable description of a loudspeaker layout for use in
+    cache keys."""
+    return dict(name=layout.name,
+                channel_names=list(layout.channel_names),
+                positions=layout.positions.tolist())
+
+
+class FilterCache(object):
+    """Directory of preprocessed filters.
+
+    Each entry is a sub-directory named by a hash of everything that affects
+    its contents, containing one .npy file per array. Entries are written to a
+    temporary directory and renamed into place, so that the cache can be used
+    by several processes at once. Loaded arrays are memory-mapped.
+
+    When the total size of the entries exceeds max_size, the least recently
+    used entries are removed.
+
+    Parameters:
+        path (str): cache directory; created if it does not exist
+        max_size (int): maximum total size of the entries in bytes
+    """
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+
+    def key(self, **params):
+        """Get the key for an entry depending on params, which must be
+        JSON-serialisable."""
+        params = dict(params, cache_version=CACHE_VERSION)
+        desc = json.dumps(params, sort_keys=True)
+        return hashlib.sha256(desc.encode("utf-8")).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key)
+
+    def load(self, key):
+        """Load an entry.
+
+        Returns:
+            dict mapping names to read-only arrays, or None if the entry does
+            not exist
+        """
+        entry_path = self._entry_path(key)
+        try:
+            names = os.listdir(entry_path)
+        except OSError:
+            return None
+
+        # mark as recently used
+        os.utime(entry_path, None)
+
+        return {
+            os.path.splitext(name)[0]:
+            np.load(os.path.join(entry_path, name), mmap_mode="r")
+            for name in names if name.endswith(".npy")
+        }
+
+    def store(self, key, arrays):
+        """Store an entry, then remove old entries if the cache is too large.
+
+        Parameters:
+            key (str): key from self.key
+            arrays (dict): mapping from names to arrays
+        """
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+        tmp_path = tempfile.mkdtemp(prefix=".tmp-", dir=self.path)
+        try:
+            for name, array in arrays.items():
+                np.save(os.path.join(tmp_path, name + ".npy"), array)
+            os.rename(tmp_path, self._entry_path(key))
+        except OSError:
+            # another process stored the same entry first
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            if not os.path.isdir(self._entry_path(key)):
+                raise
+
+        self.evict()
+
+    def entries(self):
+        """Get the entries in the cache.
+
+        Returns:
+            list of (path, last use time, size in bytes) tuples, least recently
+            used first
+        """
+        if not os.path.isdir(self.path):
+            return []
+
+        entries = []
+        for name in os.listdir(self.path):
+            entry_path = os.path.join(self.path, name)
+            if name.startswith(".") or not os.path.isdir(entry_path):
+                continue
+            size = sum(
+                os.path.getsize(os.path.join(entry_path, f))
+                for f in os.listdir(entry_path))
+            entries.append((entry_path, os.path.getmtime(entry_path), size))
+
+        return sorted(entries, key=lambda entry: entry[1])
+
+    def evict(self):
+        """Remove least recently used entries until the cache is no larger than
+        max_size."""
+        entries = self.entries()
+        total_size = sum(size for _, _, size in entries)
+
+        for entry_path, _, size in entries:
+            if total_size <= self.max_size:
+                break
+            shutil.rmtree(entry_path, ignore_errors=True)
+            total_size -= size
+
+    def clear(self):
+        """Remove all entries."""
+        for entry_path, _, _ in self.entries():
+            shutil.rmtree(entry_path, ignore_errors=True)
@@ -0,0 +1,575 @@
+from functools import partial
+import math
+import numpy as np
+from attr import attrs, attrib, evolve
+from ear.common import azimuth, cart, elevation
+from ear.core import hoa
+from ear.core.direct_speakers.renderer import DirectSpeakersRenderer
+from ear.core.objectbased import conversion
+from ear.core.objectbased.renderer import ObjectRenderer
+from ear.core.renderer_common import FixedGains, InterpGains, ProcessingBlock
+from ear.core.scenebased.renderer import FixedMatrix, HOARenderer
+from .binaural_point_source import is_point_source
+
+"""head-tracked rendering, by rotating the scene before the EAR renderers
+
+The orientation of the listener's head is applied to the metadata of each
+rendering item rather than to the filters, so the filter banks are not
+changed: objects are panned to their rotated positions, DirectSpeakers
+channels (apart from LFE channels) are panned as point sources at their
+rotated positions, and HOA decoder matrices are combined with a rotation of
+the HOA signals. When the orientation changes, each renderer crossfades between the
+gains for the previous and the new orientation over one block.
+
+HeadTracker holds the orientation; track_renderer makes an EAR renderer use
+it. The gains for each metadata block are calculated for an orientation the
+first time they are needed, so the cost of an orientation change is one gain
+calculation per rendering item and path, plus the crossfade. Point sources
+and DirectSpeakers channels are panned with the point source panner of each
+path directly, which is much cheaper with panning tables, and HOA rotation
+matrices are shared between items; HeadTracker can also limit how often the
+orientation changes.
+"""
+
+
+def rotation_matrix(yaw, pitch, roll):
+    """Get the rotation from head-relative to world coordinates for a head
+    orientation.
+
+    The head is turned by yaw, then tilted by pitch, then rolled by roll.
+    Coordinates are as for ADM Cartesian positions: X to the right, Y to the
+    front and Z up.
+
+    Parameters:
+        yaw (float): rotation about the Z axis in degrees; positive values
+            turn the head to the left, as for ADM azimuths
+        pitch (float): rotation about the X axis in degrees; positive values
+            tilt the head up
+        roll (float): rotation about the Y axis in degrees; positive values
+            tilt the head to the right
+
+    Returns:
+        array of (3, 3) floats
+    """
+    yaw, pitch, roll = np.radians([yaw, pitch, roll])
+    rz = np.array([[np.cos(yaw), -np.sin(yaw), 0.0],
+                   [np.sin(yaw), np.cos(yaw), 0.0],
+                   [0.0, 0.0, 1.0]])
+    rx = np.array([[1.0, 0.0, 0.0],
+                   [0.0, np.cos(pitch), -np.sin(pitch)],
+                   [0.0, np.sin(pitch), np.cos(pitch)]])
+    ry = np.array([[np.cos(roll), 0.0, np.sin(roll)],
+                   [0.0, 1.0, 0.0],
+                   [-np.sin(roll), 0.0, np.cos(roll)]])
+    return rz.dot(rx).dot(ry)
+
+
+class HeadOrientation(object):
+    """One orientation of the listener's head.
+
+    Attributes:
+        yaw, pitch, roll (float): see rotation_matrix
+        matrix (array of (3, 3) floats or None): rotation from world to
+            head-relative coordinates, which is applied to the scene; None if
+            the head is not rotated
+    """
+    def __init__(self, yaw=0.0, pitch=0.0, roll=0.0):
+        self.yaw, self.pitch, self.roll = yaw, pitch, roll
+        if yaw == 0 and pitch == 0 and roll == 0:
+            self.matrix = None
+        else:
+            self.matrix = rotation_matrix(yaw, pitch, roll).T
+
+    def rotate(self, positions):
+        """Rotate Cartesian positions (along the last axis) to head-relative
+        coordinates."""
+        if self.matrix is None:
+            return positions
+        return np.dot(positions, self.matrix.T)
+
+
+class HeadTracker(object):
+    """Orientation of the listener's head for each block rendered by
+    renderers set up with track_renderer.
+
+    set_orientation changes the orientation used from the next call to
+    next_block, which the binaural renderers call before rendering each
+    block. In the block after a change, the output is crossfaded from the
+    rendering with the previous orientation to the rendering with the new one,
+    except for the first block, which uses the orientation set before it.
+
+    Each change recalculates the gains of all rendering items, so changes can
+    be limited to one every min_interval blocks; an orientation set sooner is
+    used once the interval has passed.
+
+    Parameters:
+        min_interval (int): minimum number of blocks between changes
+
+    Attributes:
+        orientation (HeadOrientation): orientation for the current block
+        previous_orientation (HeadOrientation): orientation for the previous
+            block
+    """
+    def __init__(self, min_interval=1):
+        assert min_interval >= 1, "min_interval must be at least 1"
+        self.min_interval = min_interval
+        self.orientation = HeadOrientation()
+        self.previous_orientation = self.orientation
+        self._next_orientation = self.orientation
+        self._started = False
+        self._blocks_since_change = min_interval
+        # linear ramps for crossfading, for each block size
+        self._ramps = {}
+
+    def set_orientation(self, yaw, pitch, roll):
+        """Set the orientation for the following blocks; see
+        rotation_matrix."""
+        current = self._next_orientation
+        if (yaw, pitch, roll) != (current.yaw, current.pitch, current.roll):
+            self._next_orientation = HeadOrientation(yaw, pitch, roll)
+
+    def next_block(self):
+        """Start a new block, using the orientation last set if min_interval
+        blocks have passed since the last change."""
+        if not self._started:
+            self.orientation = self._next_orientation
+            self._started = True
+        self.previous_orientation = self.orientation
+
+        self._blocks_since_change += 1
+        if (self._next_orientation is not self.orientation
+                and self._blocks_since_change >= self.min_interval):
+            self.orientation = self._next_orientation
+            self._blocks_since_change = 0
+
+    def fades(self, n):
+        """Get the orientations to render a block of n samples with, and the
+        gain to apply to the input for each.
+
+        Returns:
+            list of (HeadOrientation, array of n floats or None) tuples; None
+            means a gain of 1
+        """
+        if self.previous_orientation is self.orientation:
+            return [(self.orientation, None)]
+
+        ramp = self._ramps.get(n)
+        if ramp is None:
+            ramp = (np.arange(n) + 1.0) / n
+            self._ramps = {n: ramp}
+        return [(self.previous_orientation, 1.0 - ramp),
+                (self.orientation, ramp)]
+
+
+class HeadOrientationFile(object):
+    """Head orientations read from a text file.
+
+    Each line contains a time in seconds followed by the yaw, pitch and roll
+    in degrees (see rotation_matrix), separated by whitespace or commas, in
+    order of time. Blank lines and lines starting with # are ignored. Each
+    orientation is used from its time until the time on the next line; the
+    first is also used before its time.
+
+    Parameters:
+        path (str): file to read
+    """
+    def __init__(self, path):
+        with open(path) as f:
+            rows = [
+                [float(value) for value in line.replace(",", " ").split()]
+                for line in f
+                if line.strip() and not line.lstrip().startswith("#")
+            ]
+        assert rows, "no head orientations in {}".format(path)
+        assert all(len(row) == 4 for row in rows), \
+            "head orientation lines must have a time, yaw, pitch and roll"
+        rows = np.array(rows)
+        assert np.all(np.diff(rows[:, 0]) >= 0), \
+            "head orientations must be in order of time"
+
+        self.times = rows[:, 0]
+        self.orientations = rows[:, 1:]
+
+    def at(self, time):
+        """Get the orientation at a time in seconds.
+
+        Returns:
+            tuple: yaw, pitch and roll in degrees
+        """
+        return self._orientation(
+            np.searchsorted(self.times, time, side="right") - 1)
+
+    def _orientation(self, i):
+        return tuple(float(value) for value in self.orientations[max(i, 0)])
+
+    def changes(self, sample_rate, start_sample, end_sample):
+        """Get the orientations used for samples start_sample to end_sample,
+        where each orientation starts at the first sample at or after its
+        time.
+
+        Returns:
+            list of (int, tuple) tuples: the first sample of each orientation,
+            starting with start_sample, and its yaw, pitch and roll
+        """
+        first_samples = np.maximum(np.ceil(self.times * sample_rate),
+                                   0).astype(int)
+        # the first orientation is also used before its time
+        first_samples[0] = 0
+        i = np.searchsorted(first_samples, start_sample, side="right") - 1
+        changes = [(start_sample, self._orientation(i))]
+
+        # with several orientations at one sample, the last is used
+        for j in range(i + 1, len(first_samples)):
+            if first_samples[j] >= end_sample:
+                break
+            if first_samples[j] == changes[-1][0]:
+                changes[-1] = (first_samples[j], self._orientation(j))
+            else:
+                changes.append((int(first_samples[j]), self._orientation(j)))
+        return changes
+
+    def render(self, renderer, sample_rate, samples):
+        """Render a block of samples with a head-tracked BinauralRenderer,
+        splitting it so that each orientation is used from its time.
+
+        The renderer crossfades each change over the samples rendered in one
+        call, so a change is crossfaded until the next change or the end of
+        samples, whichever is first.
+
+        Returns:
+            2D array: output of renderer.render for all samples
+        """
+        start = renderer.start_sample
+        changes = self.changes(sample_rate, start, start + len(samples))
+        ends = [change_start for change_start, _ in changes[1:]]
+        ends.append(start + len(samples))
+
+        outputs = []
+        for (change_start, orientation), end in zip(changes, ends):
+            renderer.set_head_orientation(*orientation)
+            outputs.append(
+                renderer.render(sample_rate,
+                                samples[change_start - start:end - start]))
+        return np.concatenate(outputs)
+
+
+class _TrackedGains(object):
+    """Gains (or a matrix) for one metadata block, calculated for each head
+    orientation when first needed.
+
+    Parameters:
+        calc_gains (callable): called with a HeadOrientation to calculate the
+            gains
+    """
+    __slots__ = ("calc_gains", "_cache")
+
+    def __init__(self, calc_gains):
+        self.calc_gains = calc_gains
+        self._cache = []
+
+    def get(self, orientation):
+        for cached_orientation, gains in self._cache:
+            if cached_orientation is orientation:
+                return gains
+        gains = self.calc_gains(orientation)
+        # only the current and previous orientations are used at once
+        self._cache = [self._cache[-1], (orientation, gains)
+                       ] if self._cache else [(orientation, gains)]
+        return gains
+
+
+def _faded(samples, fade, ovl_samples):
+    """Get samples[ovl_samples], multiplied by fade (see HeadTracker.fades)
+    along the first axis."""
+    if fade is None:
+        return samples[ovl_samples]
+    if samples.ndim == 1:
+        return samples[ovl_samples] * fade[ovl_samples]
+    return samples[ovl_samples] * fade[ovl_samples, np.newaxis]
+
+
+@attrs(slots=True, frozen=True)
+class _TrackedFixedGains(ProcessingBlock):
+    """FixedGains with _TrackedGains."""
+    gains = attrib()
+    tracker = attrib()
+
+    def process(self, start_sample, input_samples, output_samples):
+        ovl_state, ovl_samples = self.overlap(start_sample, len(input_samples))
+
+        for orientation, fade in self.tracker.fades(len(input_samples)):
+            output_samples[ovl_samples] += (
+                _faded(input_samples, fade, ovl_samples)[:, np.newaxis] *
+                self.gains.get(orientation)[np.newaxis])
+
+
+@attrs(slots=True, frozen=True)
+class _TrackedInterpGains(InterpGains):
+    """InterpGains with _TrackedGains."""
+    tracker = attrib(default=None)
+
+    def process(self, start_sample, input_samples, output_samples):
+        ovl_state, ovl_samples = self.overlap(start_sample, len(input_samples))
+
+        for orientation, fade in self.tracker.fades(len(input_samples)):
+            block_samples = _faded(input_samples, fade, ovl_samples)
+
+            if self.gains_start is not None:
+                input_fade_down = block_samples * (1.0 -
+                                                   self._interp_p[ovl_state])
+                output_samples[ovl_samples] += (
+                    input_fade_down[:, np.newaxis] *
+                    self.gains_start.get(orientation)[np.newaxis])
+
+            if self.gains_end is not None:
+                input_fade_up = block_samples * self._interp_p[ovl_state]
+                output_samples[ovl_samples] += (
+                    input_fade_up[:, np.newaxis] *
+                    self.gains_end.get(orientation)[np.newaxis])
+
+
+@attrs(slots=True, frozen=True)
+class _TrackedFixedMatrix(FixedMatrix):
+    """FixedMatrix with a _TrackedGains matrix."""
+    tracker = attrib(default=None)
+
+    def process(self, start_sample, input_samples, output_samples):
+        ovl_state, ovl_samples = self.overlap(start_sample, len(input_samples))
+
+        for orientation, fade in self.tracker.fades(len(input_samples)):
+            output_samples[ovl_samples, self.output_channels] += np.dot(
+                _faded(input_samples, fade, ovl_samples),
+                self.matrix.get(orientation).T)
+
+
+def rotate_direction(orientation, azimuth, elevation):
+    """Rotate a direction to head-relative coordinates.
+
+    Parameters:
+        orientation (HeadOrientation): orientation of the head
+        azimuth, elevation (float): direction in degrees
+
+    Returns:
+        tuple: rotated azimuth and elevation in degrees
+    """
+    if orientation.matrix is None:
+        return azimuth, elevation
+    az, el = math.radians(azimuth), math.radians(elevation)
+    x, y, z = orientation.matrix.dot(
+        (-math.sin(az) * math.cos(el), math.cos(az) * math.cos(el),
+         math.sin(el)))
+    return (-math.degrees(math.atan2(x, y)),
+            math.degrees(math.atan2(z, math.hypot(x, y))))
+
+
+def rotate_object_metadata(type_metadata, orientation):
+    """Rotate the position of an ObjectTypeMetadata to head-relative
+    coordinates. Cartesian positions are converted to polar positions
+    first."""
+    if orientation.matrix is None:
+        return type_metadata
+
+    block_format = conversion.to_polar(type_metadata.block_format)
+    position = block_format.position
+    azimuth, elevation = rotate_direction(orientation, position.azimuth,
+                                          position.elevation)
+    return evolve(type_metadata,
+                  block_format=evolve(block_format,
+                                      position=evolve(position,
+                                                      azimuth=azimuth,
+                                                      elevation=elevation)))
+
+
+def _fibonacci_points(n):
+    """Get n roughly evenly spaced unit vectors."""
+    i = np.arange(n) + 0.5
+    z = 1.0 - 2.0 * i / n
+    angle = np.pi * (1.0 + 5.0**0.5) * i
+    r = np.sqrt(1.0 - z**2)
+    return np.stack((r * np.cos(angle), r * np.sin(angle), z), axis=-1)
+
+
+# for each set of HOA channels, the points to find rotation matrices with and
+# the pseudo-inverse of the spherical harmonics at those points
+_hoa_rotation_bases = {}
+# for each set of HOA channels, the rotation matrices for the last two
+# orientations, shared between the items and paths using them
+_hoa_rotation_matrices = {}
+
+
+def _sph_harm(points, orders, degrees, norm):
+    """Get the spherical harmonics for each channel at Cartesian points.
+
+    Returns:
+        array of (n_points, n_channels) floats
+    """
+    az = np.radians(azimuth(points))[:, np.newaxis]
+    el = np.radians(elevation(points))[:, np.newaxis]
+    return hoa.sph_harm(orders[np.newaxis], degrees[np.newaxis], az, el, norm)
+
+
+def hoa_rotation_matrix(orders, degrees, normalization, orientation):
+    """Get a matrix which rotates HOA signals to head-relative coordinates.
+
+    The matrix is found by sampling the spherical harmonics at a set of
+    points and at the rotated points, which is exact if the channels contain
+    all degrees of each order present.
+
+    Parameters:
+        orders, degrees (list of int): order and degree of each channel
+        normalization (str): normalization of the channels; see
+            ear.core.hoa.norm_functions
+        orientation (HeadOrientation): orientation to rotate for
+
+    Returns:
+        array of (n_channels, n_channels) floats: matrix to apply to column
+        vectors of channel values
+    """
+    orders, degrees = np.array(orders), np.array(degrees)
+    norm = hoa.norm_functions[normalization]
+
+    key = (tuple(orders), tuple(degrees), normalization)
+    cached = _hoa_rotation_matrices.get(key, [])
+    for cached_orientation, matrix in cached:
+        if cached_orientation is orientation:
+            return matrix
+
+    if key not in _hoa_rotation_bases:
+        points = _fibonacci_points(4 * len(orders) + 8)
+        _hoa_rotation_bases[key] = (points,
+                                    np.linalg.pinv(
+                                        _sph_harm(points, orders, degrees,
+                                                  norm)))
+    points, sh_pinv = _hoa_rotation_bases[key]
+
+    # a source at a point is heard at the rotated point, so the rotated signals
+    # at a point are the original signals at the inverse rotation of it
+    sh_rotated = _sph_harm(np.dot(points, orientation.matrix), orders, degrees,
+                           norm)
+    matrix = sh_pinv.dot(sh_rotated)
+    _hoa_rotation_matrices[key] = cached[-1:] + [(orientation, matrix)]
+    return matrix
+
+
+def _object_gains(calc_gains, layout, psp, type_metadata, orientation):
+    if orientation.matrix is None or not is_point_source(
+            type_metadata.block_format):
+        return calc_gains(rotate_object_metadata(type_metadata, orientation))
+
+    # for point sources ObjectRenderer only pans to the direction, so the
+    # point source panner (possibly a panning table) can be used directly
+    block_format = type_metadata.block_format
+    position = block_format.position
+    direct = np.zeros(len(layout.channels))
+    direct[~layout.is_lfe] = psp.handle(
+        orientation.rotate(cart(position.azimuth, position.elevation,
+                                1.0))) * block_format.gain
+    return np.concatenate((direct, np.zeros_like(direct)))
+
+
+def _direct_speakers_gains(gains, layout, psp, type_metadata, orientation):
+    if orientation.matrix is None:
+        return gains
+
+    # the channel is a point source at its rotated position, rather than
+    # being routed to a loudspeaker with a matching label
+    rotated_gains = np.zeros(len(layout.channels))
+    rotated_gains[~layout.is_lfe] = psp.handle(
+        orientation.rotate(
+            type_metadata.block_format.position.as_cartesian_array()))
+    return rotated_gains
+
+
+def _hoa_matrix(design_decoder, type_metadata):
+    decoder = design_decoder(type_metadata)
+
+    def calc_matrix(orientation):
+        if orientation.matrix is None:
+            return decoder
+        return decoder.dot(
+            hoa_rotation_matrix(type_metadata.orders, type_metadata.degrees,
+                                type_metadata.normalization, orientation))
+
+    return calc_matrix
+
+
+def _tracked_object_gains(calc_gains, layout, psp, block):
+    return _TrackedGains(
+        partial(_object_gains, calc_gains, layout, psp, block))
+
+
+def _tracked_direct_speakers_gains(calc_gains, layout, psp, block):
+    gains = calc_gains(block)
+    # LFE channels are not directional, so are always routed as usual
+    if not np.any(gains[~layout.is_lfe]):
+        return _TrackedGains(lambda orientation: gains)
+    return _TrackedGains(
+        partial(_direct_speakers_gains, gains, layout, psp, block))
+
+
+class _TrackedInterpretMetadata(object):
+    """Wrapper around an EAR Interpret*Metadata instance, whose gains must
+    be _TrackedGains, which converts the ProcessingBlocks it produces to the
+    tracked versions."""
+    def __init__(self, interpret_metadata, tracker):
+        self.interpret_metadata = interpret_metadata
+        self.tracker = tracker
+
+    def __call__(self, sample_rate, block):
+        for processing_block in self.interpret_metadata(sample_rate, block):
+            if isinstance(processing_block, InterpGains):
+                yield _TrackedInterpGains(processing_block.start_sample,
+                                          processing_block.end_sample,
+                                          processing_block.gains_start,
+                                          processing_block.gains_end,
+                                          tracker=self.tracker)
+            elif isinstance(processing_block, FixedGains):
+                yield _TrackedFixedGains(processing_block.start_sample,
+                                         processing_block.end_sample,
+                                         processing_block.gains,
+                                         self.tracker)
+            elif isinstance(processing_block, FixedMatrix):
+                yield _TrackedFixedMatrix(processing_block.start_sample,
+                                          processing_block.end_sample,
+                                          processing_block.matrix,
+                                          processing_block.output_channels,
+                                          tracker=self.tracker)
+            else:
+                assert False, "unknown processing block {}".format(
+                    type(processing_block).__name__)
+
+
+def track_renderer(renderer, tracker, layout, psp):
+    """Make an EAR renderer apply the head orientation from tracker.
+
+    This must be called after the rendering items have been set, and before
+    rendering.
+
+    Parameters:
+        renderer (ObjectRenderer, DirectSpeakersRenderer or HOARenderer):
+            renderer to modify
+        tracker (HeadTracker): head orientation to use
+        layout (ear.core.layout.Layout): layout the renderer was made for
+        psp (ear.core.point_source.PointSourcePanner): point source panner
+            for layout.without_lfe, used to pan point sources and
+            DirectSpeakers channels to their rotated positions
+    """
+    for _, channel in renderer.block_processing_channels:
+        interpret = channel.interpret_metadata
+        if isinstance(renderer, ObjectRenderer):
+            interpret.calc_gains = partial(_tracked_object_gains,
+                                           interpret.calc_gains, layout, psp)
+        elif isinstance(renderer, DirectSpeakersRenderer):
+            interpret.calc_gains = partial(_tracked_direct_speakers_gains,
+                                           interpret.calc_gains, layout, psp)
+        elif isinstance(renderer, HOARenderer):
+            design_decoder = interpret.design_decoder
+            interpret.design_decoder = (
+                lambda block, design_decoder=design_decoder: _TrackedGains(
+                    _hoa_matrix(design_decoder, block)))
+        else:
+            assert False, "head tracking is not supported for {}".format(
+                type(renderer).__name__)
+
+        channel.interpret_metadata = _TrackedInterpretMetadata(
+            interpret, tracker)
@@ -1,4 +1,6 @@
+import copy
 import numpy as np
+from .fft import complex_dtype, numpy_fft
 
 
 class FDBuffer(object):
@@ -7,15 +9,17 @@ class FDBuffer(object):
     Attributes:
         is_zero (bool): Are all samples in this block zero? If False, then buffer is not Null.
         buffer (None or array): Complex samples.
+        dtype: complex dtype of buffer
     """
-    def __init__(self, block_size):
+    def __init__(self, block_size, buffer=None, dtype=np.complex128):
         self.block_size = block_size
         self.is_zero = True
-        self.buffer = None
+        self.buffer = buffer
+        self.dtype = dtype if buffer is None else buffer.dtype
 
     def alloc_buffer(self):
         if self.buffer is None:
-            self.buffer = np.zeros(self.block_size + 1, dtype=np.complex)
+            self.buffer = np.zeros(self.block_size + 1, dtype=self.dtype)
 
     def clear(self):
         self.is_zero = True
@@ -30,22 +34,33 @@ class FDBuffer(object):
         return self
 
     @classmethod
-    def from_td(cls, block_size, td):
-        b = cls(block_size)
-        if np.any(td):
-            b.is_zero = False
-            b.buffer = np.fft.rfft(td, block_size * 2)
+    def from_td(cls, block_size, td, dtype=np.complex128):
+        b = cls(block_size, dtype=dtype)
+        b.set_td(td)
         return b
 
+    def set_td(self, td):
+        """Set this buffer to the fft of td, padded to 2*block_size, re-using
+        the existing buffer if there is one."""
+        if np.any(td):
+            self.alloc_buffer()
+            self.buffer[:] = np.fft.rfft(td, self.block_size * 2)
+            self.is_zero = False
+        else:
+            self.is_zero = True
+
     def to_td(self, td):
-        if not self.is_zero:
+        if self.is_zero:
+            td[:] = 0.0
+        else:
             td[:] = np.fft.irfft(self.buffer)[:self.block_size]
 
 
-def FDBuffers_to_td(buffers):
+def FDBuffers_to_td(buffers, td=None):
     """Turn a list of frequency-domain buffers into an array of time-domain
-    samples of the same shape."""
-    td = np.zeros((len(buffers), buffers[0].block_size))
+    samples of the same shape, written to td if it is not None."""
+    if td is None:
+        td = np.zeros((len(buffers), buffers[0].block_size))
 
     for buf, td_channel in zip(buffers, td):
         buf.to_td(td_channel)
@@ -53,11 +68,16 @@ def FDBuffers_to_td(buffers):
     return td
 
 
-def fma(x, a, b):
-    """Implement x += a * b for FDBuffer arguments"""
+def fma(x, a, b, tmp=None):
+    """Implement x += a * b for FDBuffer arguments; if tmp is not None, it is
+    used to store the product instead of allocating a temporary array."""
     if (not a.is_zero) and (not b.is_zero):
         x.alloc_buffer()
-        x.buffer += a.buffer * b.buffer
+        if tmp is None:
+            x.buffer += a.buffer * b.buffer
+        else:
+            np.multiply(a.buffer, b.buffer, out=tmp)
+            x.buffer += tmp
         x.is_zero = False
 
 
@@ -68,6 +88,11 @@ class MatrixBlockConvolver(object):
     output channels are reused, as we only need to FFT each input and output
     channel once.
 
+    All buffers used while processing are allocated when the convolver is
+    created, apart from the results of the FFTs with the numpy and scipy
+    backends. All input channels, and all output channels, are transformed in
+    one call per block.
+
     Parameters:
         block_size (int): time domain block size for input and output blocks
         n_in (int): number of input channels
@@ -75,11 +100,18 @@ class MatrixBlockConvolver(object):
         filters (list): Single-channel filters to apply. Each element is a
             3-tuple containing the input channel number, output channel number,
             and a single channel filter.
+        fft (FFT backend or None): see fft.get_fft_backend; numpy if None
+        dtype: real dtype for processing; float32 or float64
+
+    Attributes:
+        tail_blocks (int): number of silent input blocks after which the
+            output is silent until the input is not
     """
     class FDConvolverChannel(object):
         """A single channel of concolution in the frequency domain."""
-        def __init__(self, block_size, f):
+        def __init__(self, block_size, f, dtype=np.complex128):
             self.block_size = block_size
+            self.dtype = dtype
 
             self.filter_blocks_fd = []
             self.blocks_fd = []
@@ -87,29 +119,86 @@ class MatrixBlockConvolver(object):
                 end = min(len(f), start + self.block_size)
 
                 self.filter_blocks_fd.append(
-                    FDBuffer.from_td(self.block_size, f[start:end]))
-                self.blocks_fd.append(FDBuffer(self.block_size))
-
-        def filter_block(self, in_block_fd):
+                    FDBuffer.from_td(self.block_size, f[start:end], dtype))
+                self.blocks_fd.append(FDBuffer(self.block_size, dtype=dtype))
+
+        def clone(self):
+            other = copy.copy(self)
+            other.blocks_fd = [
+                FDBuffer(self.block_size, dtype=self.dtype)
+                for _ in self.filter_blocks_fd
+            ]
+            return other
+
+        def filter_block(self, in_block_fd, tmp=None):
             # clear the returned block from the previous frame
             self.blocks_fd[-1].clear()
 
             for filter_block, block in zip(self.filter_blocks_fd,
                                            self.blocks_fd):
-                fma(block, filter_block, in_block_fd)
+                fma(block, filter_block, in_block_fd, tmp)
 
             self.blocks_fd.append(self.blocks_fd.pop(0))
             return self.blocks_fd[-1]
 
-    def __init__(self, block_size, n_in, n_out, filters):
+    def __init__(self,
+                 block_size,
+                 n_in,
+                 n_out,
+                 filters,
+                 fft=None,
+                 dtype=np.float64):
         self.block_size = block_size
+        self.fft = fft if fft is not None else numpy_fft
+        self.dtype = np.dtype(dtype)
+        self.complex_dtype = complex_dtype(self.dtype)
 
         self.filters = [(in_ch, out_ch,
-                         self.FDConvolverChannel(block_size, filter))
+                         self.FDConvolverChannel(block_size, filter,
+                                                 self.complex_dtype))
                         for in_ch, out_ch, filter in filters]
+        # the last input block is also in the next FFT input
+        self.tail_blocks = max(
+            [len(filter.filter_blocks_fd)
+             for _, _, filter in self.filters] + [0]) + 1
+
+        self.n_in = n_in
+        self.n_out = n_out
+        self._alloc_state()
+
+    def _alloc_state(self):
+        n_bins = self.block_size + 1
+
+        # the FDBuffers for the input and output channels are views of single
+        # arrays, so that they can be transformed together
+        self.input_block = np.zeros((self.n_in, self.block_size * 2),
+                                    dtype=self.dtype)
+        self._in_fd = np.zeros((self.n_in, n_bins), dtype=self.complex_dtype)
+        self._in_nonzero = np.zeros(self.n_in, dtype=bool)
+        self.in_block_fd = [
+            FDBuffer(self.block_size, buffer) for buffer in self._in_fd
+        ]
+        self._rfft = self.fft.plan_rfft(self.input_block, self._in_fd, axis=1)
+
+        self._out_fd = np.zeros((self.n_out, n_bins),
+                                dtype=self.complex_dtype)
+        self._out_td = np.zeros((self.n_out, self.block_size * 2),
+                                dtype=self.dtype)
+        self.out_block_fd = [
+            FDBuffer(self.block_size, buffer) for buffer in self._out_fd
+        ]
+        self._irfft = self.fft.plan_irfft(self._out_fd, self._out_td, axis=1)
+
+        self._product_fd = np.zeros(n_bins, dtype=self.complex_dtype)
 
-        self.input_block = np.zeros((n_in, block_size * 2))
-        self.out_block_fd = [FDBuffer(block_size) for _ in range(n_out)]
+    def clone(self):
+        """Get a convolver with the same filters as this one, but with its own
+        (cleared) state. The frequency-domain filters are shared, not copied."""
+        other = copy.copy(self)
+        other.filters = [(in_ch, out_ch, filter.clone())
+                         for in_ch, out_ch, filter in self.filters]
+        other._alloc_state()
+        return other
 
     @classmethod
     def per_channel(cls, block_size, nchannels, filters):
@@ -124,12 +213,14 @@ class MatrixBlockConvolver(object):
         return cls(block_size, nchannels, nchannels,
                    [(i, i, f) for i, f in enumerate(np.array(filters).T)])
 
-    def filter_block(self, in_block_td):
+    def filter_block(self, in_block_td, out=None):
         """Filter a time domain block of samples.
 
         Parameters:
             in_block_td (array of (block_size, n_in) floats): block of
                 time domain input samples
+            out (array of (block_size, n_out) floats or None): array to write
+                the output to; if None, a new array is allocated
 
         Returns:
             array of (block_size, n_out) floats: block of time domain
@@ -139,18 +230,565 @@ class MatrixBlockConvolver(object):
                                                                  block_size]
         self.input_block[:, :self.block_size] = in_block_td.T
 
-        in_block_fd = [
-            FDBuffer.from_td(self.block_size, ch) for ch in self.input_block
-        ]
+        self._rfft()
+        np.any(self.input_block, axis=1, out=self._in_nonzero)
+        for in_block, nonzero in zip(self.in_block_fd, self._in_nonzero):
+            in_block.is_zero = not nonzero
 
         for out_block in self.out_block_fd:
             out_block.clear()
 
         for in_ch, out_ch, filter in self.filters:
             self.out_block_fd[out_ch] += filter.filter_block(
-                in_block_fd[in_ch])
+                self.in_block_fd[in_ch], self._product_fd)
+
+        # zero output buffers have been cleared, so can be transformed too
+        self._irfft()
+
+        if out is None:
+            out = np.empty((self.block_size, self.n_out), dtype=self.dtype)
+        out[:] = self._out_td[:, :self.block_size].T
+        return out
+
+
+def partition_filters(block_size, n_in, n_out, filters, dtype=np.float64):
+    """Split a matrix of time-domain filters into frequency-domain partitions.
+
+    Parameters:
+        block_size (int): partition size in samples
+        n_in (int): number of input channels
+        n_out (int): number of output channels
+        filters (list): Single-channel filters, as in MatrixBlockConvolver.
+            Filters for the same input and output channel are summed.
+        dtype: real dtype used for processing; the result has the
+            corresponding complex dtype
+
+    Returns:
+        array of (block_size + 1, n_partitions, n_in, n_out) complex: blocks of
+            block_size samples of each filter, padded to 2*block_size and
+            fft-ed
+    """
+    max_len = max([len(f) for _, _, f in filters] + [1])
+    n_partitions = -(-max_len // block_size)
+
+    filters_td = np.zeros((n_partitions * block_size, n_in, n_out))
+    for in_ch, out_ch, f in filters:
+        filters_td[:len(f), in_ch, out_ch] += f
+
+    filters_td = filters_td.reshape(n_partitions, block_size, n_in, n_out)
+    filters_fd = np.fft.rfft(filters_td, block_size * 2, axis=1)
+    return filters_fd.transpose(1, 0, 2, 3).astype(complex_dtype(dtype),
+                                                   order="C")
+
+
+class VectorizedBlockConvolver(object):
+    """Apply a matrix of time-domain filters using a single batched
+    multiply-accumulate per block.
+
+    This uses the same uniformly-partitioned overlap-save scheme as
+    MatrixBlockConvolver, but all filter partitions are stored in one complex
+    array, and the spectra of past input blocks are kept in a frequency-domain
+    delay line, so that each output block is computed with one matrix product
+    per frequency bin rather than one call per filter and partition.
+
+    All buffers used while processing are allocated when the convolver is
+    created, apart from the results of the FFTs with the numpy and scipy
+    backends.
+
+    Parameters:
+        block_size (int): time domain block size for input and output blocks
+        n_in (int): number of input channels
+        n_out (int): number of output channels
+        filters (list): Single-channel filters to apply. Each element is a
+            3-tuple containing the input channel number, output channel number,
+            and a single channel filter.
+        filters_fd (array or None): filters previously split with
+            partition_filters, used instead of filters if not None
+        fft (FFT backend or None): see fft.get_fft_backend; numpy if None
+        dtype: real dtype for processing; float32 or float64
+
+    Attributes:
+        tail_blocks (int): number of silent input blocks after which the
+            output is silent until the input is not
+        filters_fd (array of (block_size + 1, n_partitions, n_in, n_out) complex):
+            filter partitions, see partition_filters
+        delay_line_fd (array of (block_size + 1, 2 * n_partitions, n_in) complex):
+            spectra of past input blocks. This is a ring buffer in which each
+            block is written twice, such that
+            delay_line_fd[:, pos:pos + n_partitions] always contains the most
+            recent n_partitions blocks, newest first.
+        input_block (array of (n_in, block_size*2) floats): input to the
+            forward fft; the first half contains the input for this block, and
+            the second half contains the input from the previous block.
+    """
+    def __init__(self,
+                 block_size,
+                 n_in,
+                 n_out,
+                 filters,
+                 filters_fd=None,
+                 fft=None,
+                 dtype=np.float64):
+        self.block_size = block_size
+        self.n_in = n_in
+        self.n_out = n_out
+        self.fft = fft if fft is not None else numpy_fft
+        self.dtype = np.dtype(dtype)
+        self.complex_dtype = complex_dtype(self.dtype)
+
+        if filters_fd is None:
+            filters_fd = partition_filters(block_size, n_in, n_out, filters,
+                                           self.dtype)
+        elif filters_fd.dtype != self.complex_dtype:
+            filters_fd = filters_fd.astype(self.complex_dtype)
+        assert filters_fd.shape[0] == block_size + 1
+        assert filters_fd.shape[2:] == (n_in, n_out)
+
+        # the filters may be shared between clones, so must not be modified
+        self.filters_fd = filters_fd
+        self.filters_fd.flags.writeable = False
+        n_bins, self.n_partitions = self.filters_fd.shape[:2]
+        self.tail_blocks = self.n_partitions + 1
+
+        # view of the filters as one (n_partitions * n_in, n_out) matrix per bin
+        self._filter_matrix = self.filters_fd.reshape(
+            n_bins, self.n_partitions * n_in, n_out)
+
+        self._alloc_state()
+
+    def _alloc_state(self):
+        n_bins = self.filters_fd.shape[0]
+        self.delay_line_fd = np.zeros(
+            (n_bins, 2 * self.n_partitions, self.n_in),
+            dtype=self.complex_dtype)
+        self.pos = 0
+
+        self.input_block = np.zeros((self.n_in, self.block_size * 2),
+                                    dtype=self.dtype)
+        self._in_block_fd = np.zeros((self.n_in, n_bins),
+                                     dtype=self.complex_dtype)
+        self._rfft = self.fft.plan_rfft(self.input_block,
+                                        self._in_block_fd,
+                                        axis=1)
+
+        self._out_block_fd = np.zeros((n_bins, 1, self.n_out),
+                                      dtype=self.complex_dtype)
+        self._out_block_td = np.zeros((self.block_size * 2, self.n_out),
+                                      dtype=self.dtype)
+        self._irfft = self.fft.plan_irfft(self._out_block_fd[:, 0],
+                                          self._out_block_td,
+                                          axis=0)
+
+    def clone(self):
+        """Get a convolver with the same filters as this one, but with its own
+        (cleared) state. The frequency-domain filters are shared, not copied."""
+        other = copy.copy(self)
+        other._alloc_state()
+        return other
+
+    @classmethod
+    def per_channel(cls, block_size, nchannels, filters):
+        """Convenience wrapper for per-channel filters; see
+        MatrixBlockConvolver.per_channel."""
+        return cls(block_size, nchannels, nchannels,
+                   [(i, i, f) for i, f in enumerate(np.array(filters).T)])
+
+    def filter_block(self, in_block_td, out=None):
+        """Filter a time domain block of samples.
 
-        return FDBuffers_to_td(self.out_block_fd).T
+        Parameters:
+            in_block_td (array of (block_size, n_in) floats): block of
+                time domain input samples
+            out (array of (block_size, n_out) floats or None): array to write
+                the output to; if None, a new array is allocated
+
+        Returns:
+            array of (block_size, n_out) floats: block of time domain
+                output samples
+        """
+        self.input_block[:, self.block_size:] = self.input_block[:, :self.
+                                                                 block_size]
+        self.input_block[:, :self.block_size] = in_block_td.T
+
+        self._rfft()
+        in_block_fd = self._in_block_fd.T
+
+        self.pos = (self.pos - 1) % self.n_partitions
+        self.delay_line_fd[:, self.pos] = in_block_fd
+        self.delay_line_fd[:, self.pos + self.n_partitions] = in_block_fd
+
+        recent_blocks = self.delay_line_fd[:, self.pos:self.pos +
+                                           self.n_partitions]
+        np.matmul(recent_blocks.reshape(len(recent_blocks), 1, -1),
+                  self._filter_matrix,
+                  out=self._out_block_fd)
+
+        self._irfft()
+
+        if out is None:
+            out = np.empty((self.block_size, self.n_out), dtype=self.dtype)
+        out[:] = self._out_block_td[:self.block_size]
+        return out
+
+
+class NonUniformBlockConvolver(object):
+    """Apply a matrix of time-domain filters using non-uniform partitions.
+
+    The head of the filters is processed in partitions of block_size samples,
+    and later segments in progressively larger partitions (doubling up to
+    max_block_size), so that long filters can be used with a small block size
+    without the cost per block growing linearly with the filter length.
+
+    Each segment is processed by a VectorizedBlockConvolver running at its own
+    partition size N, which can only produce output once N input samples have
+    been collected. A segment with partition size N is therefore started at
+    least N - block_size samples into the filters, as in Garcia, "Optimal
+    filter partition for efficient convolution with short input/output
+    delay" (AES 113th convention, 2002); the input/output delay is the same as
+    for the uniform convolvers.
+
+    Note that the larger segments are processed in the call which completes
+    their input block, rather than being spread over several calls, so the
+    processing time of individual calls varies.
+
+    Parameters:
+        block_size (int): time domain block size for input and output blocks
+        n_in (int): number of input channels
+        n_out (int): number of output channels
+        filters (list): Single-channel filters to apply. Each element is a
+            3-tuple containing the input channel number, output channel number,
+            and a single channel filter.
+        max_block_size (int): largest partition size to use; rounded down to
+            block_size times a power of two
+        partitions_per_segment (int): number of partitions of each size before
+            the partition size is doubled
+        fft (FFT backend or None): see fft.get_fft_backend; numpy if None
+        dtype: real dtype for processing; float32 or float64
+
+    Attributes:
+        tail_blocks (int): number of silent input blocks after which the
+            output is silent until the input is not
+    """
+    class Segment(object):
+        """Part of the filters processed at a single partition size.
+
+        Attributes:
+            block_size (int): partition size for this segment
+            offset (int): position of the output of this segment relative to
+                the start of the output block in which its input is complete
+            convolver (VectorizedBlockConvolver): convolver for this segment
+            input_block (array of (block_size, n_in) floats): input samples
+                collected for the next block
+            n_input (int): number of samples in input_block
+            output_block (array of (block_size, n_out) floats): output of the
+                last block processed
+        """
+        def __init__(self, block_size, offset, convolver):
+            self.block_size = block_size
+            self.offset = offset
+            self.convolver = convolver
+            self.input_block = np.zeros((block_size, convolver.n_in),
+                                        dtype=convolver.dtype)
+            self.n_input = 0
+            self.output_block = np.zeros((block_size, convolver.n_out),
+                                         dtype=convolver.dtype)
+
+        def clone(self):
+            return type(self)(self.block_size, self.offset,
+                              self.convolver.clone())
+
+    def __init__(self,
+                 block_size,
+                 n_in,
+                 n_out,
+                 filters,
+                 max_block_size=8192,
+                 partitions_per_segment=2,
+                 fft=None,
+                 dtype=np.float64):
+        assert partitions_per_segment >= 1
+        self.block_size = block_size
+        self.n_in = n_in
+        self.n_out = n_out
+        self.dtype = np.dtype(dtype)
+
+        max_len = max([len(f) for _, _, f in filters] + [1])
+
+        self.segments = []
+        start, seg_block_size = 0, block_size
+        while start < max_len:
+            if seg_block_size * 2 <= max_block_size:
+                end = start + seg_block_size * partitions_per_segment
+            else:
+                end = max_len
+
+            seg_filters = [(in_ch, out_ch, f[start:end])
+                           for in_ch, out_ch, f in filters
+                           if len(f) > start]
+            convolver = VectorizedBlockConvolver(seg_block_size,
+                                                 n_in,
+                                                 n_out,
+                                                 seg_filters,
+                                                 fft=fft,
+                                                 dtype=dtype)
+            offset = start - seg_block_size + block_size
+            self.segments.append(
+                self.Segment(seg_block_size, offset, convolver))
+
+            start = end
+            if seg_block_size * 2 <= max_block_size:
+                seg_block_size *= 2
+
+        # each segment needs a partly-filled input block, its own tail, and
+        # the output fifo to be flushed
+        self.tail_blocks = max(
+            (seg.convolver.tail_blocks + 1) * seg.block_size + seg.offset +
+            seg.block_size for seg in self.segments) // block_size
+
+        self._alloc_fifo()
+
+    def _alloc_fifo(self):
+        # output_fifo[i] is added to output sample i of the next block; it is
+        # shifted by copying into _next_output_fifo, and the two are swapped
+        fifo_len = max(seg.offset + seg.block_size for seg in self.segments)
+        self.output_fifo = np.zeros((fifo_len, self.n_out), dtype=self.dtype)
+        self._next_output_fifo = np.zeros((fifo_len, self.n_out),
+                                          dtype=self.dtype)
+
+    def clone(self):
+        """Get a convolver with the same filters as this one, but with its own
+        (cleared) state. The frequency-domain filters are shared, not copied."""
+        other = copy.copy(self)
+        other.segments = [seg.clone() for seg in self.segments]
+        other._alloc_fifo()
+        return other
+
+    @classmethod
+    def per_channel(cls, block_size, nchannels, filters, **kwargs):
+        """Convenience wrapper for per-channel filters; see
+        MatrixBlockConvolver.per_channel."""
+        return cls(block_size, nchannels, nchannels,
+                   [(i, i, f) for i, f in enumerate(np.array(filters).T)],
+                   **kwargs)
+
+    def filter_block(self, in_block_td, out=None):
+        """Filter a time domain block of samples.
+
+        Parameters:
+            in_block_td (array of (block_size, n_in) floats): block of
+                time domain input samples
+            out (array of (block_size, n_out) floats or None): array to write
+                the output to; if None, a new array is allocated
+
+        Returns:
+            array of (block_size, n_out) floats: block of time domain
+                output samples
+        """
+        for seg in self.segments:
+            seg.input_block[seg.n_input:seg.n_input +
+                            self.block_size] = in_block_td
+            seg.n_input += self.block_size
+
+            if seg.n_input == seg.block_size:
+                seg.convolver.filter_block(seg.input_block,
+                                           out=seg.output_block)
+                self.output_fifo[seg.offset:seg.offset +
+                                 seg.block_size] += seg.output_block
+                seg.n_input = 0
+
+        if out is None:
+            out = np.empty((self.block_size, self.n_out), dtype=self.dtype)
+        out[:] = self.output_fifo[:self.block_size]
+
+        self._next_output_fifo[:-self.block_size] = \
+            self.output_fifo[self.block_size:]
+        self._next_output_fifo[-self.block_size:] = 0.0
+        self.output_fifo, self._next_output_fifo = \
+            self._next_output_fifo, self.output_fifo
+
+        return out
+
+
+def sparse_taps(filters, max_taps=4):
+    """Turn a list of filters into a list of taps if they are all sparse.
+
+    Parameters:
+        filters (list): Single-channel filters, as for MatrixBlockConvolver.
+        max_taps (int): maximum number of non-zero samples in each filter
+
+    Returns:
+        list of (in_ch, out_ch, delay, gain) tuples for each non-zero sample
+        of each filter, or None if any of the filters has more than max_taps
+        non-zero samples
+    """
+    taps = []
+    for in_ch, out_ch, f in filters:
+        delays = np.flatnonzero(f)
+        if len(delays) > max_taps:
+            return None
+        taps.extend((in_ch, out_ch, delay, f[delay]) for delay in delays)
+    return taps
+
+
+class DelayGainConvolver(object):
+    """Apply a matrix of filters which each consist of a few delayed and
+    scaled impulses, without FFTs.
+
+    The input is stored in a time-domain delay line, and each output block is
+    computed with one matrix product per distinct delay.
+
+    Parameters:
+        block_size (int): time domain block size for input and output blocks
+        n_in (int): number of input channels
+        n_out (int): number of output channels
+        taps (list): Impulses to apply. Each element is a 4-tuple containing
+            the input channel number, output channel number, delay in samples
+            and gain; see sparse_taps.
+        dtype: real dtype for processing; float32 or float64
+
+    Attributes:
+        tail_blocks (int): number of silent input blocks after which the
+            output is silent until the input is not
+        delays (array of ints): distinct delays of the taps
+        gains (array of (len(delays), n_in, n_out) floats): gain matrix for
+            each delay
+        delay_line (array of (2 * delay_line_size, n_in) floats): past input
+            samples. This is a ring buffer in which each block is written
+            twice, such that the delay_line_size samples before
+            delay_line[pos + delay_line_size + block_size] are always the most
+            recent input samples.
+    """
+    def __init__(self, block_size, n_in, n_out, taps, dtype=np.float64):
+        self.block_size = block_size
+        self.n_in = n_in
+        self.n_out = n_out
+        self.dtype = np.dtype(dtype)
+
+        self.delays = np.unique([delay for in_ch, out_ch, delay, gain in taps
+                                 ]).astype(int)
+        if len(self.delays) == 0:
+            self.delays = np.zeros(1, dtype=int)
+        self.gains = np.zeros((len(self.delays), n_in, n_out),
+                              dtype=self.dtype)
+        for in_ch, out_ch, delay, gain in taps:
+            self.gains[np.searchsorted(self.delays, delay), in_ch,
+                       out_ch] += gain
+        # the gains may be shared between clones, so must not be modified
+        self.gains.flags.writeable = False
+
+        # enough whole blocks to hold the longest delay and the current block
+        self.delay_line_size = (
+            -(-self.delays[-1] // block_size) + 1) * block_size
+        self.tail_blocks = self.delay_line_size // block_size
+
+        self._alloc_state()
+
+    def _alloc_state(self):
+        self.delay_line = np.zeros((2 * self.delay_line_size, self.n_in),
+                                   dtype=self.dtype)
+        self.pos = 0
+        self._tmp = np.zeros((self.block_size, self.n_out), dtype=self.dtype)
+
+    def clone(self):
+        """Get a convolver with the same taps as this one, but with its own
+        (cleared) state. The gains are shared, not copied."""
+        other = copy.copy(self)
+        other._alloc_state()
+        return other
+
+    def filter_block(self, in_block_td, out=None):
+        """Filter a time domain block of samples.
+
+        Parameters:
+            in_block_td (array of (block_size, n_in) floats): block of
+                time domain input samples
+            out (array of (block_size, n_out) floats or None): array to write
+                the output to; if None, a new array is allocated
+
+        Returns:
+            array of (block_size, n_out) floats: block of time domain
+                output samples
+        """
+        size, pos = self.delay_line_size, self.pos
+        self.delay_line[pos:pos + self.block_size] = in_block_td
+        self.delay_line[pos + size:pos + size + self.block_size] = in_block_td
+
+        if out is None:
+            out = np.empty((self.block_size, self.n_out), dtype=self.dtype)
+
+        end = pos + size + self.block_size
+        for i, delay in enumerate(self.delays):
+            delayed = self.delay_line[end - delay - self.block_size:end -
+                                      delay]
+            if i == 0:
+                np.matmul(delayed, self.gains[i], out=out)
+            else:
+                np.matmul(delayed, self.gains[i], out=self._tmp)
+                out += self._tmp
+
+        self.pos = (pos + self.block_size) % size
+        return out
+
+
+class SilenceBypass(object):
+    """Wrapper around a convolver which does not process blocks once the
+    input has been silent for long enough that the output is silent too.
+
+    The wrapped convolver must have a tail_blocks attribute; once it has
+    processed that many silent blocks its state is all zero, so further silent
+    blocks can be skipped without changing the output.
+
+    Parameters:
+        convolver: convolver to wrap, e.g. a VectorizedBlockConvolver
+
+    Attributes:
+        silent_blocks (int): number of consecutive silent input blocks
+        processed_blocks (int): number of blocks passed to the convolver
+        skipped_blocks (int): number of blocks skipped
+    """
+    def __init__(self, convolver):
+        self.convolver = convolver
+        self.block_size = convolver.block_size
+        self.n_in = convolver.n_in
+        self.n_out = convolver.n_out
+        self.dtype = convolver.dtype
+        self.tail_blocks = convolver.tail_blocks
+
+        self.silent_blocks = 0
+        self.processed_blocks = 0
+        self.skipped_blocks = 0
+
+    def clone(self):
+        """Get a wrapper around a clone of the convolver, with its own state
+        and counters."""
+        return type(self)(self.convolver.clone())
+
+    def filter_block(self, in_block_td, out=None):
+        """Filter a time domain block of samples; see
+        VectorizedBlockConvolver.filter_block."""
+        if np.any(in_block_td):
+            self.silent_blocks = 0
+        else:
+            self.silent_blocks += 1
+
+        if self.silent_blocks > self.tail_blocks:
+            if out is None:
+                out = np.zeros((self.block_size, self.n_out),
+                               dtype=self.dtype)
+            else:
+                out[:] = 0.0
+            self.skipped_blocks += 1
+            return out
+
+        self.processed_blocks += 1
+        return self.convolver.filter_block(in_block_td, out=out)
+
+
+convolver_types = {
+    "matrix": MatrixBlockConvolver,
+    "vectorized": VectorizedBlockConvolver,
+    "nonuniform": NonUniformBlockConvolver,
+}
 
 
 def OverlapSaveConvolver(block_size, nchannels, filters):
@@ -0,0 +1,280 @@
+import numpy as np
+from . import sofa, profiling
+from .fft import complex_dtype, numpy_fft
+from .filter_bank import HRIRGrid
+from .filter_cache import FilterCache
+
+"""HRIRs interpolated at arbitrary directions, and a convolver for filters
+which change over time, used to render objects on the HRIR path without
+panning them to virtual loudspeakers (see binaural_wrapper.ObjectHRIRRenderer)
+"""
+
+
+class HRIRSet(object):
+    """HRIRs measured on a grid of directions, which can be interpolated at
+    any direction.
+
+    Parameters:
+        positions (array of (n, 3) floats): Cartesian measurement positions
+        hrirs (array of (n, 2, m) floats, or filter_bank.HRIRGrid): HRIRs for
+            each measurement; these should be aligned (see align_irs) so that
+            they can be interpolated
+
+    Attributes:
+        hrirs (array of (n, 2, m) floats, or filter_bank.HRIRGrid): HRIRs for
+            each measurement
+        index (sofa.SourceIndex): index of the measurement positions
+    """
+    def __init__(self, positions, hrirs):
+        self.hrirs = hrirs
+        self.index = sofa.SourceIndex(positions)
+
+    def weights(self, directions):
+        """Find the measurements to interpolate between for some directions.
+
+        Parameters:
+            directions (array of (k, 3) floats): Cartesian directions
+
+        Returns:
+            array of (k, 3) ints: measurement indices
+            array of (k, 3) floats: interpolation weights
+
+            See sofa.SourceIndex.k_nearest.
+        """
+        return self.index.k_nearest(directions, k=3)
+
+    def interpolate(self, idxes, weights):
+        """Interpolate HRIRs with the result of weights.
+
+        Returns:
+            array of (k, 2, m) floats: HRIRs for each direction
+        """
+        return np.einsum("ij,ijkl->ikl", weights, self.hrirs[idxes])
+
+    def prepare(self, directions):
+        """Prepare the HRIRs needed to interpolate at some directions in
+        advance, if they are prepared when first used (see
+        filter_bank.HRIRGrid), so that this is not done while rendering.
+
+        Parameters:
+            directions (array of (k, 3) floats): Cartesian directions
+        """
+        if isinstance(self.hrirs, HRIRGrid):
+            idxes, _ = self.weights(directions)
+            self.hrirs[idxes]
+
+
+_hrir_sets = {}
+
+
+def get_hrir_set(hrir_file,
+                 layout,
+                 sr,
+                 cache_dir=None,
+                 cache_max_size=0,
+                 dtype="float64"):
+    """Get a HRIRSet with all measurements in a SOFA file, re-using one
+    created previously in this process if possible.
+
+    The HRIRs are read and prepared when they are first used, and stored in a
+    FilterCache in cache_dir; see filter_bank.HRIRGrid.
+
+    Parameters:
+        hrir_file (str): SOFA file URL, see sofa.load_hdf5
+        layout (Layout): HRIR path virtual loudspeaker layout; the HRIRs are
+            prepared to match those used for it
+        sr (int): sample rate
+        cache_dir (str or None): directory for a FilterCache
+        cache_max_size (int): maximum size of the FilterCache in bytes
+        dtype (str): precision of the HRIRs; "float32" or "float64"
+
+    Returns:
+        HRIRSet
+    """
+    key = (hrir_file, layout.name, tuple(layout.channel_names), sr, dtype)
+
+    if key not in _hrir_sets:
+        with profiling.stage("setup/hrir_set"):
+            cache = (FilterCache(cache_dir, cache_max_size)
+                     if cache_dir is not None else None)
+            grid = HRIRGrid(hrir_file, layout, sr, cache=cache, dtype=dtype)
+            _hrir_sets[key] = HRIRSet(grid.positions, grid)
+
+    return _hrir_sets[key]
+
+
+class CrossfadingConvolver(object):
+    """Convolve each input channel with its own pair of filters, and sum the
+    results into two output channels (the left and right ears). The filters
+    of each channel can be changed between blocks.
+
+    This uses uniformly-partitioned overlap-save with a frequency-domain delay
+    line, as matrix_convolver.VectorizedBlockConvolver does. In blocks after
+    the filters have changed, the output spectra are calculated with both the
+    old and the new filters, and the outputs are crossfaded linearly over the
+    block, so that changes do not cause discontinuities. The filters are zero
+    until they are first set, which is done without a crossfade.
+
+    Parameters:
+        block_size (int): time domain block size for input and output blocks
+        n_in (int): number of input channels
+        filter_length (int): maximum length of the filters
+        fft (FFT backend or None): see fft.get_fft_backend; numpy if None
+        dtype: real dtype for processing; float32 or float64
+
+    Attributes:
+        tail_blocks (int): number of silent input blocks after which the
+            output is silent until the input is not
+        filters_fd (array of (block_size + 1, n_partitions, n_in, 2) complex):
+            filter partitions used in the next block, as in
+            VectorizedBlockConvolver
+    """
+    def __init__(self,
+                 block_size,
+                 n_in,
+                 filter_length,
+                 fft=None,
+                 dtype=np.float64):
+        self.block_size = block_size
+        self.n_in = n_in
+        self.fft = fft if fft is not None else numpy_fft
+        self.dtype = np.dtype(dtype)
+        self.complex_dtype = complex_dtype(self.dtype)
+
+        self.n_partitions = -(-filter_length // block_size)
+        self.tail_blocks = self.n_partitions + 1
+        n_bins = block_size + 1
+
+        self.filters_fd = np.zeros((n_bins, self.n_partitions, n_in, 2),
+                                   dtype=self.complex_dtype)
+        # filters used in the previous block; these differ from filters_fd
+        # only for the channels in _changed
+        self._old_filters_fd = np.zeros_like(self.filters_fd)
+        self._is_set = np.zeros(n_in, dtype=bool)
+        self._changed = np.zeros(n_in, dtype=bool)
+
+        # views of the filters as one (n_partitions * n_in, 2) matrix per bin
+        self._filter_matrix = self.filters_fd.reshape(
+            n_bins, self.n_partitions * n_in, 2)
+        self._old_filter_matrix = self._old_filters_fd.reshape(
+            n_bins, self.n_partitions * n_in, 2)
+
+        self.delay_line_fd = np.zeros((n_bins, 2 * self.n_partitions, n_in),
+                                      dtype=self.complex_dtype)
+        self.pos = 0
+
+        self.input_block = np.zeros((n_in, block_size * 2), dtype=self.dtype)
+        self._in_block_fd = np.zeros((n_in, n_bins), dtype=self.complex_dtype)
+        self._rfft = self.fft.plan_rfft(self.input_block,
+                                        self._in_block_fd,
+                                        axis=1)
+
+        # output spectra and signals with the new and old filters
+        self._out_blocks_fd = np.zeros((2, n_bins, 1, 2),
+                                       dtype=self.complex_dtype)
+        self._out_blocks_td = np.zeros((2, block_size * 2, 2),
+                                       dtype=self.dtype)
+        self._irffts = [
+            self.fft.plan_irfft(self._out_blocks_fd[i, :, 0],
+                                self._out_blocks_td[i],
+                                axis=0) for i in range(2)
+        ]
+
+        self._ramp = ((np.arange(block_size) + 1.0) /
+                      block_size)[:, np.newaxis].astype(self.dtype)
+
+        # buffers for transforming the filters of one channel in set_filters;
+        # the second half of each partition in _filter_td is always zero
+        self._filter_padded = np.zeros((2, self.n_partitions * block_size),
+                                       dtype=self.dtype)
+        self._filter_td = np.zeros((2, self.n_partitions, block_size * 2),
+                                   dtype=self.dtype)
+        self._filter_fd = np.zeros((2, self.n_partitions, n_bins),
+                                   dtype=self.complex_dtype)
+        self._filter_rfft = self.fft.plan_rfft(self._filter_td,
+                                               self._filter_fd,
+                                               axis=2)
+
+    def set_filters(self, channels, filters):
+        """Set the filters of some input channels, which are used from the
+        next block.
+
+        Parameters:
+            channels (array of k ints): input channel indices
+            filters (array of (k, 2, n) floats): filters for each channel and
+                ear, with n at most filter_length
+        """
+        channels = np.asarray(channels)
+        length = filters.shape[2]
+        assert length <= self.n_partitions * self.block_size, \
+            "filters are too long"
+
+        self._filter_padded[:, length:] = 0.0
+        for channel, channel_filters in zip(channels, filters):
+            self._filter_padded[:, :length] = channel_filters
+            self._filter_td[:, :, :self.block_size] = \
+                self._filter_padded.reshape(2, self.n_partitions,
+                                            self.block_size)
+            self._filter_rfft()
+            self.filters_fd[:, :, channel] = self._filter_fd.transpose(2, 1, 0)
+
+        new = channels[~self._is_set[channels]]
+        self._old_filters_fd[:, :, new] = self.filters_fd[:, :, new]
+        self._is_set[new] = True
+        self._changed[channels[~np.isin(channels, new)]] = True
+
+    def filter_block(self, in_block_td, out=None):
+        """Filter a time domain block of samples.
+
+        Parameters:
+            in_block_td (array of (block_size, n_in) floats): block of
+                time domain input samples
+            out (array of (block_size, 2) floats or None): array to write
+                the output to; if None, a new array is allocated
+
+        Returns:
+            array of (block_size, 2) floats: block of time domain
+                output samples
+        """
+        self.input_block[:, self.block_size:] = self.input_block[:, :self.
+                                                                 block_size]
+        self.input_block[:, :self.block_size] = in_block_td.T
+
+        self._rfft()
+        in_block_fd = self._in_block_fd.T
+
+        self.pos = (self.pos - 1) % self.n_partitions
+        self.delay_line_fd[:, self.pos] = in_block_fd
+        self.delay_line_fd[:, self.pos + self.n_partitions] = in_block_fd
+
+        recent_blocks = self.delay_line_fd[:, self.pos:self.pos +
+                                           self.n_partitions]
+        recent_blocks = recent_blocks.reshape(len(recent_blocks), 1, -1)
+        np.matmul(recent_blocks,
+                  self._filter_matrix,
+                  out=self._out_blocks_fd[0])
+        self._irffts[0]()
+
+        if out is None:
+            out = np.empty((self.block_size, 2), dtype=self.dtype)
+        new_out = self._out_blocks_td[0, :self.block_size]
+
+        if np.any(self._changed):
+            np.matmul(recent_blocks,
+                      self._old_filter_matrix,
+                      out=self._out_blocks_fd[1])
+            self._irffts[1]()
+            old_out = self._out_blocks_td[1, :self.block_size]
+
+            np.subtract(new_out, old_out, out=out)
+            out *= self._ramp
+            out += old_out
+
+            changed = self._changed
+            self._old_filters_fd[:, :, changed] = self.filters_fd[:, :,
+                                                                  changed]
+            self._changed[:] = False
+        else:
+            out[:] = new_out
+
+        return out
@@ -0,0 +1,187 @@
+import math
+import warnings
+import numpy as np
+from ear.core.geom import cart
+from .filter_cache import FilterCache, layout_description
+
+"""point source panning using gains precomputed on a grid of directions,
+which is much faster than the EAR point source panner for large layouts"""
+
+
+class PanningTable(object):
+    """Point source panner which interpolates gains precomputed on a regular
+    grid of azimuths and elevations.
+
+    The four grid points around a direction are interpolated bilinearly; if
+    the gains on the grid are power-normalised (as for the EAR panners), the
+    result is too.
+
+    Parameters:
+        gains (array of (n_el, n_az, num_channels) floats): gains for
+            elevations from -90 to 90 degrees and azimuths from -180 to 180
+            degrees (both inclusive) in steps of resolution
+        resolution (float): grid spacing in degrees
+        estimated_error (float or None): estimate of the largest gain error
+            relative to the panner the gains were computed with; see
+            estimate_error
+
+    Attributes:
+        num_channels (int): number of output channels
+    """
+    def __init__(self, gains, resolution, estimated_error=None):
+        n_el, n_az, self.num_channels = gains.shape
+        assert n_el == int(round(180.0 / resolution)) + 1
+        assert n_az == int(round(360.0 / resolution)) + 1
+        self.gains = gains
+        self.resolution = resolution
+        self.estimated_error = estimated_error
+
+        norms = np.linalg.norm(gains, axis=2)
+        self.normalise = bool(np.allclose(norms, 1.0))
+
+    @classmethod
+    def from_panner(cls, panner, resolution):
+        """Compute a table using panner.
+
+        Parameters:
+            panner: point source panner, with a handle method
+            resolution (float): grid spacing in degrees; 180 must be a
+                multiple of this
+
+        Returns:
+            PanningTable
+        """
+        n_el = int(round(180.0 / resolution)) + 1
+        n_az = int(round(360.0 / resolution)) + 1
+        assert abs((n_el - 1) * resolution - 180.0) < 1e-6, \
+            "180 must be a multiple of resolution"
+
+        gains = np.zeros((n_el, n_az, panner.num_channels))
+        for i, el in enumerate(np.linspace(-90.0, 90.0, n_el)):
+            # all azimuths are the same direction at the poles
+            azimuths = [0.0] if abs(el) == 90.0 else np.linspace(
+                -180.0, 180.0, n_az)
+            for j, az in enumerate(azimuths):
+                pv = panner.handle(cart(az, el, 1.0))
+                assert pv is not None, "panner does not handle all directions"
+                gains[i, j] = pv
+            if len(azimuths) == 1:
+                gains[i, 1:] = gains[i, 0]
+
+        return cls(gains, resolution)
+
+    def handle(self, position):
+        """Calculate gains for a position.
+
+        Parameters:
+            position (array of 3 floats): Cartesian source position
+
+        Returns:
+            array of num_channels floats
+        """
+        x, y, z = position
+        az = math.degrees(math.atan2(-x, y))
+        el = math.degrees(math.atan2(z, math.hypot(x, y)))
+
+        n_el, n_az = self.gains.shape[:2]
+        f_az = (az + 180.0) / self.resolution
+        f_el = (el + 90.0) / self.resolution
+        i_az = min(int(f_az), n_az - 2)
+        i_el = min(int(f_el), n_el - 2)
+        w_az = f_az - i_az
+        w_el = f_el - i_el
+
+        cell = self.gains[i_el:i_el + 2, i_az:i_az + 2]
+        pv = ((1.0 - w_el) * ((1.0 - w_az) * cell[0, 0] + w_az * cell[0, 1]) +
+              w_el * ((1.0 - w_az) * cell[1, 0] + w_az * cell[1, 1]))
+
+        if self.normalise:
+            pv /= np.linalg.norm(pv)
+        return pv
+
+    def estimate_error(self, panner, n_points=500, seed=0):
+        """Estimate the largest error of this table relative to panner.
+
+        The interpolation error is largest away from the grid points, so the
+        gains are compared at the centres of n_points randomly chosen grid
+        cells. This is an estimate rather than a bound: other directions may
+        have somewhat larger errors.
+
+        Returns:
+            float: largest absolute difference in any channel gain at the
+            points tested
+        """
+        rng = np.random.RandomState(seed)
+        n_el, n_az = self.gains.shape[:2]
+        max_error = 0.0
+        for i_el, i_az in zip(rng.randint(n_el - 1, size=n_points),
+                              rng.randint(n_az - 1, size=n_points)):
+            position = cart(-180.0 + (i_az + 0.5) * self.resolution,
+                            -90.0 + (i_el + 0.5) * self.resolution, 1.0)
+            error = np.max(
+                np.abs(self.handle(position) - panner.handle(position)))
+            max_error = max(max_error, error)
+        return max_error
+
+
+_tables = {}
+
+
+def get_panning_table(layout,
+                      panner,
+                      resolution,
+                      max_error,
+                      cache_dir=None,
+                      cache_max_size=0):
+    """Get a PanningTable for a layout, re-using one created previously in
+    this process, or stored in a FilterCache in cache_dir, if possible.
+
+    If the estimated error of the table is larger than max_error, a warning
+    is issued and None is returned, so that the panner should be used
+    directly.
+
+    Parameters:
+        layout (Layout): loudspeaker layout that panner was configured for
+        panner: point source panner for layout
+        resolution (float): grid spacing in degrees
+        max_error (float): largest acceptable estimated gain error
+        cache_dir (str or None): directory for a FilterCache
+        cache_max_size (int): maximum size of the FilterCache in bytes
+
+    Returns:
+        PanningTable or None
+    """
+    key = (layout.name, tuple(layout.channel_names),
+           tuple(map(tuple, layout.positions)), resolution)
+
+    if key not in _tables:
+        table = None
+        if cache_dir is not None:
+            cache = FilterCache(cache_dir, cache_max_size)
+            cache_key = cache.key(type="panning_table",
+                                  layout=layout_description(layout),
+                                  resolution=resolution)
+            arrays = cache.load(cache_key)
+            if arrays is not None:
+                table = PanningTable(arrays["gains"], resolution,
+                                     float(arrays["estimated_error"]))
+
+        if table is None:
+            table = PanningTable.from_panner(panner, resolution)
+            table.estimated_error = table.estimate_error(panner)
+            if cache_dir is not None:
+                cache.store(
+                    cache_key,
+                    dict(gains=table.gains,
+                         estimated_error=np.array(table.estimated_error)))
+
+        _tables[key] = table
+
+    table = _tables[key]
+    if table.estimated_error > max_error:
+        warnings.warn(
+            "panning table for layout {} has an estimated error of {:.3g}, "
+            "more than {:.3g}; using the point source panner".format(
+                layout.name, table.estimated_error, max_error))
+        return None
+    return table
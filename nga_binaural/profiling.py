@@ -0,0 +1,232 @@
+from contextlib import contextmanager
+import json
+import sys
+import threading
+import time
+
+"""accumulation of the time spent in each stage of the rendering
+
+Stages are marked in the code with `with stage(name):`; while a Profiler is
+enabled with `profile`, the wall time and number of calls of each stage are
+added to it, and otherwise stage returns a context manager which does
+nothing, so the overhead of the instrumentation is one function call.
+
+Stage names are made of parts separated by "/"; stages whose names start with
+the name of another stage and "/" are (normally) run inside it, so their time
+is included in its time. The stages used are:
+
+- adm: parsing the ADM metadata and selecting the rendering items
+- setup: constructing the renderer, including:
+  - setup/filters: preparing the filters and convolvers, or loading them from
+    the filter cache, if this has not been done before in this process;
+    this includes:
+    - setup/load_sofa: reading impulse responses from SOFA files
+    - setup/align_irs: aligning the HRIRs
+  - setup/hrir_set: preparing to interpolate HRIRs for objects rendered
+    directly on the HRIR path (see the hrir_objects option), if this has not
+    been done before in this process; this also includes setup/load_sofa and
+    setup/align_irs
+- hrir_grid: preparing the HRIRs of a chunk of measurements for objects
+  rendered directly on the HRIR path, or loading them from the filter cache,
+  when they are first used; this is normally in setup, but may be in render
+  for moving objects
+- read: reading input samples
+- render: rendering input samples, including:
+  - render/{objects,direct_speakers,hoa}/{brir,hrir,dirir}: the EAR renderers
+    for each type and path, producing virtual loudspeaker signals
+  - render/objects/hrir_direct: rendering and convolution of objects rendered
+    directly on the HRIR path
+  - render/convolve/{brir,hrir,dirir}: convolution of each path
+- write: writing output samples
+
+When the paths are processed on several threads (the `threads` binaural output
+option) the times of the path stages are summed across threads, so may add up
+to more than the time of the render stage. Stages run in other processes (e.g.
+when rendering segments with `--jobs`) are not included.
+"""
+
+
+class _NullStage(object):
+    """Context manager returned by stage when profiling is disabled."""
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+_null_stage = _NullStage()
+
+
+class _Stage(object):
+    """Context manager which adds the time taken by its body to a stage of a
+    Profiler."""
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profiler.add(self.name, time.perf_counter() - self.start)
+
+
+def peak_rss_mib():
+    """Get the peak resident set size of this process.
+
+    Returns:
+        float or None: peak RSS in MiB, or None if this can not be measured
+        on this platform
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, KiB elsewhere
+    return rss / 2.0**20 if sys.platform == "darwin" else rss / 2.0**10
+
+
+class Profiler(object):
+    """Wall time and call counts of the stages of the rendering, and the
+    duration of the audio rendered.
+
+    Attributes:
+        stages (dict): maps each stage name to a list of [total time in
+            seconds, number of calls]
+        audio_duration (float): duration of the input audio in seconds, added
+            with add_audio
+        wall_time (float or None): time for which the profiler was enabled in
+            seconds, or None if it has not been enabled
+    """
+    def __init__(self):
+        self.stages = {}
+        self.audio_duration = 0.0
+        self.wall_time = None
+        self._lock = threading.Lock()
+
+    def add(self, name, duration):
+        """Add one call taking duration seconds to stage name."""
+        with self._lock:
+            entry = self.stages.get(name)
+            if entry is None:
+                self.stages[name] = [duration, 1]
+            else:
+                entry[0] += duration
+                entry[1] += 1
+
+    def stage(self, name):
+        """Get a context manager which adds the time taken by its body to
+        stage name."""
+        return _Stage(self, name)
+
+    def add_audio(self, n_samples, sample_rate):
+        """Record that n_samples samples at sample_rate are being rendered."""
+        self.audio_duration += float(n_samples) / sample_rate
+
+    def report(self):
+        """Get a summary of the measurements, which can be stored as JSON.
+
+        Returns:
+            dict: with keys:
+
+            - wall_time: see wall_time
+            - audio_duration: see audio_duration
+            - realtime_factor: wall_time divided by audio_duration, or None if
+              either is not known
+            - peak_rss_mib: see peak_rss_mib
+            - stages: maps each stage name to a dict with its total time, calls
+              and mean time per call
+        """
+        if self.wall_time is not None and self.audio_duration > 0:
+            realtime_factor = self.wall_time / self.audio_duration
+        else:
+            realtime_factor = None
+
+        with self._lock:
+            stages = {
+                name: dict(time=total, calls=calls, mean=total / calls)
+                for name, (total, calls) in self.stages.items()
+            }
+
+        return dict(wall_time=self.wall_time,
+                    audio_duration=self.audio_duration,
+                    realtime_factor=realtime_factor,
+                    peak_rss_mib=peak_rss_mib(),
+                    stages=stages)
+
+    def write(self, path):
+        """Write the report to a JSON file at path."""
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2, sort_keys=True)
+            f.write("\n")
+
+
+# the enabled Profiler, or None
+_profiler = None
+
+
+@contextmanager
+def profile(profiler=None):
+    """Enable a Profiler for the body of a with statement.
+
+    Parameters:
+        profiler (Profiler or None): profiler to add to; a new one is used if
+            this is None
+
+    Yields:
+        Profiler: the enabled profiler; its wall_time includes the time
+        spent in the body
+    """
+    global _profiler
+    assert _profiler is None, "a profiler is already enabled"
+
+    if profiler is None:
+        profiler = Profiler()
+
+    _profiler = profiler
+    start = time.perf_counter()
+    try:
+        yield profiler
+    finally:
+        _profiler = None
+        profiler.wall_time = ((profiler.wall_time or 0.0) +
+                              time.perf_counter() - start)
+
+
+def stage(name):
+    """Get a context manager which adds the time taken by its body to stage
+    name of the enabled profiler, if there is one."""
+    if _profiler is None:
+        return _null_stage
+    return _Stage(_profiler, name)
+
+
+def timed_iter(name, iterable):
+    """Get an iterator over iterable which adds the time taken to get each
+    item to stage name of the enabled profiler, if there is one."""
+    if _profiler is None:
+        return iter(iterable)
+    return _timed_iter(_profiler, name, iterable)
+
+
+def _timed_iter(profiler, name, iterable):
+    it = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(it)
+        except StopIteration:
+            return
+        profiler.add(name, time.perf_counter() - start)
+        yield item
+
+
+def add_audio(n_samples, sample_rate):
+    """Record that n_samples samples at sample_rate are being rendered in the
+    enabled profiler, if there is one."""
+    if _profiler is not None:
+        _profiler.add_audio(n_samples, sample_rate)
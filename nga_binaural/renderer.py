@@ -1,5 +1,8 @@
-from .binaural_wrapper import BinauralWrapper, binaural_output_options
+from .binaural_wrapper import (BinauralConvolver, binaural_output_options,
+                               paths, rendering_items_for_path)
+from functools import partial
 import numpy as np
+from ear.core.delay import Delay
 from ear.core.objectbased.renderer import ObjectRenderer
 from ear.core.direct_speakers.renderer import DirectSpeakersRenderer
 from ear.core.scenebased.renderer import HOARenderer
@@ -50,36 +53,54 @@ class BinauralRenderer(object):
                  binaural_output_opts={}):
         self.block_aligner = BlockAligner(2)
 
-        self._object_renderer = BinauralWrapper(
-            ObjectRenderer,
-            layout,
-            virtual_layout,
-            sr,
-            renderer_opts=object_renderer_opts,
-            **binaural_output_opts)
-
-        self._direct_speakers_renderer = BinauralWrapper(
-            DirectSpeakersRenderer,
-            layout,
-            virtual_layout,
-            sr,
-            renderer_opts=direct_speakers_opts,
-            **binaural_output_opts)
-
-        self._hoa_renderer = BinauralWrapper(HOARenderer,
-                                             layout,
-                                             virtual_layout,
-                                             sr,
-                                             renderer_opts=hoa_renderer_opts,
-                                             **binaural_output_opts)
+        # all renderer types render to the same virtual layouts, so their
+        # loudspeaker signals are summed and convolved once
+        self._binaural_convolver = BinauralConvolver(virtual_layout, sr,
+                                                     **binaural_output_opts)
+
+        self._object_renderer = self._binaural_convolver.loudspeaker_renderer(
+            ObjectRenderer, renderer_opts=object_renderer_opts, name="objects")
+
+        self._direct_speakers_renderer = \
+            self._binaural_convolver.loudspeaker_renderer(
+                DirectSpeakersRenderer,
+                renderer_opts=direct_speakers_opts,
+                name="direct_speakers")
+
+        self._hoa_renderer = self._binaural_convolver.loudspeaker_renderer(
+            HOARenderer, renderer_opts=hoa_renderer_opts, name="hoa")
+
+        # objects rendered without panning on the HRIR path
+        self._object_hrir_renderer = \
+            self._binaural_convolver.object_hrir_renderer(
+                self._object_renderer.overall_delay)
+
+        # The DirectSpeakers and HOA renderings have always been added to the
+        # output without compensating for the convolution delay, i.e. they
+        # are late by overall_delay relative to the objects. Delay their
+        # loudspeaker signals accordingly, so that the output is unchanged.
+        self.overall_delay = self._binaural_convolver.delay(
+            self._object_renderer.overall_delay)
+        self._non_object_delays = [
+            Delay(len(virtual_layout.channels), self.overall_delay)
+            for virtual_layout in (self._binaural_convolver.brir_layout,
+                                   self._binaural_convolver.hrir_layout,
+                                   self._binaural_convolver.dirir_layout)
+        ]
 
         self.start_sample = 0
 
     def set_rendering_items(self, rendering_items):
-        self._object_renderer.set_rendering_items([
+        objects = [
             item for item in rendering_items
             if isinstance(item, ObjectRenderingItem)
-        ])
+        ]
+        # see the hrir_objects binaural output option
+        direct_objects = self._binaural_convolver.direct_hrir_objects(objects)
+        self._object_renderer.set_rendering_items(
+            objects, excluded_items=dict(hrir=direct_objects))
+        self._object_hrir_renderer.set_rendering_items(
+            rendering_items_for_path(direct_objects, "hrir"))
 
         self._direct_speakers_renderer.set_rendering_items([
             item for item in rendering_items
@@ -93,6 +114,100 @@ class BinauralRenderer(object):
 
         # XXX: check for unsupported types?
 
+    @property
+    def skipped_blocks(self):
+        """Counts of processing skipped because the input was silent.
+
+        Returns:
+            dict: "convolution" maps each path (hrir, brir and dirir) to the
+            number of convolution blocks skipped; "objects",
+            "direct_speakers" and "hoa" map each path to the number of calls
+            in which that renderer was not run
+        """
+        return dict(
+            convolution=self._binaural_convolver.skipped_blocks,
+            objects=dict(self._object_renderer.skipped_blocks),
+            direct_speakers=dict(
+                self._direct_speakers_renderer.skipped_blocks),
+            hoa=dict(self._hoa_renderer.skipped_blocks),
+        )
+
+    @property
+    def warmup_samples(self):
+        """int: number of samples after which the output no longer depends on
+        the state of the delays and filters; see seek"""
+        return 2 * self.overall_delay + max(
+            self._binaural_convolver.tail_length,
+            self._object_hrir_renderer.tail_length)
+
+    def seek(self, sample_rate, start_sample):
+        """Start rendering from input sample start_sample rather than 0.
+
+        The metadata before start_sample is interpreted, so that gains are
+        interpolated as if the whole input had been rendered, but no audio is
+        rendered. The delays and filters therefore start empty, and the
+        output is only the same as when rendering from the start after
+        warmup_samples samples.
+
+        This must be called after set_rendering_items and before render. The
+        first sample returned by render is then output sample
+        max(start_sample - overall_delay, 0).
+
+        Args:
+            sample_rate (int): Sample Rate.
+            start_sample (int): index of the first sample that will be passed
+                to render
+        """
+        assert self.start_sample == 0, "seek must be called before render"
+
+        for renderer in (self._object_renderer,
+                         self._direct_speakers_renderer, self._hoa_renderer,
+                         self._object_hrir_renderer):
+            renderer.skip_metadata(sample_rate, start_sample)
+
+        self.start_sample = start_sample
+        # nothing before this is rendered, so it is the new time 0 for the
+        # block aligner, rather than samples which must be discarded
+        self.block_aligner.buf_start = max(start_sample - self.overall_delay,
+                                           0)
+
+    def set_head_orientation(self, yaw, pitch, roll):
+        """Set the orientation of the listener's head, used from the next
+        block rendered; the head_tracking binaural output option must be
+        enabled. The rendering is crossfaded to the new orientation over that
+        block.
+
+        Parameters:
+            yaw (float): rotation to the left in degrees
+            pitch (float): upwards rotation in degrees
+            roll (float): rotation to the right in degrees
+
+        See head_tracking.rotation_matrix.
+        """
+        head_tracker = self._binaural_convolver.head_tracker
+        assert head_tracker is not None, "head tracking is not enabled"
+        head_tracker.set_orientation(yaw, pitch, roll)
+
+    def _render_path(self, path, delay, sample_rate, samples):
+        """Render the virtual loudspeaker signals of one path (brir, hrir or
+        dirir) for all types, and convolve their sum."""
+        object_signal = self._object_renderer.render_path(
+            path, sample_rate, self.start_sample, samples)
+        direct_speakers_signal = self._direct_speakers_renderer.render_path(
+            path, sample_rate, self.start_sample, samples)
+        hoa_signal = self._hoa_renderer.render_path(path, sample_rate,
+                                                    self.start_sample, samples)
+
+        loudspeaker_signal = object_signal + delay.process(
+            direct_speakers_signal + hoa_signal)
+        rendering = self._binaural_convolver.process_path(
+            path, loudspeaker_signal)
+
+        if path == "hrir" and self._object_hrir_renderer.active:
+            rendering += self._object_hrir_renderer.render(
+                sample_rate, self.start_sample, samples)
+        return rendering
+
     def render(self, sample_rate, samples):
         """Render n samples.
 
@@ -109,20 +224,15 @@ class BinauralRenderer(object):
         Returns:
             ndarray of (m, l): m samples and l channels of output audio.
         """
-        
-        self.block_aligner.add(
-            self.start_sample - self._object_renderer.overall_delay,
-            self._object_renderer.render(sample_rate, self.start_sample,
-                                         samples))
+        if self._binaural_convolver.head_tracker is not None:
+            self._binaural_convolver.head_tracker.next_block()
 
-        self.block_aligner.add(
-            self.start_sample,
-            self._direct_speakers_renderer.render(sample_rate,
-                                                  self.start_sample, samples))
+        renderings = self._binaural_convolver.executor.map(
+            partial(self._render_path, sample_rate=sample_rate,
+                    samples=samples), paths, self._non_object_delays)
 
-        self.block_aligner.add(
-            self.start_sample,
-            self._hoa_renderer.render(sample_rate, self.start_sample, samples))
+        self.block_aligner.add(self.start_sample - self.overall_delay,
+                               self._binaural_convolver.mix(*renderings))
 
         self.start_sample += len(samples)
 
@@ -130,6 +240,183 @@ class BinauralRenderer(object):
 
     def get_tail(self, sample_rate, n_channels):
         """Get an additional block of samples that completes the output."""
-        total_delay = self._object_renderer.overall_delay
+        total_delay = self.overall_delay
 
         return self.render(sample_rate, np.zeros((total_delay, n_channels)))
+
+    def close(self):
+        """Stop any threads used by this renderer."""
+        self._binaural_convolver.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class _BlockDelay(object):
+    """Delay line for fixed-size blocks which does not allocate while
+    processing.
+
+    Parameters:
+        block_size (int): number of samples in each block
+        nchannels (int): number of channels to process
+        delay (int): number of samples to delay by
+    """
+    def __init__(self, block_size, nchannels, delay):
+        self.block_size = block_size
+        self.delay = delay
+        # the delayed samples followed by the current block; the two buffers
+        # are swapped after each block to avoid overlapping copies
+        self._buffers = [
+            np.zeros((delay + block_size, nchannels)) for i in range(2)
+        ]
+
+    def process(self, input_samples, out):
+        """Delay one block of input_samples, writing the result to out."""
+        current, next_ = self._buffers
+        current[self.delay:] = input_samples
+        out[:] = current[:self.block_size]
+        next_[:self.delay] = current[self.block_size:]
+        self._buffers.reverse()
+
+
+class BinauralStreamRenderer(object):
+    """Binaural renderer for real-time use, processing fixed-size blocks.
+
+    Unlike BinauralRenderer, the output is not aligned with the input; output
+    sample i corresponds to input sample i - latency. The convolution block
+    size and the object renderer block size are both set to block_size, so
+    that the latency is as low as possible.
+
+    All buffers used outside of the EAR renderers and the FFTs are allocated
+    here, and the array returned by process is re-used for every block.
+
+    Parameters:
+        virtual_layout (str or None): BS.2051 layout name for the HRIR path;
+            see BinauralConvolver
+        sr (int): sample rate
+        block_size (int): number of samples in each input and output block
+        **options: see BinauralRenderer.options; block_size in
+            binaural_output_opts and object_renderer_opts is overridden
+
+    Attributes:
+        block_size (int): number of samples in each input and output block
+        latency (int): delay of the output relative to the input in samples
+    """
+    options = BinauralRenderer.options
+
+    @options.with_defaults
+    def __init__(self,
+                 virtual_layout,
+                 sr,
+                 block_size=128,
+                 object_renderer_opts={},
+                 direct_speakers_opts={},
+                 hoa_renderer_opts={},
+                 binaural_output_opts={}):
+        self.block_size = block_size
+        self.sr = sr
+
+        self._binaural_convolver = BinauralConvolver(
+            virtual_layout, sr,
+            **dict(binaural_output_opts, block_size=block_size))
+        virtual_layouts = (self._binaural_convolver.brir_layout,
+                           self._binaural_convolver.hrir_layout,
+                           self._binaural_convolver.dirir_layout)
+
+        self._object_renderer = self._binaural_convolver.loudspeaker_renderer(
+            ObjectRenderer,
+            renderer_opts=dict(object_renderer_opts, block_size=block_size),
+            name="objects")
+        self._direct_speakers_renderer = \
+            self._binaural_convolver.loudspeaker_renderer(
+                DirectSpeakersRenderer,
+                renderer_opts=direct_speakers_opts,
+                name="direct_speakers")
+        self._hoa_renderer = self._binaural_convolver.loudspeaker_renderer(
+            HOARenderer, renderer_opts=hoa_renderer_opts, name="hoa")
+        self._object_hrir_renderer = \
+            self._binaural_convolver.object_hrir_renderer(
+                self._object_renderer.overall_delay)
+
+        # the convolution adds no delay as blocks are processed as they are;
+        # only the objects are delayed (by the decorrelators), so delay the
+        # DirectSpeakers and HOA signals to match
+        self.latency = self._object_renderer.overall_delay
+
+        # per path (BRIR, HRIR and direct): summed non-object signals, their
+        # delayed version, and the sum of all signals
+        shapes = [(block_size, len(layout.channels))
+                  for layout in virtual_layouts]
+        self._non_object_sums = [np.zeros(shape) for shape in shapes]
+        self._loudspeaker_signals = [np.zeros(shape) for shape in shapes]
+        self._non_object_delays = [
+            _BlockDelay(block_size, nchannels, self.latency)
+            for _, nchannels in shapes
+        ]
+        self._output = np.zeros((block_size, 2))
+
+        self.start_sample = 0
+
+    set_rendering_items = BinauralRenderer.set_rendering_items
+    set_head_orientation = BinauralRenderer.set_head_orientation
+    skipped_blocks = BinauralRenderer.skipped_blocks
+
+    def _process_path(self, path, non_object_sum, delay, loudspeaker_signal,
+                      samples):
+        """Render the virtual loudspeaker signals of one path (brir, hrir or
+        dirir) for all types into loudspeaker_signal, and convolve them."""
+        object_signal = self._object_renderer.render_path(
+            path, self.sr, self.start_sample, samples)
+        direct_speakers_signal = self._direct_speakers_renderer.render_path(
+            path, self.sr, self.start_sample, samples)
+        hoa_signal = self._hoa_renderer.render_path(path, self.sr,
+                                                    self.start_sample, samples)
+
+        np.add(direct_speakers_signal, hoa_signal, out=non_object_sum)
+        delay.process(non_object_sum, loudspeaker_signal)
+        loudspeaker_signal += object_signal
+        rendering = self._binaural_convolver.process_block_path(
+            path, loudspeaker_signal)
+
+        if path == "hrir" and self._object_hrir_renderer.active:
+            rendering += self._object_hrir_renderer.process_block(
+                self.sr, self.start_sample, samples)
+        return rendering
+
+    def process(self, samples):
+        """Render one block.
+
+        Parameters:
+            samples (ndarray of (block_size, k) floats): k channels of input
+                audio
+
+        Returns:
+            ndarray of (block_size, 2) floats: binaural output, delayed by
+                latency samples. This array is overwritten by the next call.
+        """
+        assert len(samples) == self.block_size, "wrong block size"
+        if self._binaural_convolver.head_tracker is not None:
+            self._binaural_convolver.head_tracker.next_block()
+
+        renderings = self._binaural_convolver.executor.map(
+            partial(self._process_path, samples=samples), paths,
+            self._non_object_sums, self._non_object_delays,
+            self._loudspeaker_signals)
+        self._binaural_convolver.mix(*renderings, out=self._output)
+
+        self.start_sample += self.block_size
+
+        return self._output
+
+    def close(self):
+        """Stop any threads used by this renderer."""
+        self._binaural_convolver.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,205 @@
+import math
+import multiprocessing
+import os
+import tempfile
+import numpy as np
+from ear.fileio import openBw64, openBw64Adm
+from .renderer import BinauralRenderer
+from . import profiling
+
+"""render one long file in a pool of worker processes
+
+The input is split into segments, each of which is rendered by a separate
+renderer. A renderer for a segment starting at sample s seeks to
+s - warmup_samples (see BinauralRenderer.seek), renders the input from there,
+and discards the output before s, so that its filters and delays are in the
+same state as when rendering the whole file in one go; the outputs of the
+segments are then concatenated.
+
+Segments start on multiples of the driver and convolution block sizes, so that
+all blocks are processed with the same boundaries as the sequential rendering,
+and the output is the same.
+"""
+
+# driver for the current worker process, set by _init_worker
+_driver = None
+
+
+def _init_worker(driver):
+    global _driver
+    _driver = driver
+
+
+def _n_samples(input_file):
+    """Get the number of sample frames in a BW64 file."""
+    with openBw64(input_file) as f:
+        return len(f)
+
+
+def plan_segments(n_samples, segment_size, alignment):
+    """Split n_samples samples into segments.
+
+    Parameters:
+        n_samples (int): total number of samples
+        segment_size (int): maximum segment length; this is rounded up to a
+            multiple of alignment
+        alignment (int): all segments start on a multiple of this
+
+    Returns:
+        list of (start, end) tuples: sample ranges of the segments, in order
+    """
+    segment_size = max(-(-segment_size // alignment), 1) * alignment
+    return [(start, min(start + segment_size, n_samples))
+            for start in range(0, n_samples, segment_size)]
+
+
+def _alignment(driver, renderer):
+    """Get the number of samples that segments and warm-up periods must be a
+    multiple of."""
+    a, b = driver.blocksize, renderer._binaural_convolver.block_size
+    return a * b // math.gcd(a, b)
+
+
+def render_segment(job):
+    """Render one segment of a file using the driver of this process.
+
+    Parameters:
+        job (tuple): (input file, start, end, output file); the output
+            samples from start to end are written to the output file in .npy
+            format
+
+    Returns:
+        str: output file name
+    """
+    input_file, start, end, output_file = job
+    driver = _driver
+
+    spkr_layout, upmix, n_channels = driver.load_output_layout(driver)
+    with openBw64Adm(input_file, driver.enable_block_duration_fix) as infile:
+        sr = infile.sampleRate
+        renderer = BinauralRenderer(spkr_layout,
+                                    driver.target_layout,
+                                    sr=sr,
+                                    **driver.config)
+        renderer.set_rendering_items(driver.get_rendering_items(infile.adm))
+
+    # round the warm-up up, so that blocks are aligned with the sequential
+    # rendering
+    alignment = _alignment(driver, renderer)
+    warmup = -(-renderer.warmup_samples // alignment) * alignment
+    render_start = max(start - warmup, 0)
+    renderer.seek(sr, render_start)
+
+    output = np.lib.format.open_memmap(output_file,
+                                       mode="w+",
+                                       shape=(end - start, n_channels))
+    with openBw64(input_file) as f, renderer:
+        f.seek(render_start)
+        output_position = max(render_start - renderer.overall_delay, 0)
+        head_orientations = getattr(driver, "head_orientations", None)
+        while output_position < end:
+            if f.tell() < len(f) and head_orientations is not None:
+                output_samples = head_orientations.render(
+                    renderer, sr, f.read(driver.blocksize))
+            elif f.tell() < len(f):
+                output_samples = renderer.render(sr, f.read(driver.blocksize))
+            else:
+                output_samples = renderer.get_tail(sr, f.channels)
+                assert output_position + len(output_samples) >= end
+
+            # copy the part of output_samples between start and end
+            first = max(start - output_position, 0)
+            last = min(end - output_position, len(output_samples))
+            if first < last:
+                output[output_position + first - start:output_position +
+                       last - start] = output_samples[first:last]
+            output_position += len(output_samples)
+    output.flush()
+
+    return output_file
+
+
+def _get_mp_context():
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    else:
+        return multiprocessing.get_context()
+
+
+def render_input_file_segmented(driver,
+                                infile,
+                                spkr_layout,
+                                virtual_layout,
+                                upmix=None,
+                                input_file=None,
+                                jobs=1,
+                                segment_duration=None,
+                                tmp_dir=None):
+    """Get sample blocks of the input file after rendering, rendering
+    segments of the file in parallel; this can be used in place of
+    cmdline._render_input_file_binaural, with the extra parameters bound
+    using functools.partial.
+
+    The output is the same as for _render_input_file_binaural, but is
+    returned in blocks of up to driver.blocksize samples.
+
+    Parameters:
+        infile (Bw64AdmReader): file to read from
+        spkr_layout (Layout): layout to render to
+        virtual_layout (str or None): see BinauralRenderer
+        upmix (sparse array or None): optional upmix to apply
+        input_file (str): path of infile, which is opened again by the
+            workers
+        jobs (int): number of worker processes
+        segment_duration (float or None): maximum length of each segment in
+            seconds; by default the input is split into one segment per job
+        tmp_dir (str or None): directory to store rendered segments in
+
+    Yields:
+        2D sample blocks
+    """
+    assert input_file is not None, "input_file must be given"
+    sr = infile.sampleRate
+    n_samples = _n_samples(input_file)
+
+    # this prepares the filters and layouts, which are shared with forked
+    # workers, and gives the convolution block size
+    with profiling.stage("setup"):
+        renderer = BinauralRenderer(spkr_layout,
+                                    virtual_layout,
+                                    sr=sr,
+                                    **driver.config)
+    alignment = _alignment(driver, renderer)
+    renderer.close()
+
+    if segment_duration is None:
+        segment_size = -(-n_samples // jobs)
+    else:
+        segment_size = int(segment_duration * sr)
+    segments = plan_segments(n_samples, segment_size, alignment)
+
+    with tempfile.TemporaryDirectory(prefix="nga-binaural-",
+                                     dir=tmp_dir) as segment_dir:
+        jobs_args = [(input_file, start, end,
+                      os.path.join(segment_dir, "{}.npy".format(i)))
+                     for i, (start, end) in enumerate(segments)]
+
+        with _get_mp_context().Pool(max(min(jobs, len(segments)), 1),
+                                    initializer=_init_worker,
+                                    initargs=(driver, )) as pool:
+            for segment_file in pool.imap(render_segment,
+                                          jobs_args,
+                                          chunksize=1):
+                segment = np.load(segment_file, mmap_mode="r")
+                for block_start in range(0, len(segment), driver.blocksize):
+                    output_samples = np.array(
+                        segment[block_start:block_start + driver.blocksize])
+
+                    output_samples *= driver.output_gain_linear
+
+                    if upmix is not None:
+                        output_samples *= upmix
+
+                    yield output_samples
+                del segment
+                os.remove(segment_file)
@@ -3,33 +3,106 @@ from ear.core import bs2051, allocentric, point_source, convolver
 from . import binaural_point_source
 
 
-def load_hdf5(file_url):
-    """Load a HDF5 file from a URL of the form:
+def resolve_file_url(file_url):
+    """Get the path of a file from a URL of the form:
 
-    `file:PATH`: load from file at PATH
-    `resource:PATH`: load from package resource PATH
+    `file:PATH`: file at PATH
+    `resource:PATH`: package resource PATH
     """
-    import h5py
     import pkg_resources
 
     scheme, path = file_url.split(':', 1)
 
     if scheme == "resource":
-        real_path = pkg_resources.resource_filename(__name__, path)
+        return pkg_resources.resource_filename(__name__, path)
     elif scheme == "file":
-        real_path = path
+        return path
     else:
         assert False, "unknown resource scheme {scheme}".format(scheme=scheme)
 
-    return h5py.File(real_path, 'r')
+
+def load_hdf5(file_url):
+    """Load a HDF5 file from a URL; see resolve_file_url."""
+    import h5py
+
+    return h5py.File(resolve_file_url(file_url), 'r')
+
+
+class SourceIndex(object):
+    """Spatial index of measurement directions, for finding the measurements
+    closest to arbitrary positions.
+
+    Only the directions of the positions are used; distances are ignored.
+
+    Parameters:
+        positions (array of (n, 3) floats): Cartesian measurement positions
+    """
+    def __init__(self, positions):
+        from scipy.spatial import cKDTree
+
+        self.directions = self._normalise(positions)
+        self.tree = cKDTree(self.directions)
+
+    @staticmethod
+    def _normalise(positions):
+        positions = np.asarray(positions, dtype=float)
+        return positions / np.linalg.norm(positions, axis=-1, keepdims=True)
+
+    def nearest(self, positions):
+        """Find the nearest measurement to each position.
+
+        Parameters:
+            positions (array of (m, 3) floats): Cartesian positions
+
+        Returns:
+            array of (m,) ints: measurement indices
+        """
+        _, idxes = self.tree.query(self._normalise(positions))
+        return idxes
+
+    def k_nearest(self, positions, k=3):
+        """Find the k nearest measurements to each position, with weights for
+        interpolating between them.
+
+        The weights are proportional to the inverse of the distance between
+        the directions and sum to one; a position which coincides with a
+        measurement gets a weight of one for that measurement.
+
+        Parameters:
+            positions (array of (m, 3) floats): Cartesian positions
+            k (int): number of measurements to find
+
+        Returns:
+            array of (m, k) ints: measurement indices, nearest first
+            array of (m, k) floats: interpolation weights
+        """
+        distances, idxes = self.tree.query(self._normalise(positions), k=k)
+        distances = distances.reshape(len(distances), k)
+        idxes = idxes.reshape(len(idxes), k)
+
+        coincident = distances < 1e-9
+        weights = np.where(coincident, 1.0,
+                           1.0 / np.maximum(distances, 1e-9))
+        any_coincident = np.any(coincident, axis=1, keepdims=True)
+        weights[any_coincident & ~coincident] = 0.0
+        weights /= np.sum(weights, axis=1, keepdims=True)
+
+        return idxes, weights
+
+
+_source_indices = {}
 
 
 class SOFAFileHRIR(object):
     """Simple SOFA interface allowing IRs to be extracted from a
     SimpleFreeFieldHRIR convention file.
+
+    Attributes:
+        bytes_read (int): number of bytes of IR data read from the file
     """
     def __init__(self, f):
         self.f = f
+        self.bytes_read = 0
 
         self.check()
 
@@ -64,15 +137,19 @@ class SOFAFileHRIR(object):
         sp = np.array(self.f["SourcePosition"])
         return cart(*sp.T)
 
-    def select_sources(self, positions, exact):
-        source_positions = self.source_positions()
+    def source_index(self):
+        """Get a SourceIndex of the source positions in this file; this is
+        only built once per file."""
+        if self.f.filename not in _source_indices:
+            _source_indices[self.f.filename] = SourceIndex(
+                self.source_positions())
+        return _source_indices[self.f.filename]
 
-        distances = np.linalg.norm(positions[:, np.newaxis] -
-                                   source_positions[np.newaxis],
-                                   axis=2)
-        source_idxes = np.argmin(distances, 1)
+    def select_sources(self, positions, exact):
+        source_idxes = self.source_index().nearest(positions)
 
         if exact:
+            source_positions = self.source_positions()
             assert np.max(
                 np.linalg.norm(source_positions[source_idxes] - positions,
                                axis=1)) < 1e-5
@@ -82,10 +159,28 @@ class SOFAFileHRIR(object):
     def irs_for_positions(self, positions, exact=False):
         #assert self.f["Data.SamplingRate"][0] == fs
 
-        sources = self.select_sources(positions, exact)
+        return self.irs_for_sources(self.select_sources(positions, exact))
+
+    def irs_for_sources(self, sources):
+        """Get the IRs of some measurements.
+
+        Parameters:
+            sources (array of ints): measurement indices, in the order of
+                source_positions
+
+        Returns:
+            array of (len(sources), 2, N) floats: IRs for the left and right
+            ears
+        """
         recievers = self.select_receivers()
 
-        irs = np.array(self.f["Data.IR"])[np.ix_(sources, recievers)]
+        # read only the measurements that are needed; h5py requires the
+        # indices to be increasing and unique
+        unique_sources, source_idxes = np.unique(sources, return_inverse=True)
+        source_irs = self.f["Data.IR"][unique_sources.tolist()]
+        self.bytes_read += source_irs.nbytes
+
+        irs = source_irs[np.ix_(source_idxes, recievers)]
 
         return irs
 
@@ -93,37 +188,45 @@ class SOFAFileHRIR(object):
         return int(self.f["Data.SamplingRate"][0])
 
 def calc_gain_of_irs(irs):
-    list_of_gains = []
-    for ir in irs:
-        pow1L = np.sum(np.abs(ir[0])) / len(ir[0])
-        pow1R = np.sum(np.abs(ir[1])) / len(ir[0])
-        pow2L = 0.5 / len(ir[0])
-        pow2R = 0.5 / len(ir[0])
-        pow2Lnorm = pow2L / pow1L / 2
-        pow2Rnorm = pow2R / pow1R / 2
-        
-        pow2LR_sum = pow2Lnorm+pow2Rnorm
-        list_of_gains.append(pow2LR_sum)
-    
-    avg_gain = np.average(list_of_gains)
-    return avg_gain
-    
+    """Get the gain used to normalise a set of IRs: the average over the IRs
+    of the sum over both ears of 0.25 / (sum of absolute sample values).
+
+    Parameters:
+        irs (array of (n_irs, 2, n) floats): IRs
+
+    Returns:
+        float
+    """
+    return np.mean(np.sum(0.25 / np.sum(np.abs(irs), axis=2), axis=1))
+
+
 def calc_delay_of_irs(irs):
-    list_min_delay = []
-    for ir in irs:
-        max_amp_l = np.argmax(ir[0, :])
-        max_amp_r = np.argmax(ir[1, :])
-        if max_amp_l <= max_amp_r:
-            list_min_delay.append(max_amp_l)
-        else:
-            list_min_delay.append(max_amp_r)
-        
-    totalavg_mindelay = np.average(list_min_delay)
-    
-    return totalavg_mindelay
-    
+    """Get the average delay of a set of IRs, where the delay of one IR is the
+    position of the maximum of the ear which it reaches first.
+
+    Parameters:
+        irs (array of (n_irs, 2, n) floats): IRs
+
+    Returns:
+        float: delay in samples
+    """
+    return np.mean(np.min(np.argmax(irs, axis=2), axis=1))
+
+
 def get_binaural_layout(spec):
-    bs2051.layout_names, bs2051.layouts = binaural_point_source._load_binaural_layouts()
-    allocentric._allo_positions = binaural_point_source._load_allo_positions_binaural()
-    
+    """Get a binaural virtual loudspeaker layout.
+
+    This installs the binaural layouts (see
+    binaural_point_source.get_layout_registry) in place of the EAR BS.2051
+    layouts, so that they are used by the EAR renderers.
+
+    Parameters:
+        spec (tuple): ("binaural" or "bs2051", layout name)
+
+    Returns:
+        Layout: the layout, without LFE channels
+    """
+    (bs2051.layout_names, bs2051.layouts,
+     allocentric._allo_positions) = binaural_point_source.get_layout_registry()
+
     return bs2051.get_layout(spec[1]).without_lfe
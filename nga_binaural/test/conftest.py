@@ -0,0 +1,49 @@
+import argparse
+import pytest
+from nga_binaural import cmdline
+
+# the default hrir_file (HRIR_FULL2DEG.sofa) is not included in the
+# repository, so the tests use the BRIRs for the HRIR path too
+test_sofa_file = "resource:data/BRIR_KU100_60ms.sofa"
+
+
+def _make_driver(args=None):
+    """Make a driver with cmdline.make_driver which uses the test SOFA file.
+
+    Parameters:
+        args (argparse.Namespace or None): arguments for
+            cmdline.make_driver; if None, the defaults are used
+    """
+    if args is None:
+        parser = argparse.ArgumentParser()
+        cmdline.add_commands_for_offline_driver(parser)
+        cmdline.add_filter_cache_commands(parser)
+        args = parser.parse_args([])
+
+    driver = cmdline.make_driver(args)
+    driver.config["binaural_output_opts"]["hrir_file"] = test_sofa_file
+    return driver
+
+
+@pytest.fixture
+def sofa_file():
+    """SOFA file to load HRIRs from"""
+    return test_sofa_file
+
+
+@pytest.fixture
+def binaural_output_opts(sofa_file):
+    """binaural output options for the renderers, using sofa_file"""
+    return dict(hrir_file=sofa_file)
+
+
+@pytest.fixture
+def make_driver():
+    """function making drivers from command line arguments; see _make_driver"""
+    return _make_driver
+
+
+@pytest.fixture
+def driver(make_driver):
+    """driver for binaural rendering with the default options"""
+    return make_driver()
@@ -0,0 +1,174 @@
+import numpy as np
+import numpy.testing as npt
+import pytest
+from scipy import signal
+from nga_binaural import sofa
+from nga_binaural.align_irs import (align_irs, delay_and_resample,
+                                    ir_onsets, oversample_fact)
+
+
+def align_irs_loops(irs):
+    """the previous implementation of align_irs, which processes each IR in
+    turn"""
+    oversample_fact = 2
+    irs = np.array([
+        signal.resample(ir, len(ir[0]) * oversample_fact, axis=1)
+        for ir in irs
+    ])
+
+    listLmax = []
+    listRmax = []
+    list_min_delay = []
+
+    posorneg = np.max(irs)
+    for ir in irs:
+        if posorneg < 0:
+            max_amp_l = np.argmax(-ir[0, :])
+            max_amp_r = np.argmax(-ir[1, :])
+        elif posorneg > 0:
+            max_amp_l = np.argmax(ir[0, :])
+            max_amp_r = np.argmax(ir[1, :])
+
+        if max_amp_l <= max_amp_r:
+            if posorneg < 0:
+                peak = signal.find_peaks(-ir[0, :], height=0.2)
+            else:
+                peak = signal.find_peaks(ir[0, :], height=0.2)
+
+            if (len(peak[0]) >= 2 and peak[0][0] <= peak[0][1]
+                    and max_amp_r - max_amp_l <= oversample_fact * 20):
+                max_amp_l = peak[0][0]
+            list_min_delay.append(max_amp_l)
+        else:
+            if posorneg < 0:
+                peak = signal.find_peaks(-ir[1, :], height=0.2)
+            else:
+                peak = signal.find_peaks(ir[1, :], height=0.2)
+
+            if (len(peak[0]) >= 2 and peak[0][0] <= peak[0][1]
+                    and max_amp_l - max_amp_r <= oversample_fact * 20):
+                max_amp_r = peak[0][0]
+            list_min_delay.append(max_amp_r)
+
+        listLmax.append(max_amp_l)
+        listRmax.append(max_amp_r)
+
+    maxdelay = int(np.amax(list_min_delay))
+
+    irs_aligned = []
+    for i_idx, ir in enumerate(irs):
+        if listLmax[i_idx] <= listRmax[i_idx]:
+            shift = maxdelay - listLmax[i_idx]
+        else:
+            shift = maxdelay - listRmax[i_idx]
+        irs_aligned.append(
+            np.concatenate((np.zeros((2, shift)), ir[:, :]), axis=1))
+
+    max_length = max(ir.shape[1] for ir in irs_aligned)
+    irs_final = [
+        np.concatenate((ir, np.zeros((2, max_length - ir.shape[1]))), axis=1)
+        for ir in irs_aligned
+    ]
+
+    return signal.resample(irs_final,
+                           int(len(irs_final[0][0]) / oversample_fact),
+                           axis=2)
+
+
+def synthetic_irs(n_irs, n, sign=1.0, seed=0):
+    """decaying noise with a direct sound at a different time in each IR and
+    ear, and an early reflection"""
+    rng = np.random.RandomState(seed)
+    irs = rng.randn(n_irs, 2, n) * 0.02 * np.exp(-np.arange(n) / (n / 8.0))
+    for ir in irs:
+        onset = rng.randint(5, n // 4)
+        ir[0, onset] += 1.0
+        ir[1, onset + rng.randint(-30, 30)] += 0.7
+        ir[0, onset + rng.randint(3, 40)] += 0.5
+    return sign * irs
+
+
+@pytest.mark.parametrize("layout_name", ["BRIR", "all_defined"])
+def test_align_irs_sofa(layout_name):
+    layout = sofa.get_binaural_layout(("binaural", layout_name))
+    sofa_file = sofa.SOFAFileHRIR(
+        sofa.load_hdf5("resource:data/BRIR_KU100_60ms.sofa"))
+    irs = sofa_file.irs_for_positions(layout.positions)
+
+    expected = align_irs_loops(irs)
+    aligned = align_irs(irs)
+    assert aligned.shape == expected.shape
+    npt.assert_allclose(aligned, expected, atol=1e-12 * np.max(np.abs(irs)))
+
+
+@pytest.mark.parametrize("n", [255, 256])
+@pytest.mark.parametrize("sign", [1.0, -1.0])
+def test_align_irs_synthetic(n, sign):
+    irs = synthetic_irs(20, n, sign)
+    if sign < 0:
+        # all samples must be negative for the IRs to be inverted
+        irs -= np.max(irs) + 0.01
+
+    expected = align_irs_loops(irs)
+    aligned = align_irs(irs)
+    assert aligned.shape == expected.shape
+    npt.assert_allclose(aligned, expected, atol=1e-12)
+
+
+def test_align_irs_reference():
+    irs = synthetic_irs(20, 256)
+    # IRs with onsets later and earlier than those of the reference IRs,
+    # which do not decay to zero
+    irs[10:12] = np.random.RandomState(1).randn(2, 2, 256) * 0.02
+    irs[10, :, :150] = 0.0
+    irs[10, :, 150] += 1.0
+    irs[11, :, 1] += 1.0
+    reference = np.arange(2, 10)
+
+    aligned = align_irs(irs, reference_onsets=ir_onsets(irs[reference]))
+    npt.assert_allclose(aligned[reference],
+                        align_irs(irs[reference]),
+                        atol=1e-12)
+
+    # the other IRs are zero-padded and truncated, rather than wrapping
+    # around
+    irs_os = signal.resample(irs, 256 * oversample_fact, axis=2)
+    onsets = ir_onsets(irs)
+    delays = np.max(onsets[reference]) - onsets
+    padded_length = (np.max(onsets[reference]) - np.min(onsets[reference]) +
+                     256 * oversample_fact)
+    assert delays[10] < 0
+    assert delays[11] + 256 * oversample_fact > padded_length
+    for i in [10, 11]:
+        padded = np.zeros((2, padded_length + 1024))
+        padded[:, 512 + delays[i]:][:, :256 * oversample_fact] = irs_os[i]
+        expected = signal.resample(padded[:, 512:512 + padded_length],
+                                   aligned.shape[2],
+                                   axis=1)
+        npt.assert_allclose(aligned[i], expected, atol=1e-12)
+
+
+@pytest.mark.parametrize("num", [15, 16])
+def test_delay_and_resample(num):
+    irs = np.random.RandomState(0).randn(3, 2, 20)
+    delays = np.array([0, 3, 10])
+
+    padded = np.zeros((3, 2, 33))
+    for ir, delay, p in zip(irs, delays, padded):
+        p[:, delay:delay + 20] = ir
+
+    npt.assert_allclose(delay_and_resample(irs, delays, 33, num),
+                        signal.resample(padded, num, axis=2),
+                        atol=1e-12)
+
+
+def test_calc_irs():
+    irs = synthetic_irs(10, 128)
+
+    gains = [(0.5 / 128) / (np.sum(np.abs(ir[0])) / 128) / 2 +
+             (0.5 / 128) / (np.sum(np.abs(ir[1])) / 128) / 2 for ir in irs]
+    assert sofa.calc_gain_of_irs(irs) == pytest.approx(np.average(gains),
+                                                       rel=1e-12)
+
+    delays = [min(np.argmax(ir[0]), np.argmax(ir[1])) for ir in irs]
+    assert sofa.calc_delay_of_irs(irs) == np.average(delays)
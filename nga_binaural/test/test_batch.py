@@ -0,0 +1,44 @@
+import os.path
+import shutil
+import numpy.testing as npt
+from ear.fileio import openBw64
+from nga_binaural import batch, cmdline
+
+files_dir = os.path.join(os.path.dirname(__file__), "data")
+bwf_file = os.path.join(files_dir, "test-input.wav")
+
+
+def read(path):
+    with openBw64(path) as f:
+        return f.read(len(f))
+
+
+def test_batch(tmpdir, monkeypatch, make_driver):
+    monkeypatch.setattr(batch, "make_driver", make_driver)
+
+    in_dir = tmpdir.mkdir("in")
+    for name in ["a.wav", "b.wav"]:
+        shutil.copy(bwf_file, str(in_dir.join(name)))
+    in_dir.join("broken.wav").write("not a wav file")
+
+    out_dir = tmpdir.join("out")
+    args = batch.parse_command_line(
+        [str(in_dir.join("*.wav")), "-o",
+         str(out_dir), "-j", "2"])
+    results = batch.render_files_batch(args)
+
+    assert [os.path.basename(r["input_file"])
+            for r in results] == ["a.wav", "b.wav", "broken.wav"]
+    assert [r["status"] for r in results] == ["ok", "ok", "error"]
+    for result in results[:2]:
+        assert result["duration"] > 0
+        assert not result["overloaded"]
+        assert len(result["peak_db"]) == 2
+
+    # both workers produce the same output as a single-file render
+    reference = str(tmpdir.join("reference.wav"))
+    cmdline._run(make_driver(args), bwf_file, reference, False)
+    for name in ["a.wav", "b.wav"]:
+        npt.assert_array_equal(read(str(out_dir.join(name))), read(reference))
+
+    batch.print_summary(results)
@@ -0,0 +1,205 @@
+from fractions import Fraction
+import gc
+import threading
+import time
+import numpy as np
+import numpy.testing as npt
+import pytest
+from ear.core.metadata_input import (ADMPath, DirectSpeakersRenderingItem,
+                                     DirectSpeakersTypeMetadata,
+                                     DirectTrackSpec, HOARenderingItem,
+                                     HOATypeMetadata, MetadataSourceIter,
+                                     ObjectRenderingItem, ObjectTypeMetadata)
+from ear.fileio.adm.elements import (AudioBlockFormatDirectSpeakers,
+                                     AudioBlockFormatObjects,
+                                     AudioChannelFormat, BoundCoordinate,
+                                     DirectSpeakerPolarPosition, JumpPosition,
+                                     ObjectPolarPosition, TypeDefinition)
+from ear.core.objectbased.renderer import InterpretObjectMetadata
+from ear.core.renderer_common import BlockProcessingChannel
+from nga_binaural.binaural_wrapper import (PathExecutor,
+                                           _skip_processing_blocks, paths,
+                                           rendering_items_for_path)
+
+
+def object_item(distances, gain=0.5):
+    block_formats = [
+        AudioBlockFormatObjects(position=ObjectPolarPosition(
+            azimuth=30.0, elevation=0.0, distance=distance),
+                                gain=gain) for distance in distances
+    ]
+    channel_format = AudioChannelFormat(audioChannelFormatName="object",
+                                        type=TypeDefinition.Objects,
+                                        audioBlockFormats=block_formats)
+    return ObjectRenderingItem(
+        track_spec=DirectTrackSpec(0),
+        metadata_source=MetadataSourceIter([
+            ObjectTypeMetadata(block_format=block_format)
+            for block_format in block_formats
+        ]),
+        adm_path=ADMPath(audioChannelFormat=channel_format))
+
+
+def direct_speakers_item():
+    block_format = AudioBlockFormatDirectSpeakers(
+        position=DirectSpeakerPolarPosition(
+            bounded_azimuth=BoundCoordinate(0.0),
+            bounded_elevation=BoundCoordinate(0.0)))
+    return DirectSpeakersRenderingItem(
+        track_spec=DirectTrackSpec(1),
+        metadata_source=MetadataSourceIter(
+            [DirectSpeakersTypeMetadata(block_format=block_format)]))
+
+
+def hoa_item():
+    return HOARenderingItem(
+        track_specs=[DirectTrackSpec(i) for i in range(2, 6)],
+        metadata_source=MetadataSourceIter([
+            HOATypeMetadata(orders=[0, 1, 1, 1],
+                            degrees=[0, -1, 0, 1],
+                            normalization="SN3D")
+        ]))
+
+
+def read_blocks(metadata_source):
+    blocks = []
+    while True:
+        metadata = metadata_source.get_next_block()
+        if metadata is None:
+            return blocks
+        blocks.append(metadata.block_format)
+
+
+@pytest.mark.parametrize("path, gains", [
+    ("hrir", [0.5 * 0.1 / 0.3, 0.5 * 0.25 / 0.3, 0.5, 0.5]),
+    ("brir", [0.0, 0.5 * 0.05 / 0.8, 0.5 * 0.3 / 0.8, 0.5]),
+    ("dirir", [0.5 * (1 - 0.1 / 0.3), 0.5 * (1 - 0.25 / 0.3), 0.0, 0.0]),
+])
+def test_object_gains(path, gains):
+    distances = [0.1, 0.25, 0.5, 2.0]
+    item = object_item(distances)
+
+    [path_item] = rendering_items_for_path([item], path)
+    blocks = read_blocks(path_item.metadata_source)
+
+    assert [block.gain for block in blocks] == pytest.approx(gains)
+    assert [block.position.distance for block in blocks] == [1.0] * 4
+
+    # the original item is neither modified nor read from
+    original_blocks = read_blocks(item.metadata_source)
+    assert [block.gain for block in original_blocks] == [0.5] * 4
+    assert [block.position.distance
+            for block in original_blocks] == distances
+
+
+def test_items_for_path():
+    near, far = object_item([0.1]), object_item([2.0])
+    direct_speakers = direct_speakers_item()
+    items = [near, far, direct_speakers]
+
+    hrir_items = rendering_items_for_path(items, "hrir")
+    assert [item.track_spec for item in hrir_items
+            ] == [item.track_spec for item in items]
+    assert len(read_blocks(hrir_items[2].metadata_source)) == 1
+
+    # far objects are silent on the direct path, and only objects have one
+    assert [item.adm_path for item in rendering_items_for_path(items, "dirir")
+            ] == [near.adm_path]
+    assert [item.adm_path for item in rendering_items_for_path(items, "brir")
+            ] == [far.adm_path, None]
+
+    # each path can be read independently
+    assert len(read_blocks(rendering_items_for_path(items, "hrir")[2].
+                           metadata_source)) == 1
+
+
+def test_items_for_path_objects_and_hoa():
+    # objects are rendered on the direct path even if there are other items;
+    # before, the direct path was empty if there were any
+    near, hoa = object_item([0.25]), hoa_item()
+    items = [near, hoa]
+
+    for path in ["hrir", "brir"]:
+        assert [type(item) for item in rendering_items_for_path(items, path)
+                ] == [ObjectRenderingItem, HOARenderingItem]
+    [direct_item] = rendering_items_for_path(items, "dirir")
+    assert direct_item.adm_path == near.adm_path
+    assert [block.gain for block in read_blocks(direct_item.metadata_source)
+            ] == pytest.approx([0.5 * (1 - 0.25 / 0.3)])
+
+
+@pytest.mark.parametrize("threads", [1, 2, 3])
+def test_path_executor(threads):
+    executor = PathExecutor(threads)
+    assert executor.map(lambda path, x: path * x, paths,
+                        [1, 2, 3]) == ["brir", "hrirhrir", "dirirdirirdirir"]
+
+    def fail(path):
+        if path == "hrir":
+            raise ValueError(path)
+
+    with pytest.raises(ValueError, match="hrir"):
+        executor.map(fail, paths)
+
+
+def test_path_executor_close():
+    def n_threads():
+        return sum(thread.name.startswith("ThreadPoolExecutor")
+                   for thread in threading.enumerate())
+
+    start_threads = n_threads()
+
+    executor = PathExecutor(3)
+    executor.map(lambda path: time.sleep(0.01), paths)
+    assert n_threads() > start_threads
+    executor.close()
+    executor.close()
+    time.sleep(0.1)
+    assert n_threads() == start_threads
+
+    # threads are also stopped if close is not called
+    executor = PathExecutor(3)
+    executor.map(lambda path: time.sleep(0.01), paths)
+    del executor
+    gc.collect()
+    time.sleep(0.1)
+    assert n_threads() == start_threads
+
+
+@pytest.mark.parametrize("start_sample", [0, 100, 480, 1000, 2400, 4000])
+def test_skip_processing_blocks(start_sample):
+    # this uses the internals of the EAR BlockProcessingChannel, so check
+    # that skipping blocks gives the same output as processing them; the
+    # blocks have interpolation, so there are several per metadata block
+    def channel():
+        block_formats = [
+            AudioBlockFormatObjects(rtime=Fraction(rtime, 100),
+                                    duration=Fraction(1, 100),
+                                    position=ObjectPolarPosition(
+                                        azimuth=0.0,
+                                        elevation=0.0,
+                                        distance=1.0),
+                                    gain=gain,
+                                    jumpPosition=JumpPosition(
+                                        flag=True,
+                                        interpolationLength=Fraction(1, 200)))
+            for rtime, gain in [(0, 1.0), (1, 0.5), (2, 0.25), (3, 2.0)]
+        ]
+        return BlockProcessingChannel(
+            MetadataSourceIter([
+                ObjectTypeMetadata(block_format=block_format)
+                for block_format in block_formats
+            ]),
+            InterpretObjectMetadata(
+                lambda metadata: np.array([metadata.block_format.gain])))
+
+    sr, n = 48000, 4800
+    expected = np.zeros((n, 1))
+    channel().process(sr, 0, np.ones(n), expected)
+
+    skipped = channel()
+    _skip_processing_blocks(skipped, sr, start_sample)
+    output = np.zeros((n - start_sample, 1))
+    skipped.process(sr, start_sample, np.ones(n - start_sample), output)
+
+    npt.assert_allclose(output, expected[start_sample:])
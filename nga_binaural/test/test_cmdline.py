@@ -0,0 +1,64 @@
+import os.path
+import numpy as np
+import numpy.testing as npt
+from ear.fileio import openBw64
+from nga_binaural import cmdline
+from nga_binaural.head_tracking import HeadOrientationFile
+
+files_dir = os.path.join(os.path.dirname(__file__), "data")
+bwf_file = os.path.join(files_dir, "test-input.wav")
+
+
+def render(driver, output_file, peak_normalization):
+    # use several blocks in the normalization pass
+    driver.blocksize = 1000
+
+    cmdline._run(driver, bwf_file, output_file, peak_normalization)
+
+    with openBw64(output_file) as f:
+        return f.read(len(f)), f.bitdepth
+
+
+def test_peak_normalization(tmpdir, driver):
+    samples, bitdepth = render(driver, str(tmpdir.join("out.wav")), False)
+    normalized, _ = render(driver, str(tmpdir.join("out_normalized.wav")),
+                           True)
+
+    lsb = 1.0 / (2**(bitdepth - 1) - 1)
+    target = 10.0**(cmdline.peak_normalization_level_db / 20.0)
+
+    assert normalized.shape == samples.shape
+    assert abs(np.max(np.abs(normalized)) - target) <= lsb
+
+    gain = target / np.max(np.abs(samples))
+    npt.assert_allclose(normalized, samples * gain, atol=2 * lsb * gain)
+
+    # no temporary files left behind
+    assert sorted(os.listdir(str(tmpdir))) == ["out.wav", "out_normalized.wav"]
+
+
+def test_head_orientation_within_block(tmpdir, driver):
+    # the orientation changes at sample 4800, in the first 8192-sample block
+    assert driver.blocksize == 8192
+    orientation_file = str(tmpdir.join("orientations.txt"))
+    with open(orientation_file, "w") as f:
+        f.write("0.0 0 0 0\n0.1 60 0 0\n")
+
+    driver.config["binaural_output_opts"]["head_tracking"] = True
+    reference_file = str(tmpdir.join("reference.wav"))
+    cmdline._run(driver, bwf_file, reference_file, False)
+
+    driver.head_orientations = HeadOrientationFile(orientation_file)
+    output_file = str(tmpdir.join("output.wav"))
+    cmdline._run(driver, bwf_file, output_file, False)
+
+    with openBw64(reference_file) as f:
+        reference = f.read(len(f))
+    with openBw64(output_file) as f:
+        output = f.read(len(f))
+
+    # the head only turns from its time, not from the start of the block
+    change = 4800
+    assert np.max(np.abs(reference[change - 1000:change])) > 0
+    npt.assert_array_equal(output[:change], reference[:change])
+    assert np.max(np.abs(output[change:8192] - reference[change:8192])) > 1e-3
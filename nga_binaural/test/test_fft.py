@@ -0,0 +1,145 @@
+import os
+import pickle
+import tracemalloc
+import numpy as np
+import numpy.testing as npt
+import pytest
+from functools import partial
+from nga_binaural import fft
+from nga_binaural.convolver import OverlapSaveConvolver
+from nga_binaural.matrix_convolver import (MatrixBlockConvolver,
+                                           VectorizedBlockConvolver,
+                                           NonUniformBlockConvolver)
+
+from .test_matrix_convolver import (random_filter_matrix,
+                                    reference_convolution, run_convolver)
+
+
+def get_backend(name, **kwargs):
+    if name == "pyfftw":
+        pytest.importorskip("pyfftw")
+    return fft.fft_backends[name](**kwargs)
+
+
+@pytest.mark.parametrize("backend", sorted(fft.fft_backends))
+@pytest.mark.parametrize("convolver_cls", [
+    MatrixBlockConvolver,
+    VectorizedBlockConvolver,
+    partial(NonUniformBlockConvolver, max_block_size=256),
+])
+def test_convolvers_with_backend(backend, convolver_cls):
+    block_size, n_in, n_out = 64, 5, 2
+    filters = random_filter_matrix(n_in, n_out, [1, 64, 65, 600])
+    input_samples = np.random.RandomState(1).randn(block_size * 12, n_in)
+    # a silent channel, which the matrix convolver skips
+    input_samples[:, 2] = 0.0
+
+    convolver = convolver_cls(block_size,
+                              n_in,
+                              n_out,
+                              filters,
+                              fft=get_backend(backend))
+    # clones make their own plans
+    output = run_convolver(convolver.clone(), block_size, input_samples)
+
+    npt.assert_allclose(output,
+                        reference_convolution(input_samples, n_out, filters),
+                        atol=1e-10)
+
+
+@pytest.mark.parametrize("backend", sorted(fft.fft_backends))
+def test_overlap_save_with_backend(backend):
+    block_size, n_channels = 32, 3
+    filters = np.random.RandomState(2).randn(100, n_channels)
+    input_samples = np.random.RandomState(3).randn(block_size * 8, n_channels)
+
+    convolver = OverlapSaveConvolver(block_size,
+                                     n_channels,
+                                     filters,
+                                     fft=get_backend(backend))
+    output = run_convolver(convolver, block_size, input_samples)
+
+    npt.assert_allclose(
+        output,
+        reference_convolution(input_samples, n_channels,
+                              [(i, i, f) for i, f in enumerate(filters.T)]),
+        atol=1e-10)
+
+
+def test_pyfftw_does_not_allocate():
+    backend = get_backend("pyfftw")
+    block_size, n_in, n_out = 64, 5, 2
+    convolver = VectorizedBlockConvolver(block_size,
+                                         n_in,
+                                         n_out,
+                                         random_filter_matrix(
+                                             n_in, n_out, [1000]),
+                                         fft=backend)
+    input_samples = np.random.RandomState(4).randn(block_size, n_in)
+    out = np.zeros((block_size, n_out))
+
+    for i in range(20):
+        convolver.filter_block(input_samples, out=out)
+
+    # only memory allocated while filtering is traced
+    tracemalloc.start()
+    try:
+        for i in range(100):
+            convolver.filter_block(input_samples, out=out)
+
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    # much less than one FFT result
+    assert peak < n_in * (block_size + 1) * 16
+
+
+def test_pyfftw_wisdom(tmpdir):
+    get_backend("pyfftw")
+    wisdom_file = str(tmpdir.join("fftw_wisdom.npz"))
+
+    backend = fft.FFTWFFT(wisdom_file=wisdom_file)
+    input_array = np.ones((3, 256))
+    output_array = np.zeros((3, 129), dtype=complex)
+    plan = backend.plan_rfft(input_array, output_array, axis=1)
+
+    # planning must not change the arrays
+    npt.assert_array_equal(input_array, 1.0)
+    plan()
+    npt.assert_allclose(output_array, np.fft.rfft(input_array, axis=1))
+
+    assert os.path.exists(wisdom_file)
+    # loaded by new backends
+    fft.FFTWFFT(wisdom_file=wisdom_file)
+
+
+def test_wisdom_file(tmpdir):
+    wisdom = (b"double wisdom", b"", b"long double wisdom")
+    wisdom_file = str(tmpdir.join("fftw_wisdom.npz"))
+    with open(wisdom_file, "wb") as f:
+        fft.save_wisdom(f, wisdom)
+    assert fft.load_wisdom(wisdom_file) == wisdom
+
+    # other files, including pickles, are not loaded
+    invalid_file = str(tmpdir.join("invalid.npz"))
+    with open(invalid_file, "wb") as f:
+        pickle.dump(wisdom, f)
+    with pytest.warns(UserWarning, match="invalid FFTW wisdom"):
+        assert fft.load_wisdom(invalid_file) is None
+
+    np.savez(invalid_file, double=np.zeros(3), single=np.zeros(0, np.uint8))
+    with pytest.warns(UserWarning, match="invalid FFTW wisdom"):
+        assert fft.load_wisdom(invalid_file) is None
+
+
+def test_fallback_to_numpy(monkeypatch):
+    class Unavailable(object):
+        def __init__(self, threads):
+            raise ImportError()
+
+    monkeypatch.setitem(fft.fft_backends, "scipy", Unavailable)
+    monkeypatch.setattr(fft, "_backends", {})
+
+    with pytest.warns(UserWarning, match="not available"):
+        assert fft.get_fft_backend("scipy") is fft.numpy_fft
@@ -0,0 +1,88 @@
+import numpy as np
+import numpy.testing as npt
+from nga_binaural import sofa
+from nga_binaural.matrix_convolver import DelayGainConvolver
+from nga_binaural.filter_bank import (HRIRGrid, _resample_irs,
+                                      get_filter_bank, load_hrirs)
+from nga_binaural.filter_cache import FilterCache
+
+
+def get_test_filter_bank(sofa_file, block_size=512):
+    layout = sofa.get_binaural_layout(("binaural", "BRIR"))
+    dirir_layout = sofa.get_binaural_layout(("binaural", "binaural_direct"))
+    return get_filter_bank(layout, layout, dirir_layout, 48000, block_size,
+                           "vectorized", 8192, sofa_file, sofa_file)
+
+
+def test_filter_bank_shared(sofa_file):
+    filter_bank = get_test_filter_bank(sofa_file)
+    assert get_test_filter_bank(sofa_file) is filter_bank
+    assert get_test_filter_bank(sofa_file, 256) is not filter_bank
+
+    hrir_a, brir_a, dirir_a = filter_bank.convolvers()
+    hrir_b, brir_b, dirir_b = filter_bank.convolvers()
+    assert hrir_a is not hrir_b
+    assert hrir_a.filters_fd is hrir_b.filters_fd
+    assert hrir_a.delay_line_fd is not hrir_b.delay_line_fd
+
+
+def test_direct_path_uses_delay_gain(sofa_file):
+    filter_bank = get_test_filter_bank(sofa_file)
+    assert isinstance(filter_bank.convolver_dirir, DelayGainConvolver)
+    assert len(filter_bank.convolver_dirir.delays) == 1
+
+
+def test_hrir_grid_matches_layout_hrirs(sofa_file):
+    layout = sofa.get_binaural_layout(("bs2051", "4+5+0"))
+    hrirs = load_hrirs(sofa_file, layout, 48000)
+    grid = HRIRGrid(sofa_file, layout, 48000, chunk_size=8)
+
+    sofa_file_hrir = sofa.SOFAFileHRIR(sofa.load_hdf5(sofa_file))
+    assert len(grid.positions) == grid.shape[0] == sofa_file_hrir.M
+    idxes = sofa_file_hrir.select_sources(layout.positions, True)
+    npt.assert_allclose(grid[idxes], hrirs, atol=1e-12)
+    assert grid[[[0, 1, 2], [3, 4, 5]]].shape == (2, 3, 2, hrirs.shape[2])
+
+
+def test_hrir_grid_reads_used_chunks(tmpdir, sofa_file):
+    layout = sofa.get_binaural_layout(("bs2051", "0+5+0"))
+    cache = FilterCache(str(tmpdir), 1 << 30)
+    grid = HRIRGrid(sofa_file, layout, 48000, cache=cache, chunk_size=8)
+    bytes_read = grid.sofa_file.bytes_read
+
+    hrirs = grid[[3, 10]]
+    ir_size = grid.sofa_file.N * grid.sofa_file.R * 8
+    assert grid.sofa_file.bytes_read - bytes_read == 16 * ir_size
+    assert len(cache.entries()) == 2
+
+    # the chunks are loaded from the cache by another grid
+    other = HRIRGrid(sofa_file, layout, 48000, cache=cache, chunk_size=8)
+    bytes_read = other.sofa_file.bytes_read
+    npt.assert_array_equal(other[np.array([10, 3])], hrirs[::-1])
+    assert other.sofa_file.bytes_read == bytes_read
+
+
+def test_resample_irs():
+    # sinusoids with a whole number of periods, which are resampled exactly;
+    # each IR and ear has a different frequency and phase
+    t_48k = np.arange(480) / 48000.0
+    t_44k = np.arange(441) / 44100.0
+    freqs = 1000.0 * np.arange(1, 7).reshape(3, 2, 1)
+    phases = np.arange(6).reshape(3, 2, 1)
+    irs = np.sin(2 * np.pi * freqs * t_48k + phases)
+
+    resampled = _resample_irs(irs, 48000, 44100)
+    assert resampled.shape == (3, 2, 441)
+    npt.assert_allclose(resampled,
+                        np.sin(2 * np.pi * freqs * t_44k + phases),
+                        atol=1e-10)
+
+    assert _resample_irs(irs, 48000, 48000) is irs
+
+
+def test_hrirs_resampled(sofa_file):
+    layout = sofa.get_binaural_layout(("bs2051", "0+5+0"))
+    hrirs = load_hrirs(sofa_file, layout, 48000)
+    hrirs_44k = load_hrirs(sofa_file, layout, 44100)
+    assert hrirs_44k.shape == (len(layout.channels), 2,
+                               int(hrirs.shape[2] * 44100 / 48000))
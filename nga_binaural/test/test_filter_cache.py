@@ -0,0 +1,78 @@
+import os
+import numpy as np
+import numpy.testing as npt
+from nga_binaural import sofa
+from nga_binaural.filter_bank import FilterBank
+from nga_binaural.filter_cache import FilterCache
+
+sofa_file = "resource:data/BRIR_KU100_60ms.sofa"
+
+
+def test_store_load(tmpdir):
+    cache = FilterCache(str(tmpdir.join("cache")), 2**20)
+    key = cache.key(a=1, b=[1, 2])
+    assert key == cache.key(b=[1, 2], a=1)
+    assert key != cache.key(a=2, b=[1, 2])
+
+    assert cache.load(key) is None
+
+    arrays = dict(x=np.arange(10.0), y=np.ones((2, 3), dtype=complex))
+    cache.store(key, arrays)
+    loaded = cache.load(key)
+    assert sorted(loaded) == ["x", "y"]
+    for name in arrays:
+        npt.assert_array_equal(loaded[name], arrays[name])
+        assert not loaded[name].flags.writeable
+
+    # storing the same entry twice is harmless
+    cache.store(key, arrays)
+
+    cache.clear()
+    assert cache.load(key) is None
+
+
+def test_evict_least_recently_used(tmpdir):
+    array = np.zeros(1000)
+    entry_size = len(array) * 8 + 128
+    cache = FilterCache(str(tmpdir), 2**20)
+
+    keys = [cache.key(i=i) for i in range(3)]
+    for i, key in enumerate(keys):
+        cache.store(key, dict(x=array))
+        # make sure last use times are distinct
+        os.utime(os.path.join(str(tmpdir), key), (i, i))
+
+    assert cache.load(keys[0]) is not None  # now most recently used
+
+    cache.max_size = int(2.5 * entry_size)
+    cache.evict()
+
+    assert cache.load(keys[1]) is None
+    assert cache.load(keys[0]) is not None
+    assert cache.load(keys[2]) is not None
+
+
+def test_filter_bank_uses_cache(tmpdir):
+    layout = sofa.get_binaural_layout(("binaural", "BRIR"))
+    dirir_layout = sofa.get_binaural_layout(("binaural", "binaural_direct"))
+
+    def make_filter_bank():
+        return FilterBank(layout,
+                          layout,
+                          dirir_layout,
+                          48000,
+                          512,
+                          "vectorized",
+                          8192,
+                          sofa_file,
+                          sofa_file,
+                          filter_cache_dir=str(tmpdir),
+                          filter_cache_max_size=2**30)
+
+    cold = make_filter_bank()
+    assert len(FilterCache(str(tmpdir), 0).entries()) == 1
+
+    warm = make_filter_bank()
+    assert isinstance(warm.convolver_brir.filters_fd, np.memmap)
+    npt.assert_array_equal(warm.convolver_brir.filters_fd,
+                           cold.convolver_brir.filters_fd)
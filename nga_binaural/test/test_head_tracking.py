@@ -0,0 +1,275 @@
+import numpy as np
+import numpy.testing as npt
+import pytest
+from ear.common import cart
+from ear.core import bs2051, hoa, point_source
+from ear.core.direct_speakers.renderer import DirectSpeakersRenderer
+from ear.core.objectbased.renderer import ObjectRenderer
+from ear.core.metadata_input import (DirectSpeakersRenderingItem,
+                                     DirectSpeakersTypeMetadata,
+                                     DirectTrackSpec, HOARenderingItem,
+                                     HOATypeMetadata, MetadataSourceIter,
+                                     ObjectRenderingItem, ObjectTypeMetadata)
+from ear.fileio.adm.elements import (AudioBlockFormatDirectSpeakers,
+                                     AudioBlockFormatObjects, BoundCoordinate,
+                                     DirectSpeakerPolarPosition,
+                                     ObjectPolarPosition)
+from nga_binaural.head_tracking import (HeadOrientation, HeadOrientationFile,
+                                        HeadTracker, hoa_rotation_matrix,
+                                        rotate_direction, rotation_matrix,
+                                        track_renderer)
+from nga_binaural.renderer import BinauralStreamRenderer
+
+
+def test_rotation_matrix():
+    # turning left moves the front to the left
+    npt.assert_allclose(rotation_matrix(90, 0, 0).dot([0, 1, 0]), [-1, 0, 0],
+                        atol=1e-15)
+    # tilting up moves the front up
+    npt.assert_allclose(rotation_matrix(0, 90, 0).dot([0, 1, 0]), [0, 0, 1],
+                        atol=1e-15)
+    # rolling right moves the top to the right
+    npt.assert_allclose(rotation_matrix(0, 0, 90).dot([0, 0, 1]), [1, 0, 0],
+                        atol=1e-15)
+
+    # a source at the azimuth that the head is turned to is in front
+    npt.assert_allclose(
+        HeadOrientation(30, 0, 0).rotate(cart(30, 0, 1)), cart(0, 0, 1),
+        atol=1e-15)
+    assert HeadOrientation().matrix is None
+
+
+@pytest.mark.parametrize("normalization", ["N3D", "SN3D", "FuMa"])
+def test_hoa_rotation_matrix(normalization):
+    order = 1 if normalization == "FuMa" else 3
+    orders, degrees = np.array([(n, m) for n in range(order + 1)
+                                for m in range(-n, n + 1)]).T
+    norm = hoa.norm_functions[normalization]
+
+    def encode(position):
+        az, el = np.radians(position[:2])
+        return hoa.sph_harm(orders, degrees, az, el, norm)
+
+    orientation = HeadOrientation(40, -20, 10)
+    matrix = hoa_rotation_matrix(list(orders), list(degrees), normalization,
+                                 orientation)
+
+    for position in [(0, 0), (30, 10), (-120, 45), (170, -60)]:
+        rotated = orientation.rotate(cart(position[0], position[1], 1))
+        npt.assert_allclose(matrix.dot(encode(position)),
+                            encode(
+                                (np.degrees(-np.arctan2(rotated[0],
+                                                        rotated[1])),
+                                 np.degrees(np.arcsin(rotated[2])))),
+                            atol=1e-10)
+
+
+def test_head_orientation_file(tmpdir):
+    path = str(tmpdir.join("orientations.txt"))
+    with open(path, "w") as f:
+        f.write("# time yaw pitch roll\n"
+                "0.5, 10, 0, 0\n"
+                "\n"
+                "1.0 20 5 -5\n")
+
+    orientations = HeadOrientationFile(path)
+    assert orientations.at(0.0) == (10.0, 0.0, 0.0)
+    assert orientations.at(0.75) == (10.0, 0.0, 0.0)
+    assert orientations.at(1.0) == (20.0, 5.0, -5.0)
+    assert orientations.at(100.0) == (20.0, 5.0, -5.0)
+
+    # 0.5 s is sample 24000 at 48 kHz
+    assert orientations.changes(48000, 0, 24000) == [(0, (10.0, 0.0, 0.0))]
+    assert orientations.changes(48000, 20000, 48001) == [
+        (20000, (10.0, 0.0, 0.0)),
+        (48000, (20.0, 5.0, -5.0)),
+    ]
+    assert orientations.changes(48000, 48000, 50000) == [
+        (48000, (20.0, 5.0, -5.0)),
+    ]
+
+
+def test_head_orientation_file_same_sample(tmpdir):
+    path = str(tmpdir.join("orientations.txt"))
+    with open(path, "w") as f:
+        f.write("0.0 0 0 0\n0.1 10 0 0\n0.1 20 0 0\n")
+
+    # the last orientation at a time is used
+    assert HeadOrientationFile(path).changes(48000, 0, 8192) == [
+        (0, (0.0, 0.0, 0.0)),
+        (4800, (20.0, 0.0, 0.0)),
+    ]
+
+
+def direct_speakers_item(azimuth, label):
+    block_format = AudioBlockFormatDirectSpeakers(
+        position=DirectSpeakerPolarPosition(
+            bounded_azimuth=BoundCoordinate(azimuth),
+            bounded_elevation=BoundCoordinate(0.0)),
+        speakerLabel=[label])
+    return DirectSpeakersRenderingItem(
+        track_spec=DirectTrackSpec(0),
+        metadata_source=MetadataSourceIter(
+            [DirectSpeakersTypeMetadata(block_format=block_format)]))
+
+
+def test_crossfade():
+    layout = bs2051.get_layout("4+5+0")
+    tracker = HeadTracker()
+    renderer = DirectSpeakersRenderer(layout)
+    renderer.set_rendering_items([direct_speakers_item(0.0, "M+000")])
+    track_renderer(renderer, tracker, layout,
+                   point_source.configure(layout.without_lfe))
+
+    n = 16
+    samples = np.ones((n, 1))
+    front = layout.channel_names.index("M+000")
+    right = layout.channel_names.index("M-030")
+
+    # turning to the left moves the source to the right
+    tracker.set_orientation(30, 0, 0)
+    tracker.next_block()
+    # the first block uses the orientation set before it, without fading
+    output = renderer.render(48000, 0, samples)
+    npt.assert_allclose(output[:, right], 1.0)
+    npt.assert_allclose(np.delete(output, right, axis=1), 0.0, atol=1e-10)
+
+    tracker.set_orientation(0, 0, 0)
+    tracker.next_block()
+    output = renderer.render(48000, n, samples)
+    ramp = (np.arange(n) + 1.0) / n
+    npt.assert_allclose(output[:, front], ramp, atol=1e-10)
+    npt.assert_allclose(output[:, right], 1.0 - ramp, atol=1e-10)
+
+    tracker.next_block()
+    output = renderer.render(48000, 2 * n, samples)
+    npt.assert_allclose(output[:, front], 1.0)
+
+
+def test_min_interval():
+    tracker = HeadTracker(min_interval=3)
+    tracker.set_orientation(10, 0, 0)
+    tracker.next_block()
+    assert tracker.orientation.yaw == 10
+
+    # the first change is used at once
+    tracker.set_orientation(20, 0, 0)
+    tracker.next_block()
+    assert tracker.orientation.yaw == 20
+    assert tracker.previous_orientation.yaw == 10
+
+    # later changes wait until 3 blocks have passed, and the last one is used
+    tracker.set_orientation(30, 0, 0)
+    tracker.next_block()
+    tracker.set_orientation(40, 0, 0)
+    tracker.next_block()
+    assert tracker.orientation.yaw == 20
+    assert tracker.fades(4) == [(tracker.orientation, None)]
+    tracker.next_block()
+    assert tracker.orientation.yaw == 40
+    assert tracker.previous_orientation.yaw == 20
+
+
+def render_stream(binaural_output_opts,
+                  items,
+                  orientation=None,
+                  head_tracking=True,
+                  gains=[1.0]):
+    """Render noise with BinauralStreamRenderer; the input has one track for
+    each of gains, containing the same signal multiplied by the gain."""
+    renderer = BinauralStreamRenderer(
+        None,
+        48000,
+        block_size=512,
+        binaural_output_opts=dict(binaural_output_opts,
+                                  head_tracking=head_tracking))
+    renderer.set_rendering_items(items)
+    if orientation is not None:
+        renderer.set_head_orientation(*orientation)
+
+    samples = np.random.RandomState(0).randn(512 * 8, 1) * gains
+    return np.concatenate([
+        renderer.process(samples[start:start + 512]).copy()
+        for start in range(0, len(samples), 512)
+    ])
+
+
+def object_item(azimuth, elevation):
+    return ObjectRenderingItem(
+        track_spec=DirectTrackSpec(0),
+        metadata_source=MetadataSourceIter([
+            ObjectTypeMetadata(block_format=AudioBlockFormatObjects(
+                position=ObjectPolarPosition(azimuth, elevation, 1.0)))
+        ]))
+
+
+def test_rotated_object_gains():
+    # point sources are panned directly rather than through ObjectRenderer,
+    # which must give the same result
+    layout = bs2051.get_layout("4+5+0")
+    orientation = (40, -20, 10)
+    tracker = HeadTracker()
+    tracker.set_orientation(*orientation)
+    tracker.next_block()
+
+    tracked = ObjectRenderer(layout)
+    tracked.set_rendering_items([object_item(30.0, 10.0)])
+    track_renderer(tracked, tracker, layout,
+                   point_source.configure(layout.without_lfe))
+
+    reference = ObjectRenderer(layout)
+    reference.set_rendering_items([
+        object_item(*rotate_direction(HeadOrientation(*orientation), 30.0,
+                                      10.0))
+    ])
+
+    samples = np.random.RandomState(0).randn(512, 1)
+    npt.assert_allclose(tracked.render(48000, 0, samples),
+                        reference.render(48000, 0, samples),
+                        atol=1e-10)
+
+
+def hoa_item(order):
+    orders, degrees = zip(*[(n, m) for n in range(order + 1)
+                            for m in range(-n, n + 1)])
+    return HOARenderingItem(
+        track_specs=[DirectTrackSpec(i) for i in range(len(orders))],
+        metadata_source=MetadataSourceIter([
+            HOATypeMetadata(orders=list(orders),
+                            degrees=list(degrees),
+                            normalization="N3D")
+        ]))
+
+
+def hoa_gains(order, azimuth, elevation):
+    """N3D gains to encode a plane wave from one direction."""
+    orders, degrees = np.array([(n, m) for n in range(order + 1)
+                                for m in range(-n, n + 1)]).T
+    return hoa.sph_harm(orders, degrees, np.radians(azimuth),
+                        np.radians(elevation), hoa.norm_N3D)
+
+
+def test_no_rotation(binaural_output_opts):
+    items = [object_item(30.0, 10.0), direct_speakers_item(-30.0, "M-030")]
+    npt.assert_array_equal(
+        render_stream(binaural_output_opts, items, (0, 0, 0)),
+        render_stream(binaural_output_opts, items, head_tracking=False))
+
+
+def test_rotated_object(binaural_output_opts):
+    npt.assert_allclose(render_stream(binaural_output_opts,
+                                      [object_item(50.0, 0.0)], (20, 0, 0)),
+                        render_stream(binaural_output_opts,
+                                      [object_item(30.0, 0.0)],
+                                      head_tracking=False),
+                        atol=1e-10)
+
+
+def test_rotated_hoa(binaural_output_opts):
+    npt.assert_allclose(render_stream(binaural_output_opts, [hoa_item(2)],
+                                      (20, 0, 0),
+                                      gains=hoa_gains(2, 50.0, 0.0)),
+                        render_stream(binaural_output_opts, [hoa_item(2)],
+                                      head_tracking=False,
+                                      gains=hoa_gains(2, 30.0, 0.0)),
+                        atol=1e-10)
@@ -0,0 +1,266 @@
+import tracemalloc
+import numpy as np
+import numpy.testing as npt
+import pytest
+from functools import partial
+from nga_binaural.filter_bank import direct_irs, filter_matrix
+from nga_binaural.matrix_convolver import (MatrixBlockConvolver,
+                                           VectorizedBlockConvolver,
+                                           NonUniformBlockConvolver,
+                                           DelayGainConvolver, SilenceBypass,
+                                           sparse_taps)
+
+
+def random_filter_matrix(n_in, n_out, lengths, seed=0):
+    rng = np.random.RandomState(seed)
+    return [(in_ch, out_ch, rng.randn(length))
+            for in_ch in range(n_in) for out_ch, length in zip(
+                range(n_out), rng.choice(lengths, n_out))]
+
+
+def reference_convolution(input_samples, n_out, filters):
+    output = np.zeros((len(input_samples), n_out))
+    for in_ch, out_ch, f in filters:
+        output[:, out_ch] += np.convolve(input_samples[:, in_ch],
+                                         f)[:len(input_samples)]
+    return output
+
+
+def run_convolver(convolver, block_size, input_samples):
+    return np.concatenate([
+        convolver.filter_block(input_samples[start:start + block_size])
+        for start in range(0, len(input_samples), block_size)
+    ])
+
+
+@pytest.mark.parametrize("convolver_cls", [
+    MatrixBlockConvolver,
+    VectorizedBlockConvolver,
+    NonUniformBlockConvolver,
+    partial(NonUniformBlockConvolver, max_block_size=256),
+    partial(NonUniformBlockConvolver, partitions_per_segment=1),
+])
+def test_convolver_matches_direct_convolution(convolver_cls):
+    block_size, n_in, n_out = 64, 5, 2
+    filters = random_filter_matrix(n_in, n_out, [1, 30, 64, 65, 300])
+    input_samples = np.random.RandomState(1).randn(block_size * 12, n_in)
+
+    convolver = convolver_cls(block_size, n_in, n_out, filters)
+    output = run_convolver(convolver, block_size, input_samples)
+
+    npt.assert_allclose(output,
+                        reference_convolution(input_samples, n_out, filters),
+                        atol=1e-10)
+
+
+@pytest.mark.parametrize("convolver_cls", [
+    MatrixBlockConvolver,
+    VectorizedBlockConvolver,
+    partial(NonUniformBlockConvolver, max_block_size=256),
+])
+def test_float32(convolver_cls):
+    block_size, n_in, n_out = 64, 5, 2
+    filters = random_filter_matrix(n_in, n_out, [1, 64, 65, 600])
+    input_samples = np.random.RandomState(1).randn(block_size * 12, n_in)
+
+    convolver = convolver_cls(block_size,
+                              n_in,
+                              n_out,
+                              filters,
+                              dtype=np.float32)
+    output = run_convolver(convolver,
+                           block_size,
+                           input_samples.astype(np.float32))
+
+    assert output.dtype == np.float32
+    reference = reference_convolution(input_samples, n_out, filters)
+    npt.assert_allclose(output,
+                        reference,
+                        atol=1e-5 * np.max(np.abs(reference)))
+
+
+def test_vectorized_matches_matrix():
+    block_size, n_in, n_out = 32, 7, 2
+    filters = random_filter_matrix(n_in, n_out, [10, 100])
+    # repeated (in, out) pairs are summed
+    filters.append((0, 1, np.ones(5)))
+    input_samples = np.random.RandomState(2).randn(block_size * 20, n_in)
+
+    output_matrix = run_convolver(
+        MatrixBlockConvolver(block_size, n_in, n_out, filters), block_size,
+        input_samples)
+    output_vectorized = run_convolver(
+        VectorizedBlockConvolver(block_size, n_in, n_out, filters),
+        block_size, input_samples)
+
+    npt.assert_allclose(output_vectorized, output_matrix, atol=1e-10)
+
+
+def test_nonuniform_segments():
+    block_size = 64
+    filters = [(0, 0, np.ones(2000))]
+    convolver = NonUniformBlockConvolver(block_size,
+                                         1,
+                                         1,
+                                         filters,
+                                         max_block_size=512)
+
+    assert [seg.block_size for seg in convolver.segments] == [64, 128, 256, 512]
+    for seg in convolver.segments:
+        # segments must not need output before their input is complete
+        assert seg.offset >= 0
+
+
+@pytest.mark.parametrize("convolver_cls", [
+    MatrixBlockConvolver,
+    VectorizedBlockConvolver,
+    partial(NonUniformBlockConvolver, max_block_size=256),
+])
+def test_clone_has_independent_state(convolver_cls):
+    block_size, n_in, n_out = 64, 3, 2
+    filters = random_filter_matrix(n_in, n_out, [50, 500])
+    input_samples = np.random.RandomState(3).randn(block_size * 10, n_in)
+
+    convolver = convolver_cls(block_size, n_in, n_out, filters)
+    # run some samples through the original, which must not affect the clone
+    run_convolver(convolver, block_size, input_samples[::-1])
+    clone = convolver.clone()
+
+    output = run_convolver(clone, block_size, input_samples)
+    npt.assert_allclose(output,
+                        reference_convolution(input_samples, n_out, filters),
+                        atol=1e-10)
+
+
+def test_clone_shares_filters():
+    convolver = VectorizedBlockConvolver(64, 3, 2,
+                                         random_filter_matrix(3, 2, [100]))
+    clone = convolver.clone()
+    assert clone.filters_fd is convolver.filters_fd
+    assert not clone.filters_fd.flags.writeable
+
+
+def test_sparse_taps():
+    f = np.zeros(10)
+    f[[2, 7]] = [0.5, -1.0]
+    assert sparse_taps([(0, 1, f)]) == [(0, 1, 2, 0.5), (0, 1, 7, -1.0)]
+    assert sparse_taps([(0, 1, f)], max_taps=1) is None
+    assert sparse_taps([(0, 0, np.ones(10))]) is None
+
+
+@pytest.mark.parametrize("block_size", [1, 16, 64])
+def test_delay_gain_convolver(block_size):
+    n_in, n_out = 3, 2
+    rng = np.random.RandomState(5)
+    filters = []
+    for in_ch in range(n_in):
+        for out_ch in range(n_out):
+            f = np.zeros(200)
+            delays = rng.choice(200, 2, replace=False)
+            f[delays] = rng.randn(2)
+            filters.append((in_ch, out_ch, f))
+    # a delay of exactly one block, and an impulse with no delay
+    filters.append((0, 0, np.eye(1, block_size + 1, block_size)[0]))
+    filters.append((2, 1, np.array([0.3])))
+    input_samples = rng.randn(block_size * 20, n_in)
+
+    convolver = DelayGainConvolver(block_size, n_in, n_out,
+                                   sparse_taps(filters))
+    output = run_convolver(convolver.clone(), block_size, input_samples)
+
+    npt.assert_allclose(output,
+                        reference_convolution(input_samples, n_out, filters),
+                        atol=1e-10)
+    assert convolver.clone().gains is convolver.gains
+
+
+def test_delay_gain_matches_direct_path():
+    block_size = 64
+    filters = filter_matrix(direct_irs(100))
+    input_samples = np.random.RandomState(6).randn(block_size * 10, 2)
+
+    npt.assert_allclose(
+        run_convolver(
+            DelayGainConvolver(block_size, 2, 2, sparse_taps(filters)),
+            block_size, input_samples),
+        run_convolver(MatrixBlockConvolver(block_size, 2, 2, filters),
+                      block_size, input_samples),
+        atol=1e-10)
+
+
+@pytest.mark.parametrize("convolver_cls", [
+    MatrixBlockConvolver,
+    VectorizedBlockConvolver,
+    NonUniformBlockConvolver,
+    partial(NonUniformBlockConvolver, max_block_size=256),
+    lambda block_size, n_in, n_out, filters: DelayGainConvolver(
+        block_size, n_in, n_out, sparse_taps(filters)),
+])
+def test_silence_bypass(convolver_cls):
+    block_size, n_in, n_out = 32, 3, 2
+    filters = random_filter_matrix(n_in, n_out, [1, 50, 700])
+    if convolver_cls is not MatrixBlockConvolver:
+        # impulses, so that the same filters work with DelayGainConvolver
+        filters = [(in_ch, out_ch, np.eye(1, len(f), len(f) - 1)[0])
+                   for in_ch, out_ch, f in filters]
+    # bursts separated by silences which are shorter and longer than the
+    # filters
+    rng = np.random.RandomState(7)
+    input_samples = np.zeros((block_size * 200, n_in))
+    for start, length in [(0, 10), (30, 3), (90, 1), (92, 20)]:
+        input_samples[start * block_size:(start + length) *
+                      block_size] = rng.randn(length * block_size, n_in)
+
+    bypass = SilenceBypass(convolver_cls(block_size, n_in, n_out,
+                                         filters)).clone()
+    output = run_convolver(bypass, block_size, input_samples)
+
+    npt.assert_allclose(output,
+                        reference_convolution(input_samples, n_out, filters),
+                        atol=1e-10)
+    assert bypass.skipped_blocks > 0
+    assert bypass.skipped_blocks + bypass.processed_blocks == 200
+
+
+@pytest.mark.parametrize("convolver_cls", [
+    MatrixBlockConvolver,
+    VectorizedBlockConvolver,
+    partial(NonUniformBlockConvolver, max_block_size=256),
+    lambda block_size, n_in, n_out, filters: DelayGainConvolver(
+        block_size, n_in, n_out,
+        [(in_ch, out_ch, len(f) - 1, 1.0) for in_ch, out_ch, f in filters]),
+])
+def test_no_allocation_in_steady_state(convolver_cls):
+    block_size, n_in, n_out = 64, 5, 2
+    filters = random_filter_matrix(n_in, n_out, [50, 1000])
+    input_samples = np.random.RandomState(4).randn(block_size, n_in)
+    out = np.zeros((block_size, n_out))
+
+    convolver = convolver_cls(block_size, n_in, n_out, filters)
+
+    for i in range(20):
+        convolver.filter_block(input_samples, out=out)
+
+    # only memory allocated while filtering is traced
+    tracemalloc.start()
+    try:
+        for i in range(100):
+            assert convolver.filter_block(input_samples, out=out) is out
+
+        peak = tracemalloc.get_traced_memory()[1]
+        snapshot = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+
+    # memory use does not grow with the number of blocks; allow for the odd
+    # object kept alive by numpy or the interpreter
+    files = [tracemalloc.Filter(True, "*nga_binaural/matrix_convolver.py")]
+    growth = sum(stat.size
+                 for stat in snapshot.filter_traces(files).statistics(
+                     "filename"))
+    assert growth < out.nbytes
+
+    # the only temporaries are the results of the FFTs, which are at most 256
+    # samples long for the nonuniform convolver
+    fft_size = (n_in + n_out) * (256 + 1) * 16 * 2
+    assert peak < 2 * fft_size
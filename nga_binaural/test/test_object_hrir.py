@@ -0,0 +1,187 @@
+import numpy as np
+import numpy.testing as npt
+import pytest
+from ear.core.metadata_input import (DirectTrackSpec, MetadataSourceIter,
+                                     ObjectRenderingItem, ObjectTypeMetadata)
+from ear.fileio.adm.elements import (AudioBlockFormatObjects,
+                                     ObjectPolarPosition)
+from ear.core.metadata_processing import (convert_objects_to_cartesian,
+                                          convert_objects_to_polar)
+from fractions import Fraction
+from nga_binaural import fft, sofa
+from nga_binaural.binaural_wrapper import BinauralConvolver
+from nga_binaural.matrix_convolver import VectorizedBlockConvolver
+from nga_binaural.object_hrir import CrossfadingConvolver, HRIRSet
+from nga_binaural.renderer import BinauralRenderer, BinauralStreamRenderer
+
+from .test_fft import get_backend
+
+def test_hrir_set():
+    positions = np.array([[0, 1, 0], [1, 0, 0], [0, 0, 1], [-1, 0, 0]])
+    hrirs = np.random.RandomState(0).randn(4, 2, 16)
+    hrir_set = HRIRSet(positions * 2.0, hrirs)
+
+    idxes, weights = hrir_set.weights(positions[:2])
+    npt.assert_allclose(hrir_set.interpolate(idxes, weights), hrirs[:2])
+
+    # between the first two, which have equal weights
+    idxes, weights = hrir_set.weights([[1, 1, 0]])
+    assert set(idxes[0, :2]) == {0, 1}
+    npt.assert_allclose(weights[0, 0], weights[0, 1])
+    npt.assert_allclose(hrir_set.interpolate(idxes, weights),
+                        [np.tensordot(weights[0], hrirs[idxes[0]], axes=1)])
+
+
+@pytest.mark.parametrize("backend", sorted(fft.fft_backends))
+def test_crossfading_convolver(backend):
+    block_size, n_in, n_blocks = 16, 3, 8
+    random = np.random.RandomState(0)
+    filters_a = random.randn(n_in, 2, 40)
+    filters_b = random.randn(n_in, 2, 40)
+    samples = random.randn(n_blocks * block_size, n_in)
+
+    def reference(filters):
+        convolver = VectorizedBlockConvolver(
+            block_size, n_in, 2, [(i, ear, filters[i, ear])
+                                  for i in range(n_in) for ear in range(2)])
+        return np.concatenate([
+            convolver.filter_block(samples[start:start + block_size])
+            for start in range(0, len(samples), block_size)
+        ])
+
+    output_a, output_b = reference(filters_a), reference(filters_b)
+
+    # the filters of channel 1 change before block 4; the other channels
+    # use filters_b throughout
+    convolver = CrossfadingConvolver(block_size,
+                                     n_in,
+                                     40,
+                                     fft=get_backend(backend))
+    convolver.set_filters([0, 1, 2], np.stack(
+        [filters_b[0], filters_a[1], filters_b[2]]))
+    filters_a[[0, 2]] = filters_b[[0, 2]]
+    output_a = reference(filters_a)
+
+    output = []
+    for block in range(n_blocks):
+        if block == 4:
+            convolver.set_filters([1], filters_b[1:2])
+        start = block * block_size
+        output.append(
+            convolver.filter_block(samples[start:start + block_size]))
+    output = np.concatenate(output)
+
+    change = slice(4 * block_size, 5 * block_size)
+    ramp = ((np.arange(block_size) + 1.0) / block_size)[:, np.newaxis]
+    npt.assert_allclose(output[:change.start], output_a[:change.start])
+    npt.assert_allclose(output[change],
+                        (1 - ramp) * output_a[change] + ramp * output_b[change])
+    npt.assert_allclose(output[change.stop:], output_b[change.stop:])
+
+
+def object_item(blocks):
+    """Object with blocks of (rtime, duration, azimuth, gain, width) in
+    seconds and degrees."""
+    return ObjectRenderingItem(
+        track_spec=DirectTrackSpec(0),
+        metadata_source=MetadataSourceIter([
+            ObjectTypeMetadata(block_format=AudioBlockFormatObjects(
+                rtime=Fraction(rtime),
+                duration=Fraction(duration),
+                position=ObjectPolarPosition(azimuth, 0.0, 1.0),
+                gain=gain,
+                width=width))
+            for rtime, duration, azimuth, gain, width in blocks
+        ]))
+
+
+def test_direct_hrir_objects(binaural_output_opts):
+    def convolver(hrir_objects):
+        return BinauralConvolver("0+5+0",
+                                 48000,
+                                 hrir_objects=hrir_objects,
+                                 **binaural_output_opts)
+
+    point = object_item([(0, 1, 30.0, 1.0, 0.0)])
+    extent = object_item([(0, 1, 30.0, 1.0, 0.0), (1, 1, 30.0, 1.0, 20.0)])
+
+    assert convolver("auto").direct_hrir_objects([point, extent]) == [point]
+    # 0+5+0 has 5 loudspeakers, so these are panned unless forced
+    assert convolver("auto").direct_hrir_objects([point] * 5) == []
+    assert convolver("direct").direct_hrir_objects([point] * 5) == [point] * 5
+    assert convolver("panned").direct_hrir_objects([point]) == []
+
+    # the converted blocks are checked, not the original ones
+    [cartesian] = convert_objects_to_cartesian([point])
+    [polar] = convert_objects_to_polar([point])
+    assert convolver("direct").direct_hrir_objects([cartesian]) == []
+    assert convolver("direct").direct_hrir_objects([polar]) == [polar]
+
+
+def render_stream(binaural_output_opts, items, hrir_objects):
+    """Render noise with BinauralStreamRenderer.
+
+    Returns:
+        array of (n, 2) floats: output
+        int: latency of the output
+    """
+    renderer = BinauralStreamRenderer(
+        "4+7+0",
+        48000,
+        block_size=512,
+        binaural_output_opts=dict(binaural_output_opts,
+                                  hrir_objects=hrir_objects))
+    renderer.set_rendering_items(items)
+
+    samples = np.random.RandomState(0).randn(512 * 24, 1)
+    return np.concatenate([
+        renderer.process(samples[start:start + 512]).copy()
+        for start in range(0, len(samples), 512)
+    ]), renderer.latency
+
+
+def test_matches_panned_at_loudspeakers(binaural_output_opts):
+    # M+030 and M-030, with a jump and a gain change
+    item = object_item([(0, 0.1, 30.0, 1.0, 0.0), (0.1, 0.1, 30.0, 0.5, 0.0),
+                        (0.2, 0.1, -30.0, 0.5, 0.0)])
+    direct, _ = render_stream(binaural_output_opts, [item], "direct")
+    panned, _ = render_stream(binaural_output_opts, [item], "panned")
+    npt.assert_allclose(direct[:int(0.2 * 48000)],
+                        panned[:int(0.2 * 48000)],
+                        atol=1e-10)
+    assert np.max(np.abs(direct)) > 0.1
+
+
+def test_moving_object(binaural_output_opts):
+    # an object moving between two loudspeakers is interpolated between the
+    # HRIRs without discontinuities
+    item = object_item([(0, 0.25, 0.0, 1.0, 0.0), (0.25, 0.25, 30.0, 1.0,
+                                                   0.0)])
+    direct, _ = render_stream(binaural_output_opts, [item], "direct")
+    panned, _ = render_stream(binaural_output_opts, [item], "panned")
+
+    def energy(x):
+        return np.sum(x**2)
+
+    assert energy(direct) == pytest.approx(energy(panned), rel=0.1)
+
+
+def test_offline_matches_stream(binaural_output_opts):
+    item = object_item([(0, 0.1, 10.0, 1.0, 0.0), (0.1, 0.1, 40.0, 0.5, 0.0)])
+
+    renderer = BinauralRenderer(None,
+                                "4+7+0",
+                                48000,
+                                object_renderer_opts=dict(block_size=512),
+                                binaural_output_opts=dict(binaural_output_opts,
+                                                          hrir_objects="direct"))
+    renderer.set_rendering_items([item])
+    samples = np.random.RandomState(0).randn(512 * 24, 1)
+    offline = np.concatenate([
+        renderer.render(48000, samples[start:start + 300])
+        for start in range(0, len(samples), 300)
+    ])
+
+    stream, latency = render_stream(binaural_output_opts, [item], "direct")
+    n = len(offline) - latency
+    npt.assert_allclose(offline[:n], stream[latency:latency + n], atol=1e-10)
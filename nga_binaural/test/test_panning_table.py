@@ -0,0 +1,72 @@
+import numpy as np
+import numpy.testing as npt
+import pytest
+from ear.core.geom import cart
+from nga_binaural import binaural_point_source, panning_table, sofa
+from nga_binaural.panning_table import PanningTable, get_panning_table
+
+
+def get_panner(name):
+    layout = sofa.get_binaural_layout(("binaural", name))
+    return layout, binaural_point_source.configure(layout)
+
+
+@pytest.mark.parametrize("name", ["BRIR", "binaural_direct"])
+def test_panning_table(name):
+    layout, panner = get_panner(name)
+    table = PanningTable.from_panner(panner, 5.0)
+    assert table.num_channels == len(layout.channels)
+
+    # exact on the grid
+    for az, el in [(-180, 0), (35, -20), (180, 90), (0, -90), (-5, 45)]:
+        npt.assert_allclose(table.handle(cart(az, el, 1.0)),
+                            panner.handle(cart(az, el, 1.0)),
+                            atol=1e-10)
+
+    # close elsewhere; the estimate is not a bound, but is close to the
+    # largest error found at many more points
+    errors = []
+    rng = np.random.RandomState(0)
+    for position in rng.randn(2000, 3):
+        pv = table.handle(position)
+        errors.append(np.max(np.abs(pv - panner.handle(position))))
+        npt.assert_allclose(np.linalg.norm(pv), 1.0)
+    assert max(errors) < 0.05
+    assert table.estimate_error(panner) == pytest.approx(max(errors), rel=0.2)
+
+
+def test_get_panning_table(tmpdir, monkeypatch):
+    layout, panner = get_panner("binaural_direct")
+    cache_dir = str(tmpdir.join("cache"))
+
+    monkeypatch.setattr(panning_table, "_tables", {})
+    table = get_panning_table(layout,
+                              panner,
+                              10.0,
+                              0.1,
+                              cache_dir=cache_dir,
+                              cache_max_size=2**20)
+    assert get_panning_table(layout, panner, 10.0, 0.1) is table
+
+    # loaded from the cache in a new process
+    monkeypatch.setattr(panning_table, "_tables", {})
+    cached = get_panning_table(layout,
+                               panner,
+                               10.0,
+                               0.1,
+                               cache_dir=cache_dir,
+                               cache_max_size=2**20)
+    assert isinstance(cached.gains, np.memmap)
+    npt.assert_array_equal(cached.gains, table.gains)
+    assert cached.estimated_error == table.estimated_error
+
+    with pytest.warns(UserWarning, match="using the point source panner"):
+        assert get_panning_table(layout, panner, 10.0, 1e-6) is None
+
+
+def test_configure():
+    layout, panner = get_panner("BRIR")
+    table = binaural_point_source.configure(layout,
+                                            panning_table_resolution=5.0)
+    assert isinstance(table, PanningTable)
+    assert table.num_channels == panner.num_channels
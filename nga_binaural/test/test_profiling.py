@@ -0,0 +1,71 @@
+import json
+import os.path
+import pytest
+from nga_binaural import cmdline, profiling
+
+files_dir = os.path.join(os.path.dirname(__file__), "data")
+bwf_file = os.path.join(files_dir, "test-input.wav")
+
+
+def test_disabled():
+    assert profiling.stage("a") is profiling.stage("b")
+    with profiling.stage("a"):
+        pass
+
+    items = [1, 2, 3]
+    assert list(profiling.timed_iter("a", items)) == items
+    profiling.add_audio(48000, 48000)
+
+
+def test_profile():
+    with profiling.profile() as profiler:
+        for i in range(3):
+            with profiling.stage("a"):
+                pass
+        with profiling.stage("a/b"):
+            pass
+        assert list(profiling.timed_iter("c", [1, 2])) == [1, 2]
+        profiling.add_audio(96000, 48000)
+
+    # disabled again after the with statement
+    with profiling.stage("a"):
+        pass
+
+    assert profiler.stages["a"][1] == 3
+    assert profiler.stages["a/b"][1] == 1
+    assert profiler.stages["c"][1] == 2
+    assert profiler.audio_duration == 2.0
+
+    report = profiler.report()
+    assert report["wall_time"] > 0
+    assert report["realtime_factor"] == report["wall_time"] / 2.0
+    assert report["stages"]["a"]["calls"] == 3
+    assert report["stages"]["a"]["mean"] == pytest.approx(
+        report["stages"]["a"]["time"] / 3)
+
+
+def test_profile_nested():
+    with profiling.profile():
+        with pytest.raises(AssertionError):
+            with profiling.profile():
+                pass
+
+
+def test_run(tmpdir, driver):
+    with profiling.profile() as profiler:
+        cmdline._run(driver, bwf_file, str(tmpdir.join("output.wav")), False)
+
+    report_file = str(tmpdir.join("report.json"))
+    profiler.write(report_file)
+    with open(report_file) as f:
+        report = json.load(f)
+
+    stages = report["stages"]
+    for name in ["adm", "setup", "read", "render", "write"]:
+        assert stages[name]["calls"] > 0
+    for path in ["brir", "hrir", "dirir"]:
+        assert (stages["render/convolve/" + path]["calls"] ==
+                stages["render"]["calls"])
+    assert any(name.startswith("render/objects/") for name in stages)
+    assert report["audio_duration"] > 0
+    assert report["realtime_factor"] > 0
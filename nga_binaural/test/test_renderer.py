@@ -0,0 +1,239 @@
+import os.path
+import numpy as np
+import numpy.testing as npt
+from ear.core.block_aligner import BlockAligner
+from ear.core.direct_speakers.renderer import DirectSpeakersRenderer
+from ear.core.metadata_input import ObjectRenderingItem, DirectSpeakersRenderingItem, HOARenderingItem
+from ear.core.metadata_processing import convert_objects_to_cartesian
+from ear.core.objectbased.renderer import ObjectRenderer
+from ear.core.scenebased.renderer import HOARenderer
+from ear.fileio import openBw64Adm
+from nga_binaural import profiling
+from nga_binaural.binaural_layout import BinauralOutput
+from nga_binaural.binaural_wrapper import BinauralWrapper
+from nga_binaural.renderer import BinauralRenderer, BinauralStreamRenderer
+
+files_dir = os.path.join(os.path.dirname(__file__), "data")
+bwf_file = os.path.join(files_dir, "test-input.wav")
+
+block_size = 4096
+
+
+def read_input(driver):
+    with openBw64Adm(bwf_file) as infile:
+        rendering_items = driver.get_rendering_items(infile.adm)
+        samples = np.concatenate(list(infile.iter_sample_blocks(block_size)))
+        return rendering_items, samples, infile.sampleRate
+
+
+def render_blocks(render, samples):
+    return [
+        render(samples[start:start + block_size])
+        for start in range(0, len(samples), block_size)
+    ]
+
+
+def test_renderer_matches_separate_wrappers(driver, binaural_output_opts):
+    rendering_items, samples, sr = read_input(driver)
+
+    # BinauralWrapper always pans objects on the HRIR path
+    renderer = BinauralRenderer(BinauralOutput(),
+                                None,
+                                sr=sr,
+                                binaural_output_opts=dict(
+                                    binaural_output_opts,
+                                    hrir_objects="panned"))
+    renderer.set_rendering_items(rendering_items)
+    with profiling.profile() as renderer_profiler:
+        output = np.concatenate(
+            render_blocks(lambda block: renderer.render(sr, block),
+                          samples))
+
+    # reference: one BinauralWrapper per type, each convolved separately
+    wrappers = []
+    for renderer_cls, item_cls in [
+        (ObjectRenderer, ObjectRenderingItem),
+        (DirectSpeakersRenderer, DirectSpeakersRenderingItem),
+        (HOARenderer, HOARenderingItem),
+    ]:
+        wrapper = BinauralWrapper(renderer_cls, BinauralOutput(), None, sr,
+                                  **binaural_output_opts)
+        wrapper.set_rendering_items([
+            item for item in rendering_items if isinstance(item, item_cls)
+        ])
+        wrappers.append(wrapper)
+
+    block_aligner = BlockAligner(2)
+    reference = []
+    with profiling.profile() as wrapper_profiler:
+        for start in range(0, len(samples), block_size):
+            block = samples[start:start + block_size]
+            block_aligner.add(start - wrappers[0].overall_delay,
+                              wrappers[0].render(sr, start, block))
+            for wrapper in wrappers[1:]:
+                block_aligner.add(start, wrapper.render(sr, start, block))
+            reference.append(block_aligner.get())
+    reference = np.concatenate(reference)
+
+    assert output.shape == reference.shape
+    npt.assert_allclose(output, reference, atol=1e-10)
+
+    # the EAR renderers are profiled with the same stage names, e.g.
+    # render/objects/hrir
+    def renderer_stages(profiler):
+        return set(name for name in profiler.stages
+                   if name.startswith("render/") and name.count("/") == 2
+                   and not name.startswith("render/convolve/"))
+
+    assert "render/objects/hrir" in renderer_stages(renderer_profiler)
+    assert "render/direct_speakers/brir" in renderer_stages(
+        renderer_profiler)
+    assert (renderer_stages(wrapper_profiler) == renderer_stages(
+        renderer_profiler))
+
+
+def test_skip_silent_paths(driver, binaural_output_opts):
+    rendering_items, samples, sr = read_input(driver)
+
+    # objects are panned, so are rendered on the HRIR path
+    renderer = BinauralRenderer(BinauralOutput(),
+                                None,
+                                sr=sr,
+                                binaural_output_opts=dict(
+                                    binaural_output_opts,
+                                    hrir_objects="panned"))
+    renderer.set_rendering_items(rendering_items)
+    blocks = render_blocks(lambda block: renderer.render(sr, block), samples)
+
+    # there are no HOA items or objects in the near field, and the
+    # DirectSpeakers have no direct path
+    skipped = renderer.skipped_blocks
+    assert skipped["hoa"] == dict(hrir=len(blocks),
+                                  brir=len(blocks),
+                                  dirir=len(blocks))
+    assert skipped["objects"]["dirir"] == len(blocks)
+    assert skipped["objects"]["hrir"] == 0
+    assert skipped["direct_speakers"]["dirir"] == len(blocks)
+    assert skipped["convolution"]["dirir"] > 0
+    assert skipped["convolution"]["hrir"] == 0
+
+
+def test_cartesian_objects_are_panned(driver, binaural_output_opts):
+    # the objects are converted to Cartesian as with --apply-conversion, so
+    # can not be rendered directly even though their ADM metadata is polar
+    rendering_items, samples, sr = read_input(driver)
+    rendering_items = convert_objects_to_cartesian(rendering_items)
+
+    def render(hrir_objects):
+        renderer = BinauralRenderer(BinauralOutput(),
+                                    None,
+                                    sr=sr,
+                                    binaural_output_opts=dict(
+                                        binaural_output_opts,
+                                        hrir_objects=hrir_objects))
+        renderer.set_rendering_items(rendering_items)
+        return np.concatenate(
+            render_blocks(lambda block: renderer.render(sr, block), samples))
+
+    npt.assert_allclose(render("direct"), render("panned"), atol=1e-10)
+
+
+def test_stream_renderer_matches_offline(driver, binaural_output_opts):
+    rendering_items, samples, sr = read_input(driver)
+    n = len(samples)
+
+    # objects rendered with ObjectHRIRRenderer depend on the block size, so
+    # are panned; see test_object_hrir for those
+    opts = dict(binaural_output_opts, hrir_objects="panned")
+
+    for item_cls in [ObjectRenderingItem, DirectSpeakersRenderingItem]:
+        items = [item for item in rendering_items if isinstance(item, item_cls)]
+
+        renderer = BinauralRenderer(BinauralOutput(),
+                                    None,
+                                    sr=sr,
+                                    binaural_output_opts=opts)
+        renderer.set_rendering_items(items)
+        offline = np.concatenate(
+            render_blocks(lambda block: renderer.render(sr, block), samples) +
+            [renderer.get_tail(sr, samples.shape[1])])
+        # DirectSpeakers are delayed by the convolution in the offline
+        # renderer, and the tail does not include their last block
+        if item_cls is DirectSpeakersRenderingItem:
+            offline = offline[renderer._binaural_convolver.block_size:]
+        offline = offline[:n]
+
+        stream = BinauralStreamRenderer(None,
+                                        sr,
+                                        block_size=128,
+                                        binaural_output_opts=opts)
+        stream.set_rendering_items(items)
+        n_blocks = -(-(n + stream.latency) // stream.block_size)
+        padded = np.zeros((n_blocks * stream.block_size, samples.shape[1]))
+        padded[:n] = samples
+        output = np.concatenate([
+            stream.process(padded[start:start + stream.block_size]).copy()
+            for start in range(0, len(padded), stream.block_size)
+        ])
+
+        assert np.max(np.abs(offline)) > 0
+        npt.assert_allclose(output[stream.latency:stream.latency +
+                                   len(offline)],
+                            offline,
+                            atol=1e-10)
+
+
+def test_float32_matches_float64(driver, binaural_output_opts):
+    rendering_items, samples, sr = read_input(driver)
+
+    outputs = []
+    for dtype in ["float64", "float32"]:
+        renderer = BinauralRenderer(BinauralOutput(),
+                                    None,
+                                    sr=sr,
+                                    binaural_output_opts=dict(
+                                        binaural_output_opts, dtype=dtype))
+        renderer.set_rendering_items(rendering_items)
+        outputs.append(
+            np.concatenate(
+                render_blocks(lambda block: renderer.render(sr, block),
+                              samples)))
+    reference, output = outputs
+
+    # well within one LSB of 16 bit output
+    assert np.max(np.abs(reference)) > 0
+    npt.assert_allclose(output, reference, atol=2.0**-20)
+
+
+def test_threads_match_sequential(driver, binaural_output_opts):
+    rendering_items, samples, sr = read_input(driver)
+
+    outputs = []
+    stream_outputs = []
+    for threads in [1, 3]:
+        opts = dict(binaural_output_opts, threads=threads)
+
+        renderer = BinauralRenderer(BinauralOutput(),
+                                    None,
+                                    sr=sr,
+                                    binaural_output_opts=opts)
+        renderer.set_rendering_items(rendering_items)
+        outputs.append(
+            np.concatenate(
+                render_blocks(lambda block: renderer.render(sr, block),
+                              samples)))
+
+        stream = BinauralStreamRenderer(None,
+                                        sr,
+                                        block_size=1024,
+                                        binaural_output_opts=opts)
+        stream.set_rendering_items(rendering_items)
+        stream_outputs.append(
+            np.concatenate([
+                stream.process(samples[start:start + 1024]).copy()
+                for start in range(0, len(samples) - 1023, 1024)
+            ]))
+
+    assert np.max(np.abs(outputs[0])) > 0
+    npt.assert_array_equal(outputs[1], outputs[0])
+    npt.assert_array_equal(stream_outputs[1], stream_outputs[0])
@@ -0,0 +1,102 @@
+from functools import partial
+import os.path
+import numpy as np
+import numpy.testing as npt
+import pytest
+from ear.fileio import openBw64, openBw64Adm
+from nga_binaural import cmdline, segmented
+from nga_binaural.head_tracking import HeadOrientationFile
+from nga_binaural.segmented import plan_segments, render_segment
+
+files_dir = os.path.join(os.path.dirname(__file__), "data")
+bwf_file = os.path.join(files_dir, "test-input.wav")
+
+
+@pytest.fixture
+def driver(driver):
+    # the test file is short, so use small blocks to get several segments
+    driver.blocksize = 512
+    return driver
+
+
+def render_sequential(driver):
+    spkr_layout, upmix, n_channels = driver.load_output_layout(driver)
+    with openBw64Adm(bwf_file) as infile:
+        return np.concatenate(
+            list(
+                cmdline._render_input_file_binaural(driver, infile,
+                                                    spkr_layout, None)))
+
+
+def test_plan_segments():
+    assert plan_segments(10, 4, 2) == [(0, 4), (4, 8), (8, 10)]
+    assert plan_segments(10, 3, 2) == [(0, 4), (4, 8), (8, 10)]
+    assert plan_segments(10, 0, 2) == [(0, 2), (2, 4), (4, 6), (6, 8),
+                                       (8, 10)]
+    assert plan_segments(3, 8, 4) == [(0, 3)]
+    assert plan_segments(0, 8, 4) == []
+
+
+def test_render_segment(tmpdir, monkeypatch, driver):
+    reference = render_sequential(driver)
+    n = len(reference)
+
+    monkeypatch.setattr(segmented, "_driver", driver)
+    # the last segments start after the warm-up period, so seek is used
+    for start, end in [(1024, 4096), (8192, 10240), (10240, n)]:
+        segment_file = render_segment(
+            (bwf_file, start, end, str(tmpdir.join("segment.npy"))))
+        segment = np.load(segment_file)
+        assert np.max(np.abs(reference[start:end])) > 0
+        npt.assert_array_equal(segment, reference[start:end])
+
+
+def test_run_segmented(tmpdir, driver):
+    reference_file = str(tmpdir.join("reference.wav"))
+    cmdline._run(driver, bwf_file, reference_file, False)
+
+    driver.render_input_file = partial(segmented.render_input_file_segmented,
+                                       input_file=bwf_file,
+                                       jobs=2,
+                                       segment_duration=4096 / 48000.0,
+                                       tmp_dir=str(tmpdir))
+    output_file = str(tmpdir.join("segmented.wav"))
+    cmdline._run(driver, bwf_file, output_file, False)
+
+    with openBw64(reference_file) as f:
+        reference = f.read(len(f))
+    with openBw64(output_file) as f:
+        output = f.read(len(f))
+    assert output.shape == reference.shape
+    npt.assert_array_equal(output, reference)
+
+    # the segments have been removed
+    assert sorted(os.listdir(str(tmpdir))) == [
+        "reference.wav", "segmented.wav"
+    ]
+
+
+def test_run_segmented_head_tracking(tmpdir, driver):
+    orientation_file = str(tmpdir.join("orientations.txt"))
+    with open(orientation_file, "w") as f:
+        f.write("0.0 0 0 0\n0.05 30 0 0\n0.15 -20 10 0\n")
+
+    driver.head_orientations = HeadOrientationFile(orientation_file)
+    driver.config["binaural_output_opts"]["head_tracking"] = True
+
+    reference_file = str(tmpdir.join("reference.wav"))
+    cmdline._run(driver, bwf_file, reference_file, False)
+
+    driver.render_input_file = partial(segmented.render_input_file_segmented,
+                                       input_file=bwf_file,
+                                       jobs=2,
+                                       segment_duration=4096 / 48000.0,
+                                       tmp_dir=str(tmpdir))
+    output_file = str(tmpdir.join("segmented.wav"))
+    cmdline._run(driver, bwf_file, output_file, False)
+
+    with openBw64(reference_file) as f:
+        reference = f.read(len(f))
+    with openBw64(output_file) as f:
+        output = f.read(len(f))
+    npt.assert_array_equal(output, reference)
@@ -0,0 +1,77 @@
+import numpy as np
+import numpy.testing as npt
+from ear.core import allocentric, bs2051
+from nga_binaural import binaural_point_source, sofa
+
+sofa_file = "resource:data/BRIR_KU100_60ms.sofa"
+
+
+def test_irs_for_positions_reads_selected_sources():
+    sofa_file_hrir = sofa.SOFAFileHRIR(sofa.load_hdf5(sofa_file))
+    layout = sofa.get_binaural_layout(("binaural", "BRIR"))
+    # include a repeated position, which should only be read once
+    positions = np.concatenate((layout.positions, layout.positions[:1]))
+
+    irs = sofa_file_hrir.irs_for_positions(positions)
+
+    sources = sofa_file_hrir.select_sources(positions, False)
+    receivers = sofa_file_hrir.select_receivers()
+    expected = np.array(sofa_file_hrir.f["Data.IR"])[np.ix_(
+        sources, receivers)]
+    npt.assert_array_equal(irs, expected)
+
+    ir_size = sofa_file_hrir.R * sofa_file_hrir.N * irs.itemsize
+    assert sofa_file_hrir.bytes_read == len(set(sources)) * ir_size
+    assert sofa_file_hrir.bytes_read < sofa_file_hrir.M * ir_size
+
+
+def test_source_index():
+    rng = np.random.RandomState(0)
+    measurements = rng.randn(500, 3)
+    index = sofa.SourceIndex(measurements * 2.0)
+    positions = rng.randn(50, 3)
+
+    directions = measurements / np.linalg.norm(measurements, axis=1,
+                                               keepdims=True)
+    position_directions = positions / np.linalg.norm(
+        positions, axis=1, keepdims=True)
+    expected = np.argmax(np.dot(position_directions, directions.T), axis=1)
+    npt.assert_array_equal(index.nearest(positions), expected)
+
+    idxes, weights = index.k_nearest(positions, k=3)
+    npt.assert_array_equal(idxes[:, 0], expected)
+    npt.assert_allclose(np.sum(weights, axis=1), 1.0)
+    assert np.all(np.diff(weights, axis=1) <= 0)
+
+    # positions on a measurement only use that measurement
+    idxes, weights = index.k_nearest(measurements[:4] * 3.0, k=3)
+    npt.assert_array_equal(idxes[:, 0], np.arange(4))
+    npt.assert_array_equal(weights[:, 0], 1.0)
+
+
+def test_source_index_cached():
+    a = sofa.SOFAFileHRIR(sofa.load_hdf5(sofa_file))
+    b = sofa.SOFAFileHRIR(sofa.load_hdf5(sofa_file))
+    assert a.source_index() is b.source_index()
+
+
+def test_layouts_loaded_once(monkeypatch):
+    loads = []
+
+    def load_binaural_layouts():
+        loads.append(None)
+        return original_load()
+
+    original_load = binaural_point_source._load_binaural_layouts
+    monkeypatch.setattr(binaural_point_source, "_load_binaural_layouts",
+                        load_binaural_layouts)
+    monkeypatch.setattr(binaural_point_source, "_layout_registry", {})
+
+    layout = sofa.get_binaural_layout(("binaural", "BRIR"))
+    assert sofa.get_binaural_layout(("binaural", "BRIR")) == layout
+    sofa.get_binaural_layout(("bs2051", "4+5+0"))
+    assert len(loads) == 1
+
+    # the binaural layouts replace the BS.2051 ones in the EAR
+    assert "BRIR" in bs2051.layout_names
+    assert "BRIR" in allocentric._allo_positions
@@ -8,21 +8,25 @@ setup(
     open('CHANGELOG.md').read(),
     long_description_content_type='text/markdown',
     install_requires=[
-        'numpy~=1.14', 'pydub>=0.23.1', 'scipy~=1.0', 'ear~=2.0.0',
+        'numpy~=1.14', 'scipy~=1.4', 'ear~=2.0.0',
         'h5py>=3.1.0'
     ],
-    extras_require={'test': [
-        'pytest',
-        'pytest-datafiles',
-        'pytest-cov',
-    ]},
-    packages=find_packages(),
+    extras_require={
+        'test': [
+            'pytest',
+            'pytest-datafiles',
+            'pytest-cov',
+        ],
+        'fftw': ['pyfftw'],
+    },
+    packages=find_packages(exclude=["nga_binaural.test"]),
     package_data={
         "nga_binaural": ["data/*"],
     },
     entry_points={
         'console_scripts': [
             'nga-binaural = nga_binaural.cmdline:render_file',
+            'nga-binaural-batch = nga_binaural.batch:render_batch',
         ]
     },
 )